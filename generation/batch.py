@@ -0,0 +1,323 @@
+"""
+Offline batch jobs for very large generation sweeps.
+
+Instead of one HTTP call per completion, requests are written to an OpenAI-compatible
+batch JSONL file ({"custom_id", "method", "url", "body"} per line), submitted through a
+BatchBackend, polled until the job is done, and the results handed back to the callers
+that are waiting on them.
+
+The generator's code path does not change: OpenRouterClient hands each upstream request
+(after the cache and coalescing, in place of the HTTP call) to a BatchCollector, which
+gathers concurrent requests into a job. Extraction, sandboxing and save_response run as
+usual on the results, so records match the online path; follow-up requests (repairs,
+truncation retries, cascade escalations) simply go into the next job.
+"""
+
+import abc
+import asyncio
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import aiohttp
+
+from lm_client import OPENROUTER_ONLY_FIELDS, OpenRouterError, _raise_for_error_body
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_DIR = os.path.join(os.path.dirname(__file__), '../data/batches')
+CHAT_COMPLETIONS_URL = "/v1/chat/completions"
+
+# Job states as reported by the OpenAI batch API
+BATCH_DONE_STATES = frozenset({"completed"})
+BATCH_FAILED_STATES = frozenset({"failed", "expired", "cancelled"})
+
+
+def batch_line(custom_id: str, payload: dict) -> dict:
+    """One line of a batch input file"""
+    return {"custom_id": custom_id, "method": "POST", "url": CHAT_COMPLETIONS_URL, "body": payload}
+
+
+def result_line(custom_id: str, body: Optional[dict] = None, status_code: int = 200,
+                error: Optional[str] = None) -> dict:
+    """One line of a batch output file (what a backend writes for each request)"""
+    if error is not None:
+        return {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": custom_id, "response": None,
+                "error": {"code": status_code, "message": error}}
+    return {"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": custom_id,
+            "response": {"status_code": status_code, "body": body}, "error": None}
+
+
+def parse_result_line(line: dict) -> dict:
+    """The chat completion of an output line; raises OpenRouterError for failed requests"""
+    error = line.get("error")
+    response = line.get("response") or {}
+    if error:
+        code = error.get("code")
+        raise OpenRouterError(code if isinstance(code, int) else 500, str(error.get("message", error)))
+    if response.get("status_code") != 200:
+        raise OpenRouterError(response.get("status_code") or 500, json.dumps(response.get("body")))
+    data = response.get("body") or {}
+    _raise_for_error_body(data)
+    if not data.get("choices"):
+        raise OpenRouterError(502, "Response contained no choices")
+    return data
+
+
+class BatchBackend(abc.ABC):
+    """Where batch files are submitted: a provider's batch API or a local stand-in"""
+
+    @abc.abstractmethod
+    async def submit(self, input_path: str) -> str:
+        """Submit a batch input file; returns a job id"""
+
+    @abc.abstractmethod
+    async def status(self, job_id: str) -> str:
+        """Job state, e.g. "in_progress", "completed" or "failed" """
+
+    @abc.abstractmethod
+    async def download(self, job_id: str, output_path: str):
+        """Write the job's output file (one result line per request) to output_path"""
+
+    async def close(self):
+        pass
+
+
+class LocalBatchBackend(BatchBackend):
+    """
+    File-based stand-in for a provider batch service
+    Each job is a directory holding input.jsonl, status.json and output.jsonl. Jobs are run
+    in the background by sending every request through `send` (e.g. an online client's
+    single-request path), at most `concurrency` at a time.
+    """
+    def __init__(self, send: Callable[[dict], Awaitable[dict]], directory: str = DEFAULT_BATCH_DIR,
+                 concurrency: int = 16):
+        self.send = send
+        self.directory = os.path.abspath(directory)
+        self.concurrency = concurrency
+        self._jobs: Dict[str, asyncio.Task] = {}
+
+    def _job_dir(self, job_id: str) -> str:
+        return os.path.join(self.directory, job_id)
+
+    def _write_status(self, job_id: str, state: str):
+        with open(os.path.join(self._job_dir(job_id), "status.json"), 'w', encoding='utf-8') as f:
+            json.dump({"status": state, "updated": time.time()}, f)
+
+    async def submit(self, input_path: str) -> str:
+        job_id = f"local_batch_{uuid.uuid4().hex[:12]}"
+        os.makedirs(self._job_dir(job_id))
+        shutil.copyfile(input_path, os.path.join(self._job_dir(job_id), "input.jsonl"))
+        self._write_status(job_id, "in_progress")
+        self._jobs[job_id] = asyncio.ensure_future(self._run(job_id))
+        return job_id
+
+    async def _run(self, job_id: str):
+        with open(os.path.join(self._job_dir(job_id), "input.jsonl"), 'r', encoding='utf-8') as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_one(request: dict) -> dict:
+            async with semaphore:
+                try:
+                    return result_line(request["custom_id"], await self.send(request["body"]))
+                except OpenRouterError as e:
+                    return result_line(request["custom_id"], status_code=e.status, error=e.message)
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    return result_line(request["custom_id"], status_code=503, error=str(e) or type(e).__name__)
+
+        try:
+            results = await asyncio.gather(*(run_one(request) for request in requests))
+        except Exception as e:
+            logger.error(f"Local batch job {job_id} failed: {e}")
+            self._write_status(job_id, "failed")
+            return
+        with open(os.path.join(self._job_dir(job_id), "output.jsonl"), 'w', encoding='utf-8') as f:
+            for line in results:
+                f.write(json.dumps(line) + '\n')
+        self._write_status(job_id, "completed")
+
+    async def status(self, job_id: str) -> str:
+        with open(os.path.join(self._job_dir(job_id), "status.json"), 'r', encoding='utf-8') as f:
+            return json.load(f)["status"]
+
+    async def download(self, job_id: str, output_path: str):
+        shutil.copyfile(os.path.join(self._job_dir(job_id), "output.jsonl"), output_path)
+
+    async def close(self):
+        for task in self._jobs.values():
+            task.cancel()
+        await asyncio.gather(*self._jobs.values(), return_exceptions=True)
+
+
+class OpenAIBatchBackend(BatchBackend):
+    """
+    The OpenAI-compatible batch API: upload the file to /files, create a /batches job,
+    poll it and fetch the output file's content
+    """
+    # OpenRouter-only request fields that OpenAI-style batch endpoints reject
+    UNSUPPORTED_FIELDS = OPENROUTER_ONLY_FIELDS
+
+    def __init__(self, base_url: str, api_key: str, completion_window: str = "24h"):
+        self.base_url = base_url.rstrip("/")
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        self.completion_window = completion_window
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(headers=self.headers)
+        return self._session
+
+    async def _json(self, method: str, path: str, **kwargs) -> dict:
+        async with self._get_session().request(method, f"{self.base_url}{path}", **kwargs) as response:
+            if response.status != 200:
+                raise OpenRouterError(response.status, await response.text())
+            return await response.json()
+
+    async def submit(self, input_path: str) -> str:
+        with open(input_path, 'r', encoding='utf-8') as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        for line in lines:
+            for field in self.UNSUPPORTED_FIELDS:
+                line["body"].pop(field, None)
+        form = aiohttp.FormData()
+        form.add_field("purpose", "batch")
+        form.add_field("file", "".join(json.dumps(line) + "\n" for line in lines).encode("utf-8"),
+                       filename=os.path.basename(input_path), content_type="application/jsonl")
+        uploaded = await self._json("POST", "/files", data=form)
+        job = await self._json("POST", "/batches", json={
+            "input_file_id": uploaded["id"],
+            "endpoint": CHAT_COMPLETIONS_URL,
+            "completion_window": self.completion_window
+        })
+        return job["id"]
+
+    async def status(self, job_id: str) -> str:
+        return (await self._json("GET", f"/batches/{job_id}"))["status"]
+
+    async def download(self, job_id: str, output_path: str):
+        job = await self._json("GET", f"/batches/{job_id}")
+        with open(output_path, 'w', encoding='utf-8') as out:
+            for file_id in (job.get("output_file_id"), job.get("error_file_id")):
+                if not file_id:
+                    continue
+                async with self._get_session().get(f"{self.base_url}/files/{file_id}/content") as response:
+                    if response.status != 200:
+                        raise OpenRouterError(response.status, await response.text())
+                    out.write(await response.text())
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+class BatchCollector:
+    """
+    Gathers upstream requests from concurrent callers into batch jobs
+    A job is submitted once `max_batch_size` requests are waiting, or when no new request
+    arrived for `linger` seconds (everyone who will ask has asked). Jobs are polled every
+    `poll_interval` seconds; each caller then gets its completion or an OpenRouterError.
+    Input and output files are kept in `directory`.
+    """
+    def __init__(self, backend: BatchBackend, directory: str = DEFAULT_BATCH_DIR, max_batch_size: int = 50000,
+                 linger: float = 0.5, poll_interval: float = 30.0):
+        self.backend = backend
+        self.directory = os.path.abspath(directory)
+        self.max_batch_size = max_batch_size
+        self.linger = linger
+        self.poll_interval = poll_interval
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._jobs: List[asyncio.Task] = []
+        self.jobs_submitted = 0
+        self.requests_submitted = 0
+        self.failed_requests = 0
+
+    async def request(self, payload: dict) -> dict:
+        """Queue one chat completion payload and wait for its result from a batch job"""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((payload, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        else:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = asyncio.get_running_loop().call_later(self.linger, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        entries = [(payload, future) for payload, future in self._pending if not future.done()]
+        self._pending = []
+        if entries:
+            self._jobs.append(asyncio.ensure_future(self._run_job(entries)))
+
+    async def _run_job(self, entries: List[Tuple[dict, asyncio.Future]]):
+        self.jobs_submitted += 1
+        self.requests_submitted += len(entries)
+        name = f"batch-{int(time.time())}-{self.jobs_submitted}"
+        os.makedirs(self.directory, exist_ok=True)
+        input_path = os.path.join(self.directory, f"{name}-input.jsonl")
+        output_path = os.path.join(self.directory, f"{name}-output.jsonl")
+        futures = {}
+        with open(input_path, 'w', encoding='utf-8') as f:
+            for i, (payload, future) in enumerate(entries):
+                custom_id = f"request-{i}"
+                futures[custom_id] = future
+                f.write(json.dumps(batch_line(custom_id, payload)) + '\n')
+        try:
+            job_id = await self.backend.submit(input_path)
+            logger.info(f"Submitted batch job {job_id} with {len(entries)} requests ({input_path})")
+            while True:
+                state = await self.backend.status(job_id)
+                if state in BATCH_DONE_STATES:
+                    break
+                if state in BATCH_FAILED_STATES:
+                    raise OpenRouterError(502, f"Batch job {job_id} ended as {state}")
+                await asyncio.sleep(self.poll_interval)
+            await self.backend.download(job_id, output_path)
+            with open(output_path, 'r', encoding='utf-8') as f:
+                results = [json.loads(line) for line in f if line.strip()]
+        except Exception as e:
+            for future in futures.values():
+                if not future.done():
+                    future.set_exception(e)
+            self.failed_requests += len(futures)
+            return
+
+        for line in results:
+            future = futures.pop(line.get("custom_id"), None)
+            if future is None or future.done():
+                continue  # unknown id, or the caller was cancelled meanwhile
+            try:
+                future.set_result(parse_result_line(line))
+            except OpenRouterError as e:
+                self.failed_requests += 1
+                future.set_exception(e)
+        for future in futures.values():
+            if not future.done():
+                self.failed_requests += 1
+                future.set_exception(OpenRouterError(502, "Request missing from batch output"))
+
+    async def close(self):
+        """Cancel running jobs and anything still queued"""
+        if self._timer is not None:
+            self._timer.cancel()
+        for _, future in self._pending:
+            future.cancel()
+        self._pending = []
+        for task in self._jobs:
+            task.cancel()
+        await asyncio.gather(*self._jobs, return_exceptions=True)
+        await self.backend.close()
+
+    def __str__(self) -> str:
+        return (f"BatchCollector(jobs={self.jobs_submitted}, requests={self.requests_submitted}, "
+                f"failed={self.failed_requests})")
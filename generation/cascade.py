@@ -0,0 +1,81 @@
+"""
+Model cascade: try cheap models first and escalate only when their answer fails a check.
+
+A response is generated with each model of the cascade in turn until one passes the
+configured check on the sample tests; the last model's answer is kept either way.
+Easy problems are then solved by the cheap models, and the expensive one is only paid
+for the problems that need it.
+"""
+
+from collections import defaultdict
+from typing import Any, Callable, Dict, List
+
+
+def answer_parsed(response: Dict[str, Any]) -> bool:
+    """An answer was extracted: a code block for the naive coder, outputs for the reasoner"""
+    outputs = response["generated_outputs"]
+    if response["type"] == "reasoning":
+        return not all(output == "N/A" for output in outputs)
+    return "NO_CODE_EXTRACTED" not in outputs
+
+
+def answer_ran(response: Dict[str, Any]) -> bool:
+    """The answer was parsed and (naive coder) the code ran without errors"""
+    return answer_parsed(response) and not any(str(output).startswith("ERROR") for output in response["generated_outputs"])
+
+
+def answer_correct(response: Dict[str, Any]) -> bool:
+    """Every sample test case matched its expected output"""
+    matrix = response["confusion_matrix"]
+    return answer_ran(response) and matrix.get("true_positives", 0) == len(response["expected_outputs"])
+
+
+CASCADE_CHECKS: Dict[str, Callable[[Dict[str, Any]], bool]] = {
+    "parsed": answer_parsed,
+    "ran": answer_ran,
+    "correct": answer_correct
+}
+
+
+class CascadeStats:
+    """Per persona and model: how many responses were attempted and how many passed the check"""
+    def __init__(self):
+        self.attempts: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.passed: Dict[str, Dict[str, int]] = defaultdict(lambda: defaultdict(int))
+        self.responses: Dict[str, int] = defaultdict(int)
+        self.escalated: Dict[str, int] = defaultdict(int)
+
+    def record(self, persona: str, attempts: List[Dict[str, Any]]):
+        """Record the attempts of one cascaded response (dicts with "model" and "passed")"""
+        self.responses[persona] += 1
+        self.escalated[persona] += int(len(attempts) > 1)
+        for attempt in attempts:
+            self.attempts[persona][attempt["model"]] += 1
+            self.passed[persona][attempt["model"]] += int(attempt["passed"])
+
+    def escalation_rate(self, persona: str) -> float:
+        """Fraction of responses that needed more than the first model"""
+        return self.escalated[persona] / self.responses[persona] if self.responses[persona] else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            persona: {
+                'responses': self.responses[persona],
+                'escalation_rate': self.escalation_rate(persona),
+                'models': {
+                    model: {'attempts': count, 'passed': self.passed[persona][model]}
+                    for model, count in self.attempts[persona].items()
+                }
+            }
+            for persona in self.responses
+        }
+
+    def __str__(self) -> str:
+        if not self.responses:
+            return "CascadeStats(no responses)"
+        parts = []
+        for persona, values in sorted(self.to_dict().items()):
+            models = ", ".join(f"{model} {counts['passed']}/{counts['attempts']}"
+                               for model, counts in values['models'].items())
+            parts.append(f"{persona}: {models} passed ({values['escalation_rate']:.0%} escalated)")
+        return "CascadeStats(" + "; ".join(parts) + ")"
@@ -0,0 +1,151 @@
+"""
+Content-addressed on-disk cache for LLM completions.
+
+Entries are keyed by a SHA-256 of (base_url, model, messages, sampling params) and
+stored one JSON file per entry under a two-level fan-out directory. Writes go through
+a temp file and os.replace so concurrent processes never see partial entries; reads
+refresh the file mtime, which is what size-based LRU eviction orders by.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+try:
+    import fcntl
+    HAS_FCNTL = True
+except ImportError:
+    HAS_FCNTL = False
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), '../data/completion_cache')
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3  # 2 GB
+
+# Payload fields that do not change the completion and are left out of the key
+NON_SEMANTIC_FIELDS = frozenset({"stream", "stream_options"})
+
+
+def request_fingerprint(base_url: str, payload: Dict[str, Any]) -> str:
+    """Stable hash of everything that determines a completion"""
+    key = {"base_url": base_url.rstrip("/")}
+    key.update({k: v for k, v in payload.items() if k not in NON_SEMANTIC_FIELDS})
+    canonical = json.dumps(key, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class CompletionCache:
+    """
+    Persistent completion cache with size-based LRU eviction
+    Safe to share between processes on one host: entries are written atomically and
+    eviction runs under an exclusive lock file (where fcntl is available)
+    """
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES, enabled: bool = True):
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._bytes_since_check = 0
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return the cached response for a key, or None on a miss"""
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError, OSError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)  # mark as recently used
+        except OSError:
+            pass
+        self.hits += 1
+        return entry["response"]
+
+    def put(self, key: str, response: Dict[str, Any]):
+        """Store a response atomically and evict old entries if the cache is over budget"""
+        if not self.enabled:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps({"created": time.time(), "response": response}, ensure_ascii=False)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Failed to write completion cache entry {key}: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            return
+        self.writes += 1
+        self._bytes_since_check += len(data)
+        # Scanning the directory is not free, so only check after ~1% of the budget was written
+        if self._bytes_since_check >= self.max_bytes // 100:
+            self._bytes_since_check = 0
+            self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        lock_path = os.path.join(self.directory, ".lock")
+        with open(lock_path, 'w') as lock_file:
+            if HAS_FCNTL:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            entries = []
+            total = 0
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if not name.endswith(".json"):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue  # removed by another process
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.unlink(path)
+                    self.evictions += 1
+                except FileNotFoundError:
+                    pass
+                total -= size
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'writes': self.writes,
+            'evictions': self.evictions
+        }
+
+    def __str__(self) -> str:
+        if not self.enabled:
+            return "CompletionCache(disabled)"
+        stats = self.stats()
+        return (f"CompletionCache(hits={stats['hits']}, misses={stats['misses']}, "
+                f"hit_rate={stats['hit_rate']:.1%}, writes={stats['writes']}, evictions={stats['evictions']})")
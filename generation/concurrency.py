@@ -0,0 +1,144 @@
+"""
+Adaptive concurrency control for LLM API calls.
+
+AdaptiveConcurrencyLimiter bounds the number of in-flight requests with an
+additive-increase/multiplicative-decrease (AIMD) rule: the limit grows slowly while
+requests succeed with healthy latency, and is cut sharply on overload signals
+(429s, 503/529s and timeouts).
+"""
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Statuses that mean the provider wants us to send less
+OVERLOAD_STATUSES = frozenset({429, 503, 529})
+
+
+def is_overload(exc: BaseException) -> bool:
+    """True if an error signals that the provider is overloaded or throttling us"""
+    status = getattr(exc, 'status', None)
+    if status is not None:
+        return status in OVERLOAD_STATUSES
+    return isinstance(exc, asyncio.TimeoutError)
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    AIMD limiter for in-flight requests
+
+    - Each success with latency under `latency_tolerance` x the running average adds
+      `increase / limit`, so the limit grows by about `increase` per full window
+    - Each overload multiplies the limit by `decrease_factor`, at most once per `cooldown`
+      seconds so that one burst of 429s only counts once
+    - Other errors leave the limit unchanged
+    """
+    def __init__(
+        self,
+        initial_limit: int = 4,
+        min_limit: int = 1,
+        max_limit: int = 64,
+        increase: float = 1.0,
+        decrease_factor: float = 0.5,
+        latency_tolerance: float = 2.0,
+        cooldown: float = 1.0
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.successes = 0
+        self.overloads = 0
+        self.errors = 0
+        self.average_latency: Optional[float] = None
+        self.history: List[Tuple[float, int, str]] = [(time.time(), int(self.limit), "initial")]
+        self._last_decrease = 0.0
+        self._condition: Optional[asyncio.Condition] = None
+
+    def _get_condition(self) -> asyncio.Condition:
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        return self._condition
+
+    async def acquire(self):
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    async def release(self, latency: float, error: Optional[BaseException] = None):
+        """Release a slot and adapt the limit from the request outcome"""
+        condition = self._get_condition()
+        async with condition:
+            self.in_flight -= 1
+            previous = int(self.limit)
+            if isinstance(error, (asyncio.CancelledError, GeneratorExit)):
+                pass  # abandoned by the caller, says nothing about provider health
+            elif error is None:
+                self._on_success(latency)
+            elif is_overload(error):
+                self._on_overload()
+            else:
+                self.errors += 1
+            if int(self.limit) != previous:
+                reason = "increase" if int(self.limit) > previous else "decrease"
+                self.history.append((time.time(), int(self.limit), reason))
+            condition.notify_all()
+
+    def _on_success(self, latency: float):
+        self.successes += 1
+        healthy = self.average_latency is None or latency <= self.latency_tolerance * self.average_latency
+        self.average_latency = latency if self.average_latency is None else 0.9 * self.average_latency + 0.1 * latency
+        if healthy:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+    def _on_overload(self):
+        self.overloads += 1
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one in-flight slot for the duration of a request"""
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            await self.release(time.monotonic() - start, e)
+            raise
+        else:
+            await self.release(time.monotonic() - start)
+
+    def metrics(self) -> dict:
+        """Current limit, counters and the history of limit changes"""
+        return {
+            'limit': int(self.limit),
+            'in_flight': self.in_flight,
+            'peak_in_flight': self.peak_in_flight,
+            'successes': self.successes,
+            'overloads': self.overloads,
+            'errors': self.errors,
+            'average_latency': self.average_latency,
+            'history': list(self.history)
+        }
+
+    def __str__(self) -> str:
+        limits = [limit for _, limit, _ in self.history]
+        return (f"AdaptiveConcurrencyLimiter(limit={int(self.limit)}, range={min(limits)}-{max(limits)}, "
+                f"peak_in_flight={self.peak_in_flight}, successes={self.successes}, "
+                f"overloads={self.overloads}, errors={self.errors}, changes={len(self.history) - 1})")
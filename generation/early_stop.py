@@ -0,0 +1,131 @@
+"""
+Early termination for completions whose answer is already complete.
+
+The reasoner is done once its ```json outputs block closes (parse_reasoner_response
+reads the first one); anything after that is commentary we discard. Stop sequences let
+the provider end generation there, and on the streaming path an AnswerDetector closes
+the stream as soon as the answer is complete (covering providers that ignore `stop`).
+Savings are estimated from calibration responses that run to completion and show how
+much text usually follows the answer.
+
+The naive coder always runs to completion: extract_code grades its last ```python
+block, and neither a stop sequence nor a streaming check can tell whether a closed
+block is the final one or a draft that a later block replaces.
+"""
+
+import re
+import zlib
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from rate_limiter import CHARS_PER_TOKEN
+
+# Sent as `stop`; the provider omits the matched text, restore_stop_sequence puts the fence back.
+# The end of the outputs array is part of it, so a code block ending in "}" does not match.
+REASONER_STOP_SEQUENCES = ["]\n}\n```"]
+
+_JSON_BLOCK = re.compile(r"```json\s*(\{.*?\})\s*```", re.DOTALL)
+
+
+def json_block_end(text: str) -> Optional[int]:
+    """Index just past the first closed ```json block (the one parse_reasoner_response reads), or None"""
+    match = _JSON_BLOCK.search(text)
+    return match.end() if match else None
+
+
+def restore_stop_sequence(text: str, stop_sequences: List[str], finish_reason: Optional[str] = "stop") -> str:
+    """
+    Close a code fence that was cut off by a stop sequence (an odd number of ``` means one is open)
+    Only a reply that finished with "stop" can have been cut by one; a truncated reply is left as is
+    """
+    if not stop_sequences or finish_reason != "stop" or text.count("```") % 2 == 0:
+        return text
+    return text + stop_sequences[0].rstrip("\n")
+
+
+class AnswerDetector:
+    """
+    Streaming stop hook: called with the accumulated content after each delta
+    Only rescans when a backtick arrived, so long responses are not re-parsed per delta
+    """
+    def __init__(self, answer_end: Callable[[str], Optional[int]]):
+        self.answer_end = answer_end
+        self._checked = 0
+
+    def __call__(self, text: str) -> bool:
+        if "`" not in text[self._checked:]:
+            self._checked = len(text)
+            return False
+        self._checked = len(text)
+        return self.answer_end(text) is not None
+
+
+def is_calibration_sample(key: str, rate: float) -> bool:
+    """Deterministic choice of responses that run without early stopping (stable across re-runs)"""
+    return zlib.crc32(key.encode("utf-8")) % 10000 < rate * 10000
+
+
+@dataclass
+class _PersonaStats:
+    completions: int = 0
+    stopped: int = 0
+    calibration_samples: int = 0
+    tail_tokens: float = 0.0  # total text after the answer in calibration samples
+    tail_seconds: float = 0.0
+
+
+class EarlyStopStats:
+    """Per-persona count of early stops and the estimated tokens/seconds they saved"""
+    def __init__(self):
+        self.personas: Dict[str, _PersonaStats] = defaultdict(_PersonaStats)
+
+    def record_stopped(self, persona: str, stopped: bool):
+        stats = self.personas[persona]
+        stats.completions += 1
+        stats.stopped += int(stopped)
+
+    def record_calibration(self, persona: str, text: str, answer_end: Callable[[str], Optional[int]],
+                           tokens_per_second: Optional[float] = None):
+        """Measure how much a full (not stopped) response kept generating after its answer"""
+        stats = self.personas[persona]
+        stats.completions += 1
+        end = answer_end(text)
+        if end is None:
+            return
+        tail_tokens = (len(text) - end) / CHARS_PER_TOKEN
+        stats.calibration_samples += 1
+        stats.tail_tokens += tail_tokens
+        if tokens_per_second:
+            stats.tail_seconds += tail_tokens / tokens_per_second
+
+    def estimated_savings(self, persona: str) -> tuple:
+        """(tokens, seconds) saved: early stops times the mean tail seen in calibration samples"""
+        stats = self.personas[persona]
+        if not stats.calibration_samples:
+            return 0.0, 0.0
+        return (stats.stopped * stats.tail_tokens / stats.calibration_samples,
+                stats.stopped * stats.tail_seconds / stats.calibration_samples)
+
+    def to_dict(self) -> dict:
+        result = {}
+        for persona, stats in self.personas.items():
+            tokens, seconds = self.estimated_savings(persona)
+            result[persona] = {
+                'completions': stats.completions,
+                'stopped': stats.stopped,
+                'calibration_samples': stats.calibration_samples,
+                'estimated_tokens_saved': tokens,
+                'estimated_seconds_saved': seconds
+            }
+        return result
+
+    def __str__(self) -> str:
+        if not self.personas:
+            return "EarlyStopStats(no completions)"
+        parts = []
+        for persona, values in sorted(self.to_dict().items()):
+            parts.append(f"{persona}: {values['stopped']}/{values['completions']} stopped early, "
+                         f"~{values['estimated_tokens_saved']:.0f} tokens / ~{values['estimated_seconds_saved']:.1f}s saved "
+                         f"(from {values['calibration_samples']} calibration samples)")
+        return "EarlyStopStats(" + "; ".join(parts) + ")"
@@ -0,0 +1,200 @@
+"""
+Upstream endpoint pool for the LLM client.
+
+An Endpoint is one (base_url, api_key) pair: an OpenRouter key, or any
+OpenAI-compatible server. EndpointPool routes each attempt to a healthy endpoint
+by weight (scaled down for endpoints that are slower than the fastest one) and
+keeps a circuit breaker per endpoint so failing keys or providers are skipped
+until they recover.
+"""
+
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Statuses that mean this endpoint (its key or provider) is unusable right now,
+# even though the same request could succeed elsewhere
+ENDPOINT_FAULT_STATUSES = frozenset({401, 402, 403})
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive failures
+    Open -> half-open after `reset_timeout` seconds, when the next request is routed as a trial
+    Half-open -> closed on success, back to open on failure; a trial that ends without
+    an answer (cancelled) is released so the next request can be the trial instead
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.times_opened = 0
+        self._trial_in_flight = False
+
+    def _reset_elapsed(self) -> bool:
+        return self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout
+
+    def available(self) -> bool:
+        """Whether a request may be routed here (no side effects)"""
+        if self.state == self.CLOSED:
+            return True
+        if self._reset_elapsed():
+            return True
+        return self.state == self.HALF_OPEN and not self._trial_in_flight
+
+    def on_routed(self):
+        """Called when a request is actually sent; a half-open breaker admits only one trial"""
+        if self._reset_elapsed():
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self._trial_in_flight = True
+
+    def release_trial(self):
+        """The trial ended without telling anything about the endpoint (e.g. cancelled); allow another"""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.state = self.CLOSED
+        self._trial_in_flight = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.times_opened += 1
+                logger.warning(f"Circuit opened after {self.consecutive_failures} consecutive failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._trial_in_flight = False
+
+
+@dataclass(eq=False)
+class Endpoint:
+    """One upstream: base URL, API key and routing weight (compared by identity)"""
+    base_url: str
+    api_key: str
+    weight: float = 1.0
+    name: Optional[str] = None
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+    requests: int = 0
+    failures: int = 0
+    average_latency: Optional[float] = None
+
+    def __post_init__(self):
+        self.base_url = self.base_url.rstrip("/")
+        if self.name is None:
+            self.name = f"{self.base_url}#{self.api_key[-4:] if self.api_key else ''}"
+
+    @property
+    def is_openrouter(self) -> bool:
+        """Whether this is OpenRouter itself, which accepts its own request fields (see OPENROUTER_ONLY_FIELDS)"""
+        return "openrouter.ai" in self.base_url
+
+    @property
+    def headers(self) -> dict:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+
+    def record_success(self, latency: float):
+        self.requests += 1
+        self.breaker.record_success()
+        self.average_latency = latency if self.average_latency is None else 0.8 * self.average_latency + 0.2 * latency
+
+    def record_failure(self):
+        self.requests += 1
+        self.failures += 1
+        self.breaker.record_failure()
+
+    def record_cancelled(self):
+        """An attempt was abandoned before it answered: not a failure, but it no longer holds the trial"""
+        self.breaker.release_trial()
+
+
+class EndpointPool:
+    """Weighted, health-aware routing across endpoints"""
+    def __init__(self, endpoints: Iterable[Endpoint], rng: Optional[random.Random] = None):
+        self.endpoints: List[Endpoint] = list(endpoints)
+        if not self.endpoints:
+            raise ValueError("EndpointPool needs at least one endpoint")
+        self.random = rng or random.Random()
+        self.failovers = 0
+
+    def _effective_weight(self, endpoint: Endpoint, fastest: Optional[float]) -> float:
+        # Slow endpoints keep some traffic (so recovery is noticed) but proportionally less
+        if fastest and endpoint.average_latency:
+            return endpoint.weight * fastest / endpoint.average_latency
+        return endpoint.weight
+
+    def choose(self, exclude: Iterable[Endpoint] = ()) -> Endpoint:
+        """
+        Pick an endpoint whose breaker allows traffic, skipping `exclude` when possible
+        If every breaker is open the endpoint that opened longest ago is used anyway,
+        so a run degrades to retries instead of stalling
+        """
+        excluded = set(id(e) for e in exclude)
+        candidates = [e for e in self.endpoints if id(e) not in excluded] or self.endpoints
+        allowed = [e for e in candidates if e.breaker.available()]
+        if not allowed:
+            return min(candidates, key=lambda e: e.breaker.opened_at)
+        latencies = [e.average_latency for e in allowed if e.average_latency]
+        fastest = min(latencies) if latencies else None
+        weights = [self._effective_weight(e, fastest) for e in allowed]
+        chosen = self.random.choices(allowed, weights=weights, k=1)[0]
+        chosen.breaker.on_routed()
+        return chosen
+
+    def has_alternative(self, endpoint: Endpoint, exclude: Iterable[Endpoint] = ()) -> bool:
+        """True if some other endpoint not in `exclude` is currently usable"""
+        excluded = set(id(e) for e in exclude) | {id(endpoint)}
+        return any(id(e) not in excluded and e.breaker.available() for e in self.endpoints)
+
+    def stats(self) -> List[dict]:
+        return [{
+            'name': e.name,
+            'weight': e.weight,
+            'requests': e.requests,
+            'failures': e.failures,
+            'state': e.breaker.state,
+            'times_opened': e.breaker.times_opened,
+            'average_latency': e.average_latency
+        } for e in self.endpoints]
+
+    def __str__(self) -> str:
+        parts = [f"{e.name}: {e.requests} req, {e.failures} failed, {e.breaker.state}" for e in self.endpoints]
+        return f"EndpointPool(failovers={self.failovers}; " + "; ".join(parts) + ")"
+
+
+def load_endpoints(path: str) -> List[Endpoint]:
+    """
+    Load endpoints from a JSON list such as
+    [{"base_url": "https://openrouter.ai/api/v1", "api_key_env": "OPENROUTER_API_KEY", "weight": 2},
+     {"base_url": "http://localhost:8000/v1", "api_key": "local", "name": "vllm"}]
+    `api_key_env` names an environment variable so keys stay out of the file
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        entries = json.load(f)
+    endpoints = []
+    for entry in entries:
+        api_key = entry.get("api_key") or os.getenv(entry.get("api_key_env", ""), "")
+        endpoints.append(Endpoint(
+            base_url=entry["base_url"],
+            api_key=api_key,
+            weight=float(entry.get("weight", 1.0)),
+            name=entry.get("name")
+        ))
+    return endpoints
@@ -11,17 +11,57 @@ import time
 import os
 import logging
 import re
-from typing import Dict, List, Any
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Tuple
 from tqdm import tqdm
 from dotenv import load_dotenv
-from lm_client import OpenRouterClient
+from lm_client import (
+    OpenRouterClient,
+    ChatCompletion,
+    DEFAULT_BASE_URL,
+    DEFAULT_REQUEST_TIMEOUT,
+    json_schema_response_format
+)
+from rate_limiter import RateLimiter
+from concurrency import AdaptiveConcurrencyLimiter
+from completion_cache import CompletionCache, DEFAULT_CACHE_DIR
+from usage import UsageBudget, UsageTracker, BudgetExhaustedError, add_usage, normalize_usage
+from endpoints import Endpoint
+from hedging import HedgePolicy
+from early_stop import (
+    REASONER_STOP_SEQUENCES,
+    AnswerDetector,
+    EarlyStopStats,
+    is_calibration_sample,
+    json_block_end,
+    restore_stop_sequence
+)
+from batch import DEFAULT_BATCH_DIR, BatchBackend, BatchCollector, LocalBatchBackend
+from cascade import CASCADE_CHECKS, CascadeStats
+from token_budget import CompletionLengthStats, DEFAULT_LENGTH_STATS_FILE
+from repair import REPAIR_MAX_TOKENS, RepairStats, repair_messages
+from jsonl_writer import AsyncJsonlWriter, DEFAULT_WRITE_BATCH_SIZE, DEFAULT_WRITE_INTERVAL
+from ledger import DONE, FAILED, IN_FLIGHT, PENDING, WorkLedger, unit_key
+from pipeline import Pipeline, Stage
+from sandbox_pool import SandboxPool
+from sharding import shard_of
 from prompts import (
     get_naive_coder_prompt, 
+    get_naive_coder_instructions,
+    get_naive_repair_prompt,
+    get_problem_context,
     get_reasoner_prompt, 
+    get_reasoner_instructions,
+    get_reasoner_repair_prompt,
     get_reasoner_schema,
     generate_test_inputs,
+    parse_input_output,
+    PROMPT_VERSION,
     SandboxExecutor
 )
+from data_structures import Problem
 from utils import extract_code
 from confusion_matrix_utils import calculate_confusion_matrix_stats
 
@@ -32,13 +72,250 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def summarize_stream_metrics(metrics: List[dict]) -> str:
+    """Summarize per-request streaming metrics as p50/p99 time-to-first-token and mean tokens/sec."""
+    ttfts = sorted(m['time_to_first_token'] for m in metrics if m.get('time_to_first_token') is not None)
+    speeds = [m['tokens_per_second'] for m in metrics if m.get('tokens_per_second')]
+    if not ttfts:
+        return f"{len(metrics)} streams, no tokens received"
+    p50 = ttfts[len(ttfts) // 2]
+    p99 = ttfts[min(len(ttfts) - 1, int(len(ttfts) * 0.99))]
+    mean_speed = sum(speeds) / len(speeds) if speeds else 0.0
+    return (f"{len(metrics)} streams, time to first token p50={p50:.2f}s p99={p99:.2f}s, "
+            f"mean {mean_speed:.1f} tokens/s")
+
+def parse_reasoner_response(full_response: str, filtered_inputs: list, test_outputs: list) -> tuple:
+    """
+    Parse a free-form reasoner response into (reasoning_text, expected_outputs, generated_outputs)
+    Tries a ```json fence, then a trailing JSON object, then an "Expected outputs: [...]" line;
+    outputs that cannot be recovered are recorded as "N/A".
+    """
+    fallback_expected = [str(output) for output in test_outputs]
+    fallback_generated = ["N/A"] * len(filtered_inputs)
+    try:
+        # Look for JSON in code blocks first
+        json_pattern = r'```json\s*(\{.*?\})\s*```'
+        json_match = re.search(json_pattern, full_response, re.DOTALL)
+        
+        if json_match:
+            json_part = json_match.group(1)
+            reasoning_text = full_response[:json_match.start()].strip()
+            parsed_output = json.loads(json_part)
+        else:
+            # Look for JSON at the end
+            json_start = full_response.rfind('{')
+            if json_start != -1:
+                json_part = full_response[json_start:]
+                reasoning_text = full_response[:json_start].strip()
+                parsed_output = json.loads(json_part)
+            else:
+                # No JSON found, try to extract outputs from text patterns
+                # like "Expected outputs: ['4', '-1', '-1']"
+                outputs_pattern = r'Expected outputs:\s*\[(.*?)\]'
+                outputs_match = re.search(outputs_pattern, full_response)
+                if outputs_match:
+                    try:
+                        outputs = [item.strip().strip("'\"") for item in outputs_match.group(1).split(',')]
+                        # Only take the first N outputs where N is the number of filtered inputs
+                        outputs = outputs[:len(filtered_inputs)]
+                        return full_response, outputs, list(outputs)
+                    except (IndexError, ValueError, AttributeError):
+                        pass
+                return full_response, fallback_expected, fallback_generated
+        
+        if isinstance(parsed_output, dict) and "outputs" in parsed_output:
+            outputs = [str(output) for output in parsed_output["outputs"]]
+            return reasoning_text, outputs, list(outputs)
+        # Fallback: use actual expected outputs from the problem data
+        return reasoning_text, fallback_expected, fallback_generated
+    except json.JSONDecodeError:
+        # Fallback to plain text if JSON parsing fails
+        return full_response, fallback_expected, fallback_generated
+
+def reasoner_outputs_missing(generated_outputs: list) -> bool:
+    """True when parse_reasoner_response found no outputs (everything is the "N/A" fallback)"""
+    return all(output == "N/A" for output in generated_outputs)
+
+def load_problems_json(json_file: str, max_problems: Optional[int] = None) -> List[Problem]:
+    """Read problems from a column-oriented JSON file (question, difficulty, input_output keyed by index)"""
+    with open(json_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    question_data = data.get('question', {})
+    difficulty_data = data.get('difficulty', {})
+    input_output_data = data.get('input_output', {})
+    
+    problems = []
+    for idx in list(question_data.keys())[:max_problems]:
+        input_output = input_output_data.get(idx, '')
+        if not isinstance(input_output, str):
+            input_output = json.dumps(input_output)
+        in_out = parse_input_output(input_output)
+        problems.append(Problem(
+            id=str(idx),
+            name=f"Problem {idx}",
+            statement=question_data.get(idx, ''),
+            sample_inputs=in_out['inputs'],
+            sample_outputs=in_out['outputs'],
+            difficulty=difficulty_data.get(idx, '') or "UNKNOWN_DIFFICULTY",
+            solutions=[]
+        ))
+    return problems
+
+@dataclass
+class GenerationJob:
+    """One (problem, persona) response on its way through the generation stages"""
+    problem: Any
+    persona_type: str
+    models: List[str]  # one model, or the cascade to escalate through
+    model_index: int = 0
+    attempts: List[Dict[str, Any]] = field(default_factory=list)
+    # Per-attempt state, filled in stage by stage
+    test_inputs: Optional[list] = None
+    test_outputs: Optional[list] = None
+    filtered_inputs: Optional[list] = None
+    filtered_outputs: Optional[list] = None
+    messages: Optional[List[Dict[str, Any]]] = None
+    request_kwargs: Optional[Dict[str, Any]] = None
+    completion: Optional[ChatCompletion] = None
+    truncated_usage: Optional[Dict[str, Any]] = None
+    trace: Optional[str] = None
+    structured: Optional[Dict[str, Any]] = None
+    extracted_code: Optional[str] = None
+    expected_outputs: Optional[list] = None
+    generated_outputs: Optional[list] = None
+    repair: Optional[Dict[str, Any]] = None
+    response: Optional[Dict[str, Any]] = None
+
+    ATTEMPT_FIELDS = (
+        "test_inputs", "test_outputs", "filtered_inputs", "filtered_outputs", "messages", "request_kwargs",
+        "completion", "truncated_usage", "trace", "structured", "extracted_code", "expected_outputs",
+        "generated_outputs", "repair", "response"
+    )
+
+    @property
+    def model(self) -> str:
+        return self.models[self.model_index]
+
+    def reset_attempt(self):
+        """Clear the per-attempt state (a cascade escalation starts over with the next model)"""
+        for name in self.ATTEMPT_FIELDS:
+            setattr(self, name, None)
+
 class ReasoningTraceGenerator:
-    def __init__(self, api_key: str, model: str = "qwen/qwen3-next-80b-a3b-thinking", output_file: str = "responses.jsonl"):
-        self.client = OpenRouterClient(api_key)
+    def __init__(
+        self,
+        api_key: str,
+        model: str = "qwen/qwen3-next-80b-a3b-thinking",
+        output_file: str = "responses.jsonl",
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        max_concurrent: int = 64,
+        initial_concurrent: int = 4,
+        use_cache: bool = True,
+        cache_dir: str = DEFAULT_CACHE_DIR,
+        base_url: Optional[str] = None,
+        max_total_tokens: Optional[int] = None,
+        max_total_cost: Optional[float] = None,
+        endpoints: Optional[List[Endpoint]] = None,
+        hedge: bool = False,
+        hedge_model: Optional[str] = None,
+        request_timeout: Optional[float] = DEFAULT_REQUEST_TIMEOUT,
+        run_timeout: Optional[float] = None,
+        adaptive_max_tokens: bool = False,
+        length_stats_file: str = DEFAULT_LENGTH_STATS_FILE,
+        sandbox_concurrency: Optional[int] = None
+    ):
+        # One limiter per generator (or a shared one passed in) so every request counts against the same quota
+        if rate_limiter is None:
+            rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        # In-flight requests adapt between 1 and max_concurrent based on latency and 429s/timeouts
+        concurrency_limiter = AdaptiveConcurrencyLimiter(initial_limit=initial_concurrent, max_limit=max_concurrent)
+        # Completions are deterministic (temperature 0), so re-runs are served from the on-disk cache
+        cache = CompletionCache(cache_dir, enabled=use_cache)
+        # OPENROUTER_BASE_URL points runs at another OpenAI-compatible server (e.g. tools/mock_openrouter.py)
+        self.client = OpenRouterClient(
+            api_key,
+            base_url=base_url or os.getenv('OPENROUTER_BASE_URL', DEFAULT_BASE_URL),
+            rate_limiter=rate_limiter,
+            concurrency_limiter=concurrency_limiter,
+            cache=cache,
+            # Hard budget: once spent, the client refuses to send further requests
+            budget=UsageBudget(max_total_tokens, max_total_cost),
+            # Several keys/providers: route by weight and fail over between them
+            endpoints=endpoints,
+            # Duplicate the slowest requests (past p95 latency) to cut the tail of a run
+            hedge_policy=HedgePolicy(hedge_model=hedge_model) if hedge else None,
+            request_timeout=request_timeout
+        )
         self.model = model
+        self.usage_tracker = UsageTracker()
+        # max_tokens from past completion lengths per (model, persona, difficulty) instead of a flat 16000
+        self.length_stats = CompletionLengthStats(length_stats_file, enabled=adaptive_max_tokens)
         self.output_file = output_file
         self.results = []
+        # During a run responses go to a writer task that appends them in batches (every
+        # write_batch_size records or write_interval seconds); write_fsync forces each batch to disk
+        self.writer: Optional[AsyncJsonlWriter] = None
+        self.write_batch_size = DEFAULT_WRITE_BATCH_SIZE
+        self.write_interval = DEFAULT_WRITE_INTERVAL
+        self.write_fsync = False
         self.sandbox = SandboxExecutor()  # Use default local code runner
+        # Generated code runs on its own thread pool (default: one program per CPU) so that
+        # waiting for it never blocks the event loop and the LLM requests in flight
+        self.sandbox_pool = SandboxPool(sandbox_concurrency)
+        
+        # Stream completions over SSE and record time-to-first-token / tokens per second
+        self.stream = False
+        self.stream_metrics = []
+        
+        # Ask the reasoner for schema-constrained JSON (response_format) instead of a trailing ```json block
+        self.structured_output = False
+        self.parse_modes = Counter()
+        
+        # Stop generating once the code block / outputs block is closed (stop sequences, and
+        # closing the stream when streaming). A small deterministic sample of responses runs
+        # to completion to estimate how much each early stop saves.
+        self.early_stop = False
+        self.early_stop_calibration = 0.05
+        self.early_stop_stats = EarlyStopStats()
+        
+        # Cheaper models to try first: each model in turn until one passes cascade_check
+        # ("parsed", "ran" or "correct" on the sample tests); every attempt is kept on the record
+        self.cascade_models: List[str] = []
+        self.cascade_check = "correct"
+        self.cascade_stats = CascadeStats()
+        
+        # Unparsable answers get up to max_repairs short follow-ups in the same conversation
+        # asking only for the missing outputs JSON / code block (0 records them as failures)
+        self.max_repairs = 1
+        self.repair_stats = RepairStats()
+        
+        # Put the problem statement, identical for every persona and model, right after the
+        # system message and before the persona instructions so providers can serve it from
+        # their prompt cache; cache_control also marks it with an explicit cache breakpoint
+        self.prompt_cache = False
+        self.cache_control = False
+        
+        # Runs go through a staged pipeline (prepare -> llm -> extract -> sandbox -> score -> persist)
+        # connected by bounded queues; stage_workers overrides the worker count of any stage by name
+        self.stage_workers: Dict[str, int] = {}
+        self.pipeline: Optional[Pipeline] = None
+        
+        # Work ledger next to the output file: each (problem, persona, model, prompt version) unit is
+        # pending, in flight, done or failed, so with resume a run generates only the missing or failed ones
+        self.prompt_version = PROMPT_VERSION
+        self.resume = True
+        self.ledger: Optional[WorkLedger] = None
+        
+        # (index, count): generate only the (problem, persona) units hashed to this shard, so several
+        # processes or hosts can split a sweep, each writing its own output segment
+        self.shard: Optional[Tuple[int, int]] = None
+        
+        # Wall-clock budget for a whole run; stragglers are cancelled and recorded in timed_out
+        self.run_timeout = run_timeout
+        self.run_expired = False
+        self.timed_out = []
         
         # Filtering options
         self.disable_input_filtering = False
@@ -91,291 +368,691 @@ class ReasoningTraceGenerator:
             return f"Input examples: {problem.sample_inputs[:3]}"  # Show first 3 examples
         return "Standard input format"
     
-    def create_messages(self, prompt: str) -> List[Dict[str, str]]:
-        """Create messages for the LLM API."""
+    def create_messages(self, prompt: str, shared_prefix: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Create messages for the LLM API.
+        With a shared_prefix the user turn is two text parts, the shared prefix first
+        (marked as a cache breakpoint when cache_control is on) and then the prompt.
+        """
+        if shared_prefix is None:
+            content = prompt
+        else:
+            prefix_part = {"type": "text", "text": shared_prefix + "\n\n"}
+            if self.cache_control:
+                prefix_part["cache_control"] = {"type": "ephemeral"}
+            content = [prefix_part, {"type": "text", "text": prompt}]
         return [
             {"role": "system", "content": "You are a helpful assistant that solves competitive programming problems."},
-            {"role": "user", "content": prompt}
+            {"role": "user", "content": content}
         ]
     
+    async def complete(self, messages: List[Dict[str, str]], model: Optional[str] = None, **kwargs) -> ChatCompletion:
+        """
+        Run one completion for `model` (default: this generator's model)
+        Asks OpenRouter to include cost in `usage` (not sent to other endpoints, see endpoint_payload);
+        streaming metrics are kept on completion.timing
+        """
+        kwargs.setdefault("usage", {"include": True})
+        completion = await self.client.async_complete(model=model or self.model, messages=messages, stream=self.stream, **kwargs)
+        if completion.timing is not None:
+            self.stream_metrics.append(completion.timing)
+        return completion
+    
+    @property
+    def timeouts_file(self) -> str:
+        """Sidecar file listing the (problem, persona) pairs that timed out in the last run"""
+        return os.path.splitext(self.output_file)[0] + ".timeouts.json"
+    
+    def record_timeout(self, problem_id, persona_type: str, reason: str):
+        logger.warning(f"Problem {problem_id} ({persona_type}) timed out: {reason}")
+        self.timed_out.append({"problem_id": str(problem_id), "type": persona_type, "reason": reason})
+    
+    def write_timeouts(self):
+        """Write the timed-out pairs next to the output file (an empty list clears it)"""
+        with open(self.timeouts_file, 'w', encoding='utf-8') as f:
+            json.dump(self.timed_out, f, indent=2)
+        if self.timed_out:
+            logger.info(f"{len(self.timed_out)} responses timed out, listed in {self.timeouts_file}")
+    
+    @property
+    def ledger_file(self) -> str:
+        """Work ledger of the output file (see WorkLedger)"""
+        return os.path.splitext(self.output_file)[0] + ".ledger.jsonl"
+    
+    def unit_key(self, job: GenerationJob) -> str:
+        return unit_key(job.problem.id, job.persona_type, job.models, self.prompt_version)
+    
+    def mark_unit(self, key: str, state: str, **details):
+        """Record a unit's state in the ledger, if the run scheduled it (written with the next output batch)"""
+        if self.ledger is not None and self.ledger.state(key) is not None:
+            self.ledger.mark(key, state, **details)
+    
+    def completed_units(self) -> List[str]:
+        """Units of the current models and prompt version that have a response in the output file"""
+        models = self.cascade_models or [self.model]
+        keys = []
+        if not os.path.exists(self.output_file):
+            return keys
+        with open(self.output_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # a line cut short by a crash
+                # Records written before models and prompt versions were recorded count as current
+                if record.get("model", models[-1]) not in models:
+                    continue
+                if record.get("prompt_version", self.prompt_version) != self.prompt_version:
+                    continue
+                keys.append(unit_key(record["problem_id"], record["type"], models, self.prompt_version))
+        return keys
+    
+    def open_ledger(self, clear_output: bool = True) -> WorkLedger:
+        """
+        Open the work ledger for a run
+        With resume, the output file is kept and units already done are skipped. Responses in
+        it the ledger does not have as done (written just before a crash, or by a run from before
+        the ledger) are marked done first. Without resume the ledger starts over, and
+        clear_output empties the output file.
+        """
+        self.ledger = WorkLedger(self.ledger_file, fsync=self.write_fsync)
+        if not self.resume:
+            self.ledger.reset()
+            if clear_output:
+                with open(self.output_file, 'w', encoding='utf-8') as f:
+                    pass  # Create empty file
+            return self.ledger
+        if self.ledger.interrupted or not self.ledger.units:
+            recovered = [key for key in dict.fromkeys(self.completed_units()) if not self.ledger.is_done(key)]
+            self.ledger.mark_many(recovered, DONE, recovered=True)
+            self.ledger.flush()
+            if recovered:
+                logger.info(f"Work ledger: {len(recovered)} responses found in {self.output_file} marked done")
+        logger.info(f"Resuming from {self.ledger_file}: {self.ledger}")
+        return self.ledger
+    
+    def schedule(self, jobs: List[GenerationJob]) -> List[GenerationJob]:
+        """The jobs whose unit is not done yet, marked pending in the ledger (all of them without a ledger)"""
+        if self.ledger is None:
+            return jobs
+        remaining = [job for job in jobs if not self.ledger.is_done(self.unit_key(job))]
+        if len(remaining) < len(jobs):
+            logger.info(f"Work ledger: {len(jobs) - len(remaining)} of {len(jobs)} responses already done")
+        self.ledger.mark_many([self.unit_key(job) for job in remaining], PENDING)
+        return remaining
+    
+    def load_timeouts(self) -> List[Dict[str, str]]:
+        if not os.path.exists(self.timeouts_file):
+            return []
+        with open(self.timeouts_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    
+    def _early_stop_kwargs(self, problem_id, persona_type: str, answer_end, stop_sequences: List[str]) -> dict:
+        """Stop sequences and the streaming stop hook for one request (none for calibration samples)"""
+        if not self.early_stop or is_calibration_sample(f"{problem_id}/{persona_type}", self.early_stop_calibration):
+            return {}
+        return {"stop": stop_sequences, "stop_when": AnswerDetector(answer_end)}
+    
+    def _finish_early_stop(self, completion: ChatCompletion, problem_id, persona_type: str, answer_end,
+                           stop_sequences: List[str]) -> str:
+        """Record early-stop statistics and return the content with a fence cut by a stop sequence closed again"""
+        if not self.early_stop:
+            return completion.content
+        if is_calibration_sample(f"{problem_id}/{persona_type}", self.early_stop_calibration):
+            tokens_per_second = (completion.timing or {}).get("tokens_per_second")
+            completion_tokens = (completion.usage or {}).get("completion_tokens")
+            if tokens_per_second is None and completion_tokens and completion.latency:
+                tokens_per_second = completion_tokens / completion.latency
+            self.early_stop_stats.record_calibration(persona_type, completion.content, answer_end, tokens_per_second)
+            return completion.content
+        # Reached only for requests sent with the stop sequences (see _early_stop_kwargs)
+        content = restore_stop_sequence(completion.content, stop_sequences, completion.finish_reason)
+        stopped = completion.finish_reason == "early_stop" or content != completion.content
+        self.early_stop_stats.record_stopped(persona_type, stopped)
+        return content
+    
+    async def complete_sized(self, messages: List[Dict[str, str]], model: str, persona_type: str, difficulty,
+                             **kwargs) -> tuple:
+        """
+        Complete with max_tokens sized from past completion lengths (see CompletionLengthStats)
+        A response cut off at its budget is retried with a larger one. Returns the completion
+        and the summed usage of the truncated attempts (None if there were none).
+        """
+        budget = self.length_stats.max_tokens(model, persona_type, difficulty)
+        truncated_usage = None
+        while True:
+            completion = await self.complete(messages, model=model, max_tokens=budget, **kwargs)
+            if completion.finish_reason != "length":
+                # Only lengths of billed replies that ran to their natural end: cache hits would count a
+                # sample again, and replies cut by a stop sequence or stop hook are shorter than a full one
+                if completion.billed and completion.finish_reason != "early_stop" and not kwargs.get("stop"):
+                    self.length_stats.record(model, persona_type, difficulty,
+                                             (completion.usage or {}).get("completion_tokens"))
+                return completion, truncated_usage
+            larger = self.length_stats.next_budget(budget)
+            if larger is None:
+                return completion, truncated_usage
+            logger.info(f"{model} ({persona_type}) hit max_tokens={budget}, retrying with {larger}")
+            truncated_usage = add_usage(truncated_usage, normalize_usage(completion.usage, completion.latency, completion.billed))
+            budget = larger
+    
+    async def repair(self, messages: List[Dict[str, str]], completion: ChatCompletion, content: str,
+                     persona_type: str, instruction: str, parse, model: Optional[str] = None) -> tuple:
+        """
+        Continue the conversation with `instruction` until `parse` finds the answer, at most max_repairs times
+        `parse` returns None for a reply that still has no answer. Returns (parsed answer or None,
+        last follow-up reply, summed usage of the follow-ups).
+        """
+        reply = content or completion.reasoning or ""
+        result = None
+        usage = None
+        attempts = 0
+        while result is None and attempts < self.max_repairs:
+            attempts += 1
+            messages = repair_messages(messages, reply, instruction)
+            followup = await self.complete(messages, model=model, max_tokens=REPAIR_MAX_TOKENS, temperature=0.0)
+            usage = add_usage(usage, normalize_usage(followup.usage, followup.latency, followup.billed))
+            reply = followup.content
+            result = parse(reply)
+        self.repair_stats.record_repair(persona_type, attempts, result is not None, usage)
+        return result, reply, usage
+    
     def save_response(self, response: Dict[str, Any]):
         """Save a single response to JSONL file immediately."""
         with open(self.output_file, 'a', encoding='utf-8') as f:
             f.write(json.dumps(response) + '\n')
         self.results.append(response)
     
-    async def generate_response(self, problem, persona_type: str) -> Dict[str, Any]:
-        """Generate a single response for a problem."""
+    async def persist_response(self, response: Dict[str, Any], unit: Optional[str] = None):
+        """
+        Hand a response to the run's buffered writer, or save it immediately outside a run
+        Its ledger unit is marked done once the response is in the output file: the writer
+        commits the units of each batch to the ledger after writing it (see commit_units).
+        """
+        if self.writer is None:
+            self.save_response(response)
+            if unit is not None:
+                self.commit_units([unit])
+            return
+        await self.writer.write(response, tag=unit)
+        self.results.append(response)
+    
+    def commit_units(self, units: List[str]):
+        """Mark units whose responses were written done, in one ledger append (runs on the writer thread in a run)"""
+        if self.ledger is not None:
+            self.ledger.commit(units)
+    
+    @asynccontextmanager
+    async def buffered_output(self):
+        """Route persist_response through an AsyncJsonlWriter for the duration of a run; drained on exit"""
+        self.writer = AsyncJsonlWriter(self.output_file, self.write_batch_size, self.write_interval, self.write_fsync,
+                                       on_commit=self.commit_units)
+        try:
+            async with self.writer:
+                yield self.writer
+        finally:
+            logger.info(f"Output: {self.writer}")
+            self.writer = None
+    
+    async def prepare_stage(self, job: GenerationJob) -> Optional[GenerationJob]:
+        """Pipeline stage: select the test inputs and build the messages; None if nothing is left to ask"""
+        job.reset_attempt()
+        if job.model_index == 0:
+            self.mark_unit(self.unit_key(job), IN_FLIGHT)
+        problem = job.problem
         problem_id = problem.id
-        problem_name = problem.name
         question = problem.statement
+        persona_type = job.persona_type
         
         # Use sample inputs from the problem
-        test_inputs = problem.sample_inputs[:3] if problem.sample_inputs else []
-        test_outputs = problem.sample_outputs[:3] if problem.sample_outputs else []
+        job.test_inputs = problem.sample_inputs[:3] if problem.sample_inputs else []
+        job.test_outputs = problem.sample_outputs[:3] if problem.sample_outputs else []
         
-        # Parse input format
-        input_format = self.parse_input_output(problem)
+        if persona_type == "reasoning":
+            # Apply description-based filtering if not disabled
+            if not self.disable_input_filtering:
+                from prompts import filter_inputs_already_in_description
+                filtered_inputs, filtered_outputs = filter_inputs_already_in_description(question, job.test_inputs, job.test_outputs)
+            else:
+                filtered_inputs, filtered_outputs = job.test_inputs, job.test_outputs
+            
+            filtered_inputs, filtered_outputs = self.filter_by_size(filtered_inputs, filtered_outputs)
+            if len(filtered_inputs) == 0:
+                logger.warning(f"No inputs after filtering, skipping problem {problem_id}")
+                self.mark_unit(self.unit_key(job), FAILED, reason="no_inputs")
+                return None
+            
+            logger.info(f"Number of test cases for problem {problem_id} after filtering: {len(filtered_inputs)}")
+            job.filtered_inputs, job.filtered_outputs = filtered_inputs, filtered_outputs
+            
+            # Generate prompt with filtered test inputs
+            if self.prompt_cache:
+                prompt = get_reasoner_instructions(
+                    question, filtered_inputs, filtered_outputs,
+                    disable_filtering=self.disable_input_filtering, structured=self.structured_output
+                )
+                job.messages = self.create_messages(prompt, shared_prefix=get_problem_context(question))
+            else:
+                prompt = get_reasoner_prompt(
+                    question, filtered_inputs, filtered_outputs,
+                    disable_filtering=self.disable_input_filtering, structured=self.structured_output
+                )
+                job.messages = self.create_messages(prompt)
+            if self.structured_output:
+                # The JSON object is the whole answer, so there is nothing to stop early
+                job.request_kwargs = {"response_format": json_schema_response_format("reasoner_outputs", get_reasoner_schema())}
+            else:
+                job.request_kwargs = self._early_stop_kwargs(problem_id, persona_type, json_block_end, REASONER_STOP_SEQUENCES)
+        else:  # naive coder
+            # Generate prompt with input format
+            input_format = self.parse_input_output(problem)
+            if self.prompt_cache:
+                prompt = get_naive_coder_instructions(input_format)
+                job.messages = self.create_messages(prompt, shared_prefix=get_problem_context(question))
+            else:
+                prompt = get_naive_coder_prompt(question, input_format)
+                job.messages = self.create_messages(prompt)
+        return job
+    
+    async def llm_stage(self, job: GenerationJob) -> GenerationJob:
+        """Pipeline stage: get the completion for the prepared messages"""
+        job.completion, job.truncated_usage = await self.complete_sized(
+            job.messages,
+            job.model,
+            job.persona_type,
+            job.problem.difficulty,
+            temperature=0.0,
+            **(job.request_kwargs or {})
+        )
+        return job
+    
+    async def extract_stage(self, job: GenerationJob) -> GenerationJob:
+        """Pipeline stage: parse the answer out of the completion, with repair follow-ups if it has none"""
+        completion = job.completion
+        problem_id = job.problem.id
+        persona_type = job.persona_type
         
-        try:
-            if persona_type == "reasoning":
-                # Apply description-based filtering if not disabled
-                if not self.disable_input_filtering:
-                    from prompts import filter_inputs_already_in_description
-                    filtered_inputs, filtered_outputs = filter_inputs_already_in_description(question, test_inputs, test_outputs)
+        if persona_type == "reasoning":
+            filtered_inputs, test_outputs = job.filtered_inputs, job.test_outputs
+            structured = completion.parse_json() if self.structured_output else None
+            if structured is not None and isinstance(structured.get("outputs"), list):
+                # Schema-constrained answer: no searching through free-form text
+                self.parse_modes["structured"] += 1
+                reasoning_text = structured.get("reasoning") or completion.reasoning
+                expected_outputs = [str(output) for output in structured["outputs"]]
+                generated_outputs = list(expected_outputs)
+            else:
+                if self.structured_output:
+                    self.parse_modes["fallback"] += 1
+                    full_response = completion.content
                 else:
-                    filtered_inputs, filtered_outputs = test_inputs, test_outputs
-                
-                filtered_inputs, filtered_outputs = self.filter_by_size(filtered_inputs, filtered_outputs)
-                if len(filtered_inputs) == 0:
-                    logger.warning(f"No inputs after filtering, skipping problem {problem_id}")
-                    return None
-        
-                logger.info(f"Number of test cases for problem {problem_id} after filtering: {len(filtered_inputs)}")
-                
-                # Generate prompt with filtered test inputs
-                prompt = get_reasoner_prompt(question, filtered_inputs, filtered_outputs, disable_filtering=self.disable_input_filtering)
-                messages = self.create_messages(prompt)
-                
-                # Get the full response
-                full_response = await self.client.async_chat(
-                    model=self.model,
-                    messages=messages,
-                    max_tokens=16000,
-                    temperature=0.0
+                    full_response = self._finish_early_stop(
+                        completion, problem_id, persona_type, json_block_end, REASONER_STOP_SEQUENCES
+                    )
+                reasoning_text, expected_outputs, generated_outputs = parse_reasoner_response(
+                    full_response, filtered_inputs, test_outputs
                 )
+            
+            if reasoner_outputs_missing(generated_outputs):
+                def parse_outputs(text):
+                    _, expected, generated = parse_reasoner_response(text, filtered_inputs, test_outputs)
+                    return None if reasoner_outputs_missing(generated) else (expected, generated)
                 
-                # Extract JSON from the end of the response
-                try:
-                    # Look for JSON in code blocks first
-                    json_pattern = r'```json\s*(\{.*?\})\s*```'
-                    json_match = re.search(json_pattern, full_response, re.DOTALL)
-                    
-                    if json_match:
-                        json_part = json_match.group(1)
-                        reasoning_text = full_response[:json_match.start()].strip()
-                        parsed_output = json.loads(json_part)
-                    else:
-                        # Look for JSON at the end
-                        json_start = full_response.rfind('{')
-                        if json_start != -1:
-                            json_part = full_response[json_start:]
-                            reasoning_text = full_response[:json_start].strip()
-                            parsed_output = json.loads(json_part)
-                        else:
-                            # No JSON found, try to extract from text
-                            reasoning_text = full_response
-                            
-                            # Try to extract outputs from text patterns
-                            # Look for patterns like "Expected outputs: ['4', '-1', '-1']"
-                            outputs_pattern = r'Expected outputs:\s*\[(.*?)\]'
-                            outputs_match = re.search(outputs_pattern, full_response)
-                            
-                            if outputs_match:
-                                try:
-                                    outputs_str = outputs_match.group(1)
-                                    # Parse the outputs string
-                                    outputs = []
-                                    for item in outputs_str.split(','):
-                                        item = item.strip().strip("'\"")
-                                        outputs.append(item)
-                                    # Only take the first N outputs where N is the number of filtered inputs
-                                    expected_outputs = outputs[:len(filtered_inputs)]
-                                    generated_outputs = outputs[:len(filtered_inputs)]
-                                except (IndexError, ValueError, AttributeError):
-                                    expected_outputs = [str(output) for output in test_outputs]
-                                    generated_outputs = ["N/A"] * len(filtered_inputs)
-                            else:
-                                expected_outputs = [str(output) for output in test_outputs]
-                                generated_outputs = ["N/A"] * len(filtered_inputs)
-                            parsed_output = None
-                    
-                    if parsed_output:
-                        # Extract outputs
-                        expected_outputs = []
-                        generated_outputs = []
-                        
-                        if "outputs" in parsed_output:
-                            outputs = parsed_output["outputs"]
-                            for output in outputs:
-                                expected_outputs.append(str(output))
-                                generated_outputs.append(str(output))
-                        else:
-                            # Fallback: use actual expected outputs from the problem data
-                            expected_outputs = [str(output) for output in test_outputs]
-                            generated_outputs = ["N/A"] * len(filtered_inputs)
-                        
-                except json.JSONDecodeError:
-                    # Fallback to plain text if JSON parsing fails
-                    reasoning_text = full_response
-                    expected_outputs = [str(output) for output in test_outputs]
-                    generated_outputs = ["N/A"] * len(filtered_inputs)
-                
-                # Store the reasoning text directly as the trace
-                structured_trace = reasoning_text
-                
-                # Calculate confusion matrix statistics
-                confusion_matrix = calculate_confusion_matrix_stats(expected_outputs, generated_outputs)
-                
-                # Create response object
-                response = {
-                    "id": f"r-{time.time()}",
-                    "problem_id": int(problem_id),
-                    "type": persona_type,
-                    "trace": structured_trace,
-                    "inputs": filtered_inputs,  # Use filtered inputs instead of all test inputs
-                    "expected_outputs": filtered_outputs if filtered_outputs else expected_outputs,  # Use filtered outputs if available
-                    "generated_outputs": generated_outputs,
-                    "confusion_matrix": confusion_matrix
-                }
-                
-            else:  # naive coder
-                # Generate prompt with input format
-                prompt = get_naive_coder_prompt(question, input_format)
-                messages = self.create_messages(prompt)
-                
-                # Generate code
-                trace = await self.client.async_chat(
-                    model=self.model,
-                    messages=messages,
-                    max_tokens=16000,
-                    temperature=0.0
+                repaired, _, repair_usage = await self.repair(
+                    job.messages, completion, completion.content, persona_type,
+                    get_reasoner_repair_prompt(len(filtered_inputs)), parse_outputs, model=job.model
                 )
-                
-                # Extract Python code from the response
-                extracted_code = extract_code(trace, language="python")
-                
-                # Execute code with multiple test inputs
-                execution_results = []
-                generated_outputs = []
-                if extracted_code:
-                    try:
-                        execution_results = self.sandbox.execute_code_multiple_inputs(extracted_code, test_inputs)
-                        generated_outputs = [result["output"] for result in execution_results]
-                    except Exception as e:
-                        execution_results = [{"input": inp, "output": f"ERROR: {str(e)}", "success": False} for inp in test_inputs]
-                        generated_outputs = [f"ERROR: {str(e)}"] * len(test_inputs)
-                else:
-                    execution_results = [{"input": inp, "output": "NO_CODE_EXTRACTED", "success": False} for inp in test_inputs]
-                    generated_outputs = ["NO_CODE_EXTRACTED"] * len(test_inputs)
-                
-                # Calculate confusion matrix statistics
-                confusion_matrix = calculate_confusion_matrix_stats([str(output) for output in test_outputs], generated_outputs)
-                
-                # Create response object
-                response = {
-                    "id": f"r-{time.time()}",
-                    "problem_id": int(problem_id),
-                    "type": persona_type,
-                    "trace": trace,
-                    "inputs": test_inputs,
-                    "expected_outputs": [str(output) for output in test_outputs],  # Use actual expected outputs
-                    "generated_outputs": generated_outputs,
-                    "confusion_matrix": confusion_matrix
-                }
+                if repaired is not None:
+                    expected_outputs, generated_outputs = repaired
+                job.repair = {"repaired": repaired is not None, "usage": repair_usage}
             
-            # Save immediately to JSONL
-            self.save_response(response)
-            return response
+            # Store the reasoning text directly as the trace
+            job.trace = reasoning_text
+            job.structured = structured
+            job.expected_outputs, job.generated_outputs = expected_outputs, generated_outputs
+        else:  # naive coder
+            # Not stopped early: extract_code grades the last ```python block, which a
+            # draft followed by a final block only reveals once the reply is complete
+            trace = completion.content
             
-        except Exception as e:
-            logger.error(f"Error generating response for problem {problem_id} ({persona_type}): {e}")
+            # Extract Python code from the response
+            extracted_code = extract_code(trace, language="python")
+            
+            if not extracted_code:
+                extracted_code, reply, repair_usage = await self.repair(
+                    job.messages, completion, trace, persona_type, get_naive_repair_prompt(),
+                    lambda text: extract_code(text, language="python"), model=job.model
+                )
+                if extracted_code:
+                    # Keep the code that gets executed visible in the trace
+                    trace = f"{trace}\n\n{reply}"
+                job.repair = {"repaired": bool(extracted_code), "usage": repair_usage}
+            job.trace, job.extracted_code = trace, extracted_code
+        return job
+    
+    async def sandbox_stage(self, job: GenerationJob) -> GenerationJob:
+        """Pipeline stage: run the naive coder's code on the test inputs (reasoning jobs pass through)"""
+        if job.persona_type != "naive":
+            return job
+        test_inputs = job.test_inputs
+        # Execute code with multiple test inputs
+        if job.extracted_code:
+            try:
+                execution_results = await self.sandbox_pool.run(
+                    self.sandbox.execute_code_multiple_inputs, job.extracted_code, test_inputs
+                )
+                job.generated_outputs = [result["output"] for result in execution_results]
+            except Exception as e:
+                job.generated_outputs = [f"ERROR: {str(e)}"] * len(test_inputs)
+        else:
+            job.generated_outputs = ["NO_CODE_EXTRACTED"] * len(test_inputs)
+        job.expected_outputs = [str(output) for output in job.test_outputs]  # Use actual expected outputs
+        return job
+    
+    def score_attempt(self, job: GenerationJob) -> Dict[str, Any]:
+        """Build the response record of the current attempt (confusion matrix, usage) and record its usage"""
+        completion = job.completion
+        persona_type = job.persona_type
+        
+        # Calculate confusion matrix statistics
+        confusion_matrix = calculate_confusion_matrix_stats(job.expected_outputs, job.generated_outputs)
+        
+        # Create response object
+        response = {
+            "id": f"r-{time.time()}",
+            "problem_id": int(job.problem.id),
+            "type": persona_type,
+            "trace": job.trace,
+            "inputs": job.test_inputs,
+            "expected_outputs": job.expected_outputs,
+            "generated_outputs": job.generated_outputs,
+            "confusion_matrix": confusion_matrix,
+            "prompt_version": self.prompt_version
+        }
+        if persona_type == "reasoning":
+            response["inputs"] = job.filtered_inputs  # Use filtered inputs instead of all test inputs
+            if job.filtered_outputs:
+                response["expected_outputs"] = job.filtered_outputs  # Use filtered outputs if available
+            if self.structured_output:
+                response["structured_output"] = job.structured is not None
+        if job.repair is not None:
+            response["repair"] = job.repair
+        
+        response["model"] = job.model
+        response["usage"] = normalize_usage(completion.usage, completion.latency, completion.billed)
+        if job.truncated_usage is not None:
+            # Attempts cut off at a smaller max_tokens were billed too
+            response["usage"] = add_usage(response["usage"], job.truncated_usage)
+        if job.repair is not None:
+            # Follow-up calls count towards the response's cost
+            response["usage"] = add_usage(response["usage"], job.repair["usage"])
+        self.repair_stats.record_response(persona_type)
+        if completion.timing is not None:
+            response["timing"] = completion.timing
+        self.usage_tracker.record(job.model, persona_type, job.problem.difficulty, response["usage"])
+        job.response = response
+        return response
+    
+    def escalate(self, job: GenerationJob) -> bool:
+        """
+        Record the scored attempt for the cascade and move the job to the next model if it failed
+        Returns False once the job's response is final.
+        """
+        if len(job.models) == 1:
+            return False
+        response = job.response
+        passed = CASCADE_CHECKS[self.cascade_check](response)
+        job.attempts.append({
+            "model": job.model,
+            "passed": passed,
+            "generated_outputs": response["generated_outputs"],
+            "confusion_matrix": response["confusion_matrix"],
+            "usage": response["usage"]
+        })
+        if passed or job.model_index == len(job.models) - 1:
+            # The kept answer is the last attempt; the response pays for all of them
+            response["attempts"] = job.attempts
+            response["usage"] = job.attempts[0]["usage"]
+            for attempt in job.attempts[1:]:
+                response["usage"] = add_usage(response["usage"], attempt["usage"])
+            self.cascade_stats.record(job.persona_type, job.attempts)
+            return False
+        job.model_index += 1
+        return True
+    
+    def record_failure(self, job: GenerationJob, error: Exception):
+        """Log why a job produced no response (its exception was caught by the caller)"""
+        problem_id, persona_type = job.problem.id, job.persona_type
+        self.mark_unit(self.unit_key(job), FAILED, reason=type(error).__name__)
+        if isinstance(error, BudgetExhaustedError):
+            logger.warning(f"Budget exhausted, skipping problem {problem_id} ({persona_type})")
+        elif isinstance(error, asyncio.TimeoutError):
+            # Every retry hit the per-request deadline
+            self.record_timeout(problem_id, persona_type, "request_timeout")
+        else:
+            logger.error(f"Error generating response for problem {problem_id} ({persona_type}): {error}")
+    
+    async def generate_response(self, problem, persona_type: str) -> Optional[Dict[str, Any]]:
+        """
+        Generate and save a single response outside a run, through the same pipeline stages as a run
+        Escalates through cascade_models if set; returns None if the job failed (recorded as in a run).
+        """
+        job = GenerationJob(problem, persona_type, self.cascade_models or [self.model])
+        self.pipeline = self.build_pipeline()
+        async with self.buffered_output():
+            results = await self.pipeline.run([job])
+        return results[0] if results else None
+    
+    def _guarded(self, stage):
+        """Wrap a pipeline stage so a failing job is recorded (see record_failure) and dropped"""
+        async def run(job: GenerationJob):
+            try:
+                return await stage(job)
+            except Exception as e:
+                self.record_failure(job, e)
+                return None
+        return run
+    
+    async def score_stage(self, job: GenerationJob) -> Optional[GenerationJob]:
+        """Pipeline stage: score the attempt; a cascade escalation goes back to the start of the pipeline"""
+        self.score_attempt(job)
+        if self.escalate(job):
+            self.pipeline.resubmit(job)
             return None
+        return job
+    
+    async def persist_stage(self, job: GenerationJob) -> Dict[str, Any]:
+        """Pipeline stage: append the final response to the output file"""
+        await self.persist_response(job.response, unit=self.unit_key(job))
+        return job.response
+    
+    def build_pipeline(self, stage_workers: Optional[Dict[str, int]] = None, on_done=None) -> Pipeline:
+        """
+        The generation stages with their worker counts (self.stage_workers, then stage_workers, override the defaults)
+        LLM calls and the sandbox get the most workers, as does extract, whose repair
+        follow-ups are LLM calls too; the cheap CPU-bound steps run on the event loop
+        and only need a few.
+        """
+        workers = {
+            "prepare": 4,
+            "llm": self.client.concurrency_limiter.max_limit,
+            "extract": self.client.concurrency_limiter.max_limit,
+            "sandbox": self.sandbox_pool.max_concurrent,
+            "score": 2,
+            "persist": 1
+        }
+        workers.update(self.stage_workers)
+        workers.update(stage_workers or {})
+        stages = [
+            Stage("prepare", self._guarded(self.prepare_stage), workers["prepare"]),
+            Stage("llm", self._guarded(self.llm_stage), workers["llm"]),
+            Stage("extract", self._guarded(self.extract_stage), workers["extract"]),
+            Stage("sandbox", self._guarded(self.sandbox_stage), workers["sandbox"]),
+            Stage("score", self._guarded(self.score_stage), workers["score"]),
+            Stage("persist", self._guarded(self.persist_stage), workers["persist"])
+        ]
+        return Pipeline(stages, on_done=on_done)
     
     async def process_problems(self, json_file: str, max_problems: int = 300):
         """Process problems from JSON and generate responses."""
         logger.info(f"Reading problems from {json_file}...")
-        
-        with open(json_file, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        
-        
-        # Convert JSON structure to list of problems
-        problems = []
-        question_data = data.get('question', {})
-        difficulty_data = data.get('difficulty', {})
-        input_output_data = data.get('input_output', {})
-        
-        # Get all problem indices
-        problem_indices = list(question_data.keys())
-        
-        for idx in problem_indices:
-            problem = {
-                'problem_id': idx,
-                'question': question_data.get(idx, ''),
-                'difficulty': difficulty_data.get(idx, ''),
-                'input_output': input_output_data.get(idx, '')
-            }
-            problems.append(problem)
-        
-        # Limit to max_problems
-        problems = problems[:max_problems]
+        problems = load_problems_json(json_file, max_problems)
         print(f"Processing {len(problems)} problems...")
         
-        # Clear output file
-        with open(self.output_file, 'w', encoding='utf-8') as f:
-            pass  # Create empty file
+        # Resume from the work ledger, or start over with an empty output file
+        self.open_ledger()
         
-        # Create tasks for all responses (2 per problem)
-        tasks = []
-        for problem in problems:
-            # Add naive coder task
-            tasks.append(self.generate_response(problem, "naive"))
-            # Add reasoner task  
-            tasks.append(self.generate_response(problem, "reasoning"))
-        
-        # Process tasks with common helper
-        await self._process_tasks(tasks)
+        # Run all responses (2 per problem) through the pipeline, reusing one pooled connection for the whole run
+        async with self.client:
+            await self._process_jobs(self.create_jobs(problems))
     
     async def process_problems_from_list(self, problems):
         """Process problems from a list of Problem objects."""
         print(f"Processing {len(problems)} problems...")
         
-        # Clear output file
-        with open(self.output_file, 'w', encoding='utf-8') as f:
-            pass  # Create empty file
+        # Resume from the work ledger, or start over with an empty output file
+        self.open_ledger()
+        
+        # Run all responses (2 per problem) through the pipeline, reusing one pooled connection for the whole run
+        async with self.client:
+            await self._process_jobs(self.create_jobs(problems))
+    
+    async def process_problems_batch(self, problems, backend: Optional[BatchBackend] = None,
+                                     batch_dir: str = DEFAULT_BATCH_DIR, poll_interval: float = 30.0):
+        """
+        Like process_problems_from_list, but completions are requested through batch jobs
+        Responses go through the same pipeline stages, so records match the online path.
+        Without a backend, a LocalBatchBackend runs the jobs through the online client.
+        """
+        print(f"Processing {len(problems)} problems in batch mode...")
         
-        # Create tasks for all responses (2 per problem)
-        tasks = []
-        for problem in problems:
-            # Add naive coder task
-            tasks.append(self.generate_response(problem, "naive"))
-            # Add reasoner task  
-            tasks.append(self.generate_response(problem, "reasoning"))
+        self.open_ledger()
+        if backend is None:
+            backend = LocalBatchBackend(self.client._post_chat, os.path.join(batch_dir, "local"))
+        # Batch results arrive as whole completions, there is nothing to stream
+        self.stream = False
         
-        # Process tasks with common helper
-        await self._process_tasks(tasks)
+        jobs = self.create_jobs(problems)
+        # Every request of a round must be waiting at once to land in the same batch job
+        network_workers = max(1, len(jobs))
+        
+        async with self.client:
+            self.client.batch = BatchCollector(backend, batch_dir, poll_interval=poll_interval)
+            try:
+                await self._process_jobs(jobs, stage_workers={"llm": network_workers, "extract": network_workers})
+            finally:
+                logger.info(f"Batches: {self.client.batch}")
+                await self.client.batch.close()
+                self.client.batch = None
+    
+    async def retry_timed_out(self, problems):
+        """
+        Re-run only the responses listed in the timeouts file, appending to the output file
+        The timeouts file is rewritten with whatever times out again
+        """
+        jobs = self.timed_out_jobs(problems)
+        print(f"Retrying {len(jobs)} timed-out responses...")
+        self.open_ledger(clear_output=False)
+        async with self.client:
+            await self._process_jobs(jobs)
     
     def save_results(self, output_file: str = "responses.jsonl"):
         """Save results to JSONL format (already saved line by line)."""
         logger.info(f"Responses already saved to {self.output_file} during generation")
         logger.info(f"Total responses: {len(self.results)}")
     
-    async def _process_tasks(self, tasks: List):
+    def create_jobs(self, problems, persona_types=("naive", "reasoning")) -> List[GenerationJob]:
+        """One job per problem and persona (in this generator's shard), with the cascade models or just the generator's model"""
+        models = self.cascade_models or [self.model]
+        return [
+            GenerationJob(problem, persona_type, models) for problem in problems for persona_type in persona_types
+            if self.shard is None or shard_of(problem.id, persona_type, self.shard[1]) == self.shard[0]
+        ]
+    
+    def timed_out_jobs(self, problems, persona_types=("naive", "reasoning")) -> List[GenerationJob]:
+        """The jobs listed in the timeouts file (which stores problem ids as strings)"""
+        pending = {(entry["problem_id"], entry["type"]) for entry in self.load_timeouts()}
+        return [job for job in self.create_jobs(problems, persona_types) if (str(job.problem.id), job.persona_type) in pending]
+    
+    async def _process_jobs(self, jobs: List[GenerationJob], stage_workers: Optional[Dict[str, int]] = None,
+                            on_done=None) -> List[Dict[str, Any]]:
         """
-        Process async tasks with progress tracking.
+        Run jobs through the staged pipeline with progress tracking.
         
         Args:
-            tasks: List of async tasks to execute
+            jobs: Jobs to generate responses for (units the work ledger has done are skipped)
+            stage_workers: Worker counts overriding the defaults and self.stage_workers for this run
+            on_done: Optional callback with (job, response or None) as each job finishes
             
         Returns:
-            List of successful results
+            List of saved responses
         """
-        logger.info(f"Generating {len(tasks)} responses...")
+        jobs = self.schedule(jobs)
+        logger.info(f"Generating {len(jobs)} responses...")
         results = []
+        self.timed_out = []
+        self.run_expired = False
         
-        # Use asyncio.as_completed with tqdm
-        with tqdm(total=len(tasks), desc="Generating responses") as pbar:
-            for coro in asyncio.as_completed(tasks):
-                result = await coro
-                if result:
-                    results.append(result)
+        with tqdm(total=len(jobs), desc="Generating responses") as pbar:
+            def done(job, response):
                 pbar.update(1)
-                # Small delay to avoid rate limiting
-                await asyncio.sleep(0.1)
+                if on_done is not None:
+                    on_done(job, response)
+            
+            self.pipeline = self.build_pipeline(stage_workers, on_done=done)
+            async with self.buffered_output():
+                try:
+                    # Past the run deadline the pipeline is cancelled and raises TimeoutError
+                    results = await self.pipeline.run(jobs, timeout=self.run_timeout)
+                except asyncio.TimeoutError:
+                    unfinished = self.pipeline.unfinished
+                    logger.warning(f"Run timeout of {self.run_timeout}s reached, cancelled {len(unfinished)} unfinished responses")
+                    self.run_expired = True
+                    for job in unfinished:
+                        self.record_timeout(job.problem.id, job.persona_type, "run_timeout")
+                        self.mark_unit(self.unit_key(job), FAILED, reason="run_timeout")
+        self._finish_run(results)
+        logger.info(f"Pipeline stages:\n{self.pipeline.format_report()}")
+        return results
+    
+    def _finish_run(self, results: List[Dict[str, Any]]):
+        """Write the run's sidecar files and log its statistics"""
+        self.write_timeouts()
+        self.length_stats.save()
+        self.sandbox_pool.close()
         
         logger.info(f"Generated {len(results)} responses, saved to {self.output_file}")
-        return results
+        logger.info(f"API retries: {self.client.retry_stats}")
+        logger.info(f"Rate limiting: {self.client.rate_limiter}")
+        logger.info(f"Concurrency: {self.client.concurrency_limiter}")
+        logger.info(f"Cache: {self.client.cache}")
+        logger.info(f"Coalesced duplicate requests: {self.client.coalesced_requests}")
+        logger.info(f"Endpoints: {self.client.pool}")
+        logger.info(f"Sandbox: {self.sandbox_pool}")
+        if self.ledger is not None:
+            logger.info(f"Work ledger: {self.ledger}")
+            self.ledger.close()
+        if self.client.hedge_policy is not None:
+            logger.info(f"Hedging: {self.client.hedge_stats}")
+        if self.stream_metrics:
+            logger.info(f"Streaming: {summarize_stream_metrics(self.stream_metrics)}")
+        if self.early_stop:
+            logger.info(f"Early stopping: {self.early_stop_stats}")
+        if self.structured_output:
+            logger.info(f"Structured output: {self.parse_modes['structured']} parsed natively, "
+                        f"{self.parse_modes['fallback']} fell back to text parsing")
+        logger.info(f"Repairs: {self.repair_stats}")
+        if self.length_stats.enabled:
+            logger.info(f"max_tokens: {self.length_stats}")
+        if self.cascade_models:
+            logger.info(f"Cascade: {self.cascade_stats}")
+        if self.prompt_cache:
+            total = self.usage_tracker.rollup(by=())[()] if self.usage_tracker.records else None
+            if total:
+                logger.info(f"Prompt cache: {total['cached_tokens']}/{total['prompt_tokens']} prompt tokens "
+                            f"served from cache ({total['cache_hit_rate']:.0%})")
+        logger.info(f"Budget: {self.client.budget}")
+        logger.info(f"Usage by model/persona/difficulty:\n{self.usage_tracker.format_report()}")
 
 async def main():
     """Main function to run the trace generation."""
@@ -386,8 +1063,14 @@ async def main():
         print("Please set it with: export OPENROUTER_API_KEY='your-key-here'")
         return
     
-    # Initialize generator
-    generator = ReasoningTraceGenerator(api_key)
+    # Initialize generator, with optional provider quotas from the environment
+    rpm = os.getenv('OPENROUTER_RPM')
+    tpm = os.getenv('OPENROUTER_TPM')
+    generator = ReasoningTraceGenerator(
+        api_key,
+        requests_per_minute=float(rpm) if rpm else None,
+        tokens_per_minute=float(tpm) if tpm else None
+    )
     
     # Process problems
     await generator.process_problems('../data/validation_problems.json', max_problems=300)
@@ -0,0 +1,94 @@
+"""
+Request hedging for LLM API calls.
+
+A hedged request sends a duplicate once the original has been outstanding longer
+than a high percentile of recently observed latencies, keeps whichever copy
+finishes first and cancels the other. Only the slow tail is duplicated, so a small
+amount of extra load buys a much shorter end of run.
+"""
+
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def percentile(samples: List[float], q: float) -> float:
+    """Nearest-rank percentile (q in 0..1) of a non-empty list"""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+@dataclass
+class HedgeStats:
+    """Counters describing how often requests were hedged and what it bought"""
+    requests: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0  # hedged requests answered by the duplicate
+    hedge_failures: int = 0  # duplicates that errored while the original still succeeded
+    estimated_time_saved: float = 0.0  # seconds, see HedgePolicy.estimate_saving
+
+    @property
+    def hedge_rate(self) -> float:
+        return self.hedged / self.requests if self.requests else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'hedged': self.hedged,
+            'hedge_rate': self.hedge_rate,
+            'hedge_wins': self.hedge_wins,
+            'hedge_failures': self.hedge_failures,
+            'estimated_time_saved': self.estimated_time_saved
+        }
+
+    def __str__(self) -> str:
+        return (f"HedgeStats(requests={self.requests}, hedged={self.hedged} ({self.hedge_rate:.1%}), "
+                f"wins={self.hedge_wins}, failed_hedges={self.hedge_failures}, "
+                f"est. tail latency saved={self.estimated_time_saved:.1f}s)")
+
+
+@dataclass
+class HedgePolicy:
+    """
+    When and where to send a duplicate request
+    The hedge delay is the `quantile` of the last `window` successful latencies for the
+    model (never below `min_delay`); no hedging happens until `min_samples` were seen.
+    `max_hedge_rate` caps duplicates so a slow provider is not hit with double load.
+    `hedge_model` sends the duplicate to another model route instead of the same one;
+    with several endpoints the duplicate always prefers an endpoint not yet tried.
+    """
+    quantile: float = 0.95
+    min_samples: int = 20
+    min_delay: float = 1.0
+    window: int = 500
+    max_hedge_rate: float = 0.1
+    hedge_model: Optional[str] = None
+    _latencies: Dict[str, Deque[float]] = field(default_factory=dict, repr=False)
+
+    def record_latency(self, model: str, latency: float):
+        if model not in self._latencies:
+            self._latencies[model] = deque(maxlen=self.window)
+        self._latencies[model].append(latency)
+
+    def hedge_delay(self, model: str) -> Optional[float]:
+        """Seconds to wait before hedging a request to `model`, or None if there is no data yet"""
+        samples = self._latencies.get(model)
+        if not samples or len(samples) < self.min_samples:
+            return None
+        return max(self.min_delay, percentile(list(samples), self.quantile))
+
+    def may_hedge(self, stats: HedgeStats) -> bool:
+        return stats.hedged < self.max_hedge_rate * max(stats.requests, 1)
+
+    def estimate_saving(self, model: str, elapsed: float) -> float:
+        """
+        Expected extra wait had the original not been hedged, given it was still running at `elapsed`
+        Uses the median of observed latencies longer than `elapsed` (0 if none were that slow)
+        """
+        slower = [x for x in self._latencies.get(model, ()) if x > elapsed]
+        if not slower:
+            return 0.0
+        return percentile(slower, 0.5) - elapsed
@@ -0,0 +1,211 @@
+"""
+Buffered JSONL writer with group commit.
+
+Records are handed to a dedicated writer task over a queue. It collects them into
+batches, flushed once `max_batch` records are waiting or `max_delay` seconds after the
+first one arrived, and serializes and writes each batch on its own thread, so the event
+loop never blocks on file I/O. With `fsync` every batch is forced to disk before the
+next one starts: a crash loses at most the batch being written. Records may carry a tag;
+`on_commit` receives the tags of each batch on the writer thread once the batch is on
+disk (e.g. to record the work as done, in one go per batch).
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WRITE_BATCH_SIZE = 256
+DEFAULT_WRITE_INTERVAL = 1.0  # seconds
+
+_CLOSE = object()
+_TIMEOUT = object()
+
+
+def truncate_partial_line(path: str) -> int:
+    """
+    Cut a last line left without its newline by a crash, so appends start on a line boundary
+    Returns the number of bytes removed.
+    """
+    try:
+        with open(path, 'rb+') as f:
+            size = f.seek(0, os.SEEK_END)
+            if size == 0:
+                return 0
+            f.seek(size - 1)
+            if f.read(1) == b"\n":
+                return 0
+            # Walk back to the previous newline in blocks
+            end = size
+            while end > 0:
+                start = max(0, end - 65536)
+                f.seek(start)
+                newline = f.read(end - start).rfind(b"\n")
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            f.truncate(end)
+            return size - end
+    except FileNotFoundError:
+        return 0
+
+
+class AsyncJsonlWriter:
+    """
+    Appends records to a JSONL file from a background task, in batches
+    Use as `async with AsyncJsonlWriter(path) as writer: await writer.write(record)`;
+    leaving the block (or close()) writes whatever is still queued.
+    """
+    def __init__(self, path: str, max_batch: int = DEFAULT_WRITE_BATCH_SIZE,
+                 max_delay: float = DEFAULT_WRITE_INTERVAL, fsync: bool = False,
+                 on_commit: Optional[Callable[[List[Any]], None]] = None):
+        self.path = path
+        self.on_commit = on_commit
+        self.max_batch = max(1, max_batch)
+        self.max_delay = max_delay
+        self.fsync = fsync
+        self.records = 0
+        self.batches = 0
+        self.bytes = 0
+        self.write_seconds = 0.0
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._getter: Optional[asyncio.Future] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._file = None
+
+    async def __aenter__(self) -> 'AsyncJsonlWriter':
+        await self.start()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def start(self):
+        if self._task is not None:
+            return
+        # One thread keeps batches in order; it also opens the file, off the event loop
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="jsonl-writer")
+        self._queue = asyncio.Queue()
+        self._task = asyncio.ensure_future(self._run())
+
+    async def write(self, record: Dict[str, Any], tag: Any = None):
+        """Queue a record; it reaches the file with the next batch, whose commit reports `tag` (if not None)"""
+        if self._task is None:
+            await self.start()
+        if self._task.done():
+            # The writer failed; surface its error instead of queueing records that are never written
+            self._task.result()
+        self._queue.put_nowait((record, tag))
+
+    async def flush(self):
+        """Wait until every record queued so far has been written"""
+        if self._task is None:
+            return
+        joined = asyncio.ensure_future(self._queue.join())
+        await asyncio.wait([joined, self._task], return_when=asyncio.FIRST_COMPLETED)
+        if not joined.done():
+            joined.cancel()
+        if self._task.done():
+            # The writer stopped, possibly on the last batch; raise its error
+            self._task.result()
+
+    async def close(self):
+        """Write everything still queued, then close the file"""
+        if self._task is None:
+            return
+        self._queue.put_nowait(_CLOSE)
+        try:
+            await self._task
+        finally:
+            self._task = None
+            if self._file is not None:
+                await asyncio.get_running_loop().run_in_executor(self._executor, self._file.close)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+            self._file = None
+
+    async def _next(self, timeout: Optional[float]) -> Any:
+        """The next queued record, or _TIMEOUT; a get that timed out is kept for the next call, so nothing is lost"""
+        if self._getter is None:
+            self._getter = asyncio.ensure_future(self._queue.get())
+        done, _ = await asyncio.wait({self._getter}, timeout=timeout)
+        if not done:
+            return _TIMEOUT
+        record = self._getter.result()
+        self._getter = None
+        return record
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        self._file = await loop.run_in_executor(self._executor, self._open)
+        closing = False
+        try:
+            while not closing:
+                first = await self._next(None)
+                if first is _CLOSE:
+                    self._queue.task_done()
+                    break
+                batch = [first]
+                deadline = time.monotonic() + self.max_delay
+                while len(batch) < self.max_batch:
+                    record = self._next_nowait() if self._getter is None else _TIMEOUT
+                    if record is _TIMEOUT:
+                        record = await self._next(max(0.0, deadline - time.monotonic()))
+                    if record is _TIMEOUT:
+                        break
+                    if record is _CLOSE:
+                        self._queue.task_done()
+                        closing = True
+                        break
+                    batch.append(record)
+                try:
+                    await loop.run_in_executor(self._executor, self._write_batch, batch)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        finally:
+            if self._getter is not None:
+                self._getter.cancel()
+                self._getter = None
+
+    def _open(self):
+        """Open for appending, after cutting a line a crash left unfinished (runs on the writer thread)"""
+        removed = truncate_partial_line(self.path)
+        if removed:
+            logger.warning(f"Removed {removed} bytes of an unfinished last line from {self.path}")
+        return open(self.path, 'a', encoding='utf-8')
+
+    def _next_nowait(self) -> Any:
+        try:
+            return self._queue.get_nowait()
+        except asyncio.QueueEmpty:
+            return _TIMEOUT
+
+    def _write_batch(self, batch: List[tuple]):
+        """Serialize and append one batch of (record, tag), then report its tags (runs on the writer thread)"""
+        started = time.monotonic()
+        data = "".join(json.dumps(record) + "\n" for record, _ in batch)
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        if self.on_commit is not None:
+            tags = [tag for _, tag in batch if tag is not None]
+            if tags:
+                self.on_commit(tags)
+        self.records += len(batch)
+        self.batches += 1
+        self.bytes += len(data.encode('utf-8'))
+        self.write_seconds += time.monotonic() - started
+
+    def __str__(self) -> str:
+        mean = self.records / self.batches if self.batches else 0.0
+        return (f"AsyncJsonlWriter({self.records} records in {self.batches} batches, mean batch {mean:.1f}, "
+                f"{self.bytes / 1e6:.2f} MB, {self.write_seconds:.2f}s writing, fsync={'on' if self.fsync else 'off'})")
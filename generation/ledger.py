@@ -0,0 +1,163 @@
+"""
+Durable work ledger for resumable runs.
+
+A unit of work is one response: a (problem, persona, model, prompt version). Its state
+is appended to a JSONL log next to the output file: pending when a run schedules it,
+in_flight once it starts, done when its response has been written to the output file,
+failed when it ended without one. Loading replays the log, the last entry of a unit
+winning, so a resumed run schedules only the units that are not done and a crash costs
+only the work that was in flight.
+
+Marks are buffered and written together: the JSONL writer commits the done units of
+each output batch in one append from its own thread, after the batch is on disk, and
+the other transitions ride along. Losing a buffered pending, in-flight or failed entry
+in a crash only means the unit is scheduled again, which it would be anyway.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+from jsonl_writer import truncate_partial_line
+
+logger = logging.getLogger(__name__)
+
+PENDING = "pending"
+IN_FLIGHT = "in_flight"
+DONE = "done"
+FAILED = "failed"
+STATES = (PENDING, IN_FLIGHT, DONE, FAILED)
+
+
+def unit_key(problem_id, persona_type: str, models: List[str], prompt_version: str) -> str:
+    """Key of a unit; a cascade's models are one unit, since only its final answer is kept"""
+    return f"{problem_id}|{persona_type}|{'>'.join(models)}|{prompt_version}"
+
+
+class WorkLedger:
+    """
+    Append-only log of unit states, loaded (and compacted to one line per unit) on open
+    mark() updates the state at once and queues the entry; flush() (or commit()) appends
+    the queued entries in one write, forced to disk with `fsync`. Safe to use from the
+    event loop and the writer thread at the same time.
+    """
+    def __init__(self, path: str, fsync: bool = False):
+        self.path = path
+        self.fsync = fsync
+        self.units: Dict[str, Dict[str, Any]] = {}  # last entry of each unit
+        self.interrupted = 0  # units that were in flight when the ledger was loaded
+        self.appends = 0
+        self._file = None
+        self._queued: List[Dict[str, Any]] = []
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        self.units = {}
+        lines = 0
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    lines += 1
+                    try:
+                        entry = json.loads(line)
+                        self.units[entry["unit"]] = entry
+                    except (json.JSONDecodeError, KeyError, TypeError):
+                        # A line cut short by a crash; the unit's earlier state stands
+                        logger.warning(f"Ignoring unreadable work ledger entry in {self.path}")
+        except FileNotFoundError:
+            pass
+        self.interrupted = sum(1 for entry in self.units.values() if entry["state"] == IN_FLIGHT)
+        if lines > len(self.units):
+            self.compact()
+
+    def compact(self):
+        """Rewrite the log with only the last entry of each unit, atomically (temp file + os.replace)"""
+        self.close()
+        self._queued = []
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps(entry) + "\n" for entry in self.units.values())
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to compact work ledger {self.path}: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def reset(self):
+        """Forget every unit (a run that starts over)"""
+        self.close()
+        self.units = {}
+        self._queued = []
+        self.interrupted = 0
+        with open(self.path, 'w', encoding='utf-8'):
+            pass
+
+    def state(self, key: str) -> Optional[str]:
+        entry = self.units.get(key)
+        return entry["state"] if entry else None
+
+    def is_done(self, key: str) -> bool:
+        return self.state(key) == DONE
+
+    def mark(self, key: str, state: str, **details):
+        self.mark_many([key], state, **details)
+
+    def mark_many(self, keys: Iterable[str], state: str, **details):
+        """Record `state` for every key; written with the next flush()"""
+        if state not in STATES:
+            raise ValueError(f"Unknown work ledger state {state!r}")
+        now = time.time()
+        with self._lock:
+            for key in keys:
+                entry = {"unit": key, "state": state, "time": now, **details}
+                self.units[key] = entry
+                self._queued.append(entry)
+
+    def commit(self, keys: Iterable[str]):
+        """Mark the known units among `keys` done and write everything queued, in one append"""
+        with self._lock:
+            self.mark_many([key for key in keys if key in self.units], DONE)
+            self.flush()
+
+    def flush(self):
+        """Append the queued entries in one write (and one fsync)"""
+        with self._lock:
+            if not self._queued:
+                return
+            if self._file is None:
+                truncate_partial_line(self.path)
+                self._file = open(self.path, 'a', encoding='utf-8')
+            self._file.write("".join(json.dumps(entry) + "\n" for entry in self._queued))
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self._queued = []
+            self.appends += 1
+
+    def counts(self) -> Counter:
+        return Counter(entry["state"] for entry in self.units.values())
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __str__(self) -> str:
+        counts = self.counts()
+        return (f"WorkLedger({counts[DONE]} done, {counts[FAILED]} failed, {counts[IN_FLIGHT]} in flight, "
+                f"{counts[PENDING]} pending)")
@@ -3,57 +3,755 @@ import asyncio
 import aiohttp
 import ssl
 import os
+import json
+import threading
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Dict, List, Optional
 from dotenv import load_dotenv
+from retry import RetryPolicy, RetryStats, parse_retry_after
+from rate_limiter import RateLimiter, estimate_prompt_tokens, estimate_request_tokens, CHARS_PER_TOKEN
+from concurrency import AdaptiveConcurrencyLimiter
+from completion_cache import CompletionCache, request_fingerprint
+from usage import UsageBudget, normalize_usage
+from endpoints import Endpoint, EndpointPool, ENDPOINT_FAULT_STATUSES
+from hedging import HedgePolicy, HedgeStats
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+DEFAULT_BASE_URL = "https://openrouter.ai/api/v1"
+# Per-request deadlines (seconds). A reasoning completion can take many minutes, so the
+# total is generous; the connect deadline catches dead hosts quickly. The read deadline
+# (longest silence between bytes) is off by default because a non-streaming response
+# sends nothing until it is done; set it for streaming runs.
+DEFAULT_REQUEST_TIMEOUT = 900.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+
+class OpenRouterError(Exception):
+    """
+    Error returned by the OpenRouter API
+    Carries the HTTP status (or the error code from the body) and any Retry-After hint
+    """
+    def __init__(self, status: int, message: str, retry_after: Optional[float] = None):
+        super().__init__(f"Error: {status} - {message}")
+        self.status = status
+        self.message = message
+        self.retry_after = retry_after
+
+# Statuses with which a provider rejects a response_format it does not support
+STRUCTURED_OUTPUT_REJECTED_STATUSES = frozenset({400, 404, 422})
+# An error with one of those statuses is a rejected response_format only if it names it
+STRUCTURED_OUTPUT_ERROR_TERMS = ("response_format", "json_schema")
+
+# OpenRouter-only request fields (usage accounting, provider routing) that other OpenAI-style servers reject
+OPENROUTER_ONLY_FIELDS = ("usage", "provider")
+
+def endpoint_payload(endpoint: Endpoint, payload: dict) -> dict:
+    """The request body for `endpoint`: OpenRouter-only fields are dropped for any other server"""
+    if endpoint.is_openrouter:
+        return payload
+    return {key: value for key, value in payload.items() if key not in OPENROUTER_ONLY_FIELDS}
+
+def json_schema_response_format(name: str, schema: dict) -> dict:
+    """`response_format` value asking for output that matches a JSON schema (OpenAI/OpenRouter style)"""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": name, "strict": True, "schema": schema}
+    }
+
+def _rejects_structured_output(error: OpenRouterError) -> bool:
+    """Whether an error refuses the response_format itself (and not, e.g., a bad message)"""
+    message = error.message.lower()
+    return (error.status in STRUCTURED_OUTPUT_REJECTED_STATUSES
+            and any(term in message for term in STRUCTURED_OUTPUT_ERROR_TERMS))
+
+def _raise_for_error_body(data: dict):
+    """OpenRouter can report upstream failures inside a 200 response body or SSE chunk"""
+    if "error" in data:
+        error = data["error"] if isinstance(data["error"], dict) else {"message": data["error"]}
+        code = error.get("code")
+        raise OpenRouterError(code if isinstance(code, int) else 502, str(error.get("message", error)))
+
+@dataclass
+class ChatCompletion:
+    """
+    Result of one chat completion call
+    `billed` is False when the result came from the cache or a coalesced duplicate request
+    """
+    content: str
+    reasoning: str = ""
+    finish_reason: Optional[str] = None
+    usage: Optional[dict] = None
+    latency: float = 0.0
+    billed: bool = True
+    timing: Optional[dict] = None  # streaming metrics, when streamed
+
+    def parse_json(self) -> Optional[dict]:
+        """The content as a JSON object (structured output), or None if it is not one"""
+        try:
+            parsed = json.loads(self.content)
+        except (json.JSONDecodeError, TypeError):
+            return None
+        return parsed if isinstance(parsed, dict) else None
+
+    @classmethod
+    def from_response(cls, data: dict, latency: float = 0.0, billed: bool = True) -> 'ChatCompletion':
+        choice = data["choices"][0]
+        message = choice.get("message") or {}
+        return cls(
+            content=message.get("content") or "",
+            reasoning=message.get("reasoning") or "",
+            finish_reason=choice.get("finish_reason"),
+            usage=data.get("usage"),
+            latency=latency,
+            billed=billed
+        )
+
+class ChatStream:
+    """
+    Streaming chat completion (server-sent events)
+    Iterate with `async for delta in stream` to receive content deltas as they arrive.
+    Once iteration ends the accumulated content, finish_reason, usage and timing
+    (time-to-first-token, tokens/sec) are available as attributes and via metrics().
+
+    `stop_when` is called with the accumulated content after each content delta; once it
+    returns True the connection is closed and the stream ends with finish_reason
+    "early_stop". Usage is then estimated, since the final usage chunk never arrives.
+    """
+    def __init__(self, client: 'OpenRouterClient', payload: dict, stop_when: Optional[Callable[[str], bool]] = None):
+        self.client = client
+        self.payload = payload
+        self.stop_when = stop_when
+        self.stopped_early = False
+        self.content_parts: List[str] = []
+        self.reasoning_parts: List[str] = []
+        self.finish_reason: Optional[str] = None
+        self.usage: Optional[dict] = None
+        self.from_cache = False
+        self.started_at: Optional[float] = None  # when the successful attempt was sent
+        self.endpoint: Optional[Endpoint] = None  # endpoint that served the stream
+        self.time_to_first_token: Optional[float] = None
+        self.duration: Optional[float] = None
+        self._iterator: Optional[AsyncIterator[str]] = None
+
+    @property
+    def content(self) -> str:
+        return "".join(self.content_parts)
+
+    @property
+    def reasoning(self) -> str:
+        return "".join(self.reasoning_parts)
+
+    @property
+    def completion_tokens(self) -> int:
+        """Completion tokens from usage when reported, otherwise estimated from the text"""
+        if self.usage and self.usage.get("completion_tokens") is not None:
+            return self.usage["completion_tokens"]
+        return (len(self.content) + len(self.reasoning)) // CHARS_PER_TOKEN
+
+    @property
+    def tokens_per_second(self) -> Optional[float]:
+        """Decode speed: completion tokens over the time after the first token"""
+        if self.duration is None or self.time_to_first_token is None:
+            return None
+        generation_time = self.duration - self.time_to_first_token
+        if generation_time <= 0:
+            return None
+        return self.completion_tokens / generation_time
+
+    def metrics(self) -> dict:
+        return {
+            'time_to_first_token': self.time_to_first_token,
+            'duration': self.duration,
+            'completion_tokens': self.completion_tokens,
+            'tokens_per_second': self.tokens_per_second,
+            'finish_reason': self.finish_reason,
+            'stopped_early': self.stopped_early
+        }
+
+    def to_completion(self) -> ChatCompletion:
+        """Summary of the finished stream"""
+        return ChatCompletion(
+            content=self.content,
+            reasoning=self.reasoning,
+            finish_reason=self.finish_reason,
+            usage=self.usage,
+            latency=self.duration or 0.0,
+            billed=not self.from_cache,
+            timing=self.metrics()
+        )
+
+    def __aiter__(self) -> AsyncIterator[str]:
+        if self._iterator is None:
+            self._iterator = self._iterate()
+        return self._iterator
+
+    async def aclose(self):
+        """Stop reading and close the underlying connection"""
+        if self._iterator is not None:
+            await self._iterator.aclose()
+
+    def _to_response(self) -> dict:
+        """Non-streaming response body equivalent to this stream, used for caching"""
+        message = {"role": "assistant", "content": self.content}
+        if self.reasoning:
+            message["reasoning"] = self.reasoning
+        response = {"choices": [{"message": message, "finish_reason": self.finish_reason}]}
+        if self.usage:
+            response["usage"] = self.usage
+        return response
+
+    async def _iterate(self) -> AsyncIterator[str]:
+        client = self.client
+        cache_key = client._cache_key(self.payload)
+        cached = client.cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            # Replay the cached completion as a single delta
+            choice = cached["choices"][0]
+            self.from_cache = True
+            self.content_parts = [choice["message"].get("content") or ""]
+            self.reasoning_parts = [choice["message"].get("reasoning") or ""]
+            self.finish_reason = choice.get("finish_reason")
+            self.usage = cached.get("usage")
+            self.time_to_first_token = self.duration = 0.0
+            if self.content:
+                yield self.content
+            return
+
+        if client.budget is not None:
+            client.budget.check()
+        model = self.payload["model"]
+        estimated_tokens = estimate_request_tokens(self.payload["messages"], self.payload.get("max_tokens"))
+        # Retries only cover establishing the stream; once deltas flow an error is final
+        tried: List[Endpoint] = []
+        response, self.started_at, self.endpoint = await client.retry_policy.call(
+            lambda: client._open_stream(self.payload, estimated_tokens, tried), client.retry_stats
+        )
+        scope = client._limiter_scope(self.endpoint)
+        error = None
+        finished = False
+        try:
+            async for raw_line in response.content:
+                line = raw_line.decode("utf-8").strip()
+                # Blank keep-alives and ": OPENROUTER PROCESSING" comments carry no data
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                _raise_for_error_body(chunk)
+                if chunk.get("usage"):
+                    self.usage = chunk["usage"]
+                for choice in chunk.get("choices") or []:
+                    delta = choice.get("delta") or {}
+                    if choice.get("finish_reason"):
+                        self.finish_reason = choice["finish_reason"]
+                    reasoning = delta.get("reasoning")
+                    content = delta.get("content")
+                    if (reasoning or content) and self.time_to_first_token is None:
+                        self.time_to_first_token = time.monotonic() - self.started_at
+                    if reasoning:
+                        self.reasoning_parts.append(reasoning)
+                    if content:
+                        self.content_parts.append(content)
+                        yield content
+                if self.stop_when is not None and self.stop_when(self.content):
+                    self.stopped_early = True
+                    self.finish_reason = "early_stop"
+                    # The provider bills what it generated before we hung up; estimate it
+                    prompt_tokens = estimate_prompt_tokens(self.payload["messages"])
+                    completion_tokens = self.completion_tokens
+                    self.usage = {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens
+                    }
+                    break
+            finished = True
+            self.endpoint.record_success(time.monotonic() - self.started_at)
+            if client.budget is not None:
+                client.budget.add(normalize_usage(self.usage))
+            if cache_key:
+                client.cache.put(cache_key, self._to_response())
+        except BaseException as e:
+            error = e
+            if isinstance(e, Exception):
+                self.endpoint.record_failure()
+            else:
+                # Cancelled or closed by the consumer: release a half-open trial without counting a failure
+                self.endpoint.record_cancelled()
+            raise
+        finally:
+            self.duration = time.monotonic() - self.started_at
+            if finished and not self.stopped_early:
+                response.release()
+            else:
+                # Abandoned or stopped mid-stream: drop the connection instead of draining it
+                response.close()
+            actual_tokens = (self.usage or {}).get("total_tokens", estimated_tokens if finished else None)
+            client.rate_limiter.reconcile(model, estimated_tokens, actual_tokens, scope)
+            if client.concurrency_limiter is not None:
+                await client.concurrency_limiter.release(self.duration, error)
+
 class OpenRouterClient:
     """
     Client for interacting with the OpenRouter API (LLM provider)
     Handles both synchronous and asynchronous chat completions
+
+    The client owns a single pooled aiohttp session for its whole lifetime so that
+    TCP/TLS connections are reused across requests. Use it as an async context
+    manager (or call close()) to release the pool when done.
+
+    Pass `endpoints` to spread requests over several upstreams (API keys, OpenRouter
+    and OpenAI-compatible servers): each attempt is routed by weight to an endpoint
+    whose circuit breaker is closed, and a failed attempt is retried on another
+    endpoint immediately instead of backing off. Without it the client uses the
+    single (base_url, api_key) endpoint.
+
+    The synchronous chat()/chat_many() API runs on one long-lived event loop in a
+    background thread, so it reuses the same pool across calls and works from code
+    that already has a loop running (e.g. Jupyter). A client is meant to be used
+    either synchronously or from one event loop, not both; call shutdown() (or use
+    `with client:`) to stop the background loop.
+
+    With a `hedge_policy`, a non-streaming request still outstanding after a high
+    percentile of recent latencies is duplicated; the first copy to finish wins.
+
+    While `batch` is set (see batch.BatchCollector), non-streaming requests that miss the
+    cache are sent as part of batch jobs instead of individual HTTP calls.
     """
-    def __init__(self, api_key: str, base_url: str = "https://openrouter.ai/api/v1"):
-        """Initializes the OpenRouter client with API key and base URL"""
+    def __init__(
+        self,
+        api_key: str,
+        base_url: str = DEFAULT_BASE_URL,
+        max_connections: int = 100,
+        max_connections_per_host: int = 32,
+        keepalive_timeout: float = 30.0,
+        request_timeout: Optional[float] = DEFAULT_REQUEST_TIMEOUT,
+        connect_timeout: Optional[float] = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: Optional[float] = None,
+        retry_policy: Optional[RetryPolicy] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        concurrency_limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+        cache: Optional[CompletionCache] = None,
+        budget: Optional[UsageBudget] = None,
+        endpoints: Optional[List[Endpoint]] = None,
+        hedge_policy: Optional[HedgePolicy] = None
+    ):
+        """Initializes the OpenRouter client with API key, base URL, connection pool limits and deadlines"""
         self.api_key = api_key
         self.base_url = base_url
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        self.max_connections = max_connections
+        self.max_connections_per_host = max_connections_per_host
+        self.keepalive_timeout = keepalive_timeout
+        # Applies to every attempt; a timed-out attempt raises asyncio.TimeoutError and is retried
+        self.timeout = aiohttp.ClientTimeout(
+            total=request_timeout, sock_connect=connect_timeout, sock_read=read_timeout
+        )
+        self._session: Optional[aiohttp.ClientSession] = None
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.retry_stats = RetryStats()
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.concurrency_limiter = concurrency_limiter
+        self.cache = cache
+        self.budget = budget
+        self.pool = EndpointPool(endpoints or [Endpoint(base_url, api_key)])
+        self.hedge_policy = hedge_policy
+        self.hedge_stats = HedgeStats()
+        # In-flight requests by fingerprint, for coalescing identical concurrent calls
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[asyncio.Future, int] = {}
+        # Models that rejected a response_format; later requests to them omit it
+        self.structured_output_unsupported: set = set()
+        self.coalesced_requests = 0
+        # Set to a batch.BatchCollector to send non-streaming requests as batch jobs
+        self.batch = None
+        # Background event loop for the synchronous API, started on first use
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[threading.Thread] = None
+        self._loop_lock = threading.Lock()
         logger.info("Initialized OpenRouterClient")
 
+    async def __aenter__(self):
+        self._get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.shutdown()
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Return the shared session, creating it (and its connection pool) on first use
+        Must be called from inside a running event loop
+        """
+        if self._session is None or self._session.closed:
+            # Create SSL context that doesn't verify certificates (for development)
+            ssl_context = ssl.create_default_context()
+            ssl_context.check_hostname = False
+            ssl_context.verify_mode = ssl.CERT_NONE
+
+            connector = aiohttp.TCPConnector(
+                ssl=ssl_context,
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                keepalive_timeout=self.keepalive_timeout
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        """Close the shared session and release pooled connections"""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def _send(self, endpoint: Endpoint, payload: dict) -> dict:
+        """Send the HTTP request on the pooled session and decode the JSON body; raises OpenRouterError on API errors"""
+        session = self._get_session()
+        url = f"{endpoint.base_url}/chat/completions"
+        async with session.post(url, headers=endpoint.headers, json=endpoint_payload(endpoint, payload)) as response:
+            if response.status != 200:
+                raise OpenRouterError(
+                    response.status,
+                    await response.text(),
+                    retry_after=parse_retry_after(response.headers.get("Retry-After"))
+                )
+            data = await response.json()
+
+        _raise_for_error_body(data)
+        if not data.get("choices"):
+            raise OpenRouterError(502, "Response contained no choices")
+        return data
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Return the background event loop, starting its daemon thread on first use"""
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="OpenRouterClient-loop", daemon=True)
+                thread.start()
+                self._loop, self._loop_thread = loop, thread
+            return self._loop
+
+    def _run_sync(self, coro):
+        """Run a coroutine on the background loop and block the calling thread for its result"""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop()).result()
+
+    def shutdown(self):
+        """Close the pooled session on the background loop and stop its thread (no-op if never started)"""
+        with self._loop_lock:
+            loop, thread = self._loop, self._loop_thread
+            self._loop = self._loop_thread = None
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.close(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
     def chat(self, model: str, messages: list, **kwargs):
         """
         Synchronous chat completion using the OpenRouter API
-        Internally runs the async version using asyncio.run
+        Runs the async version on the client's background event loop; safe to call from
+        any thread, including one that already runs an event loop
+        """
+        return self._run_sync(self.async_chat(model, messages, **kwargs))
+
+    def chat_many(self, requests: List[dict], return_exceptions: bool = False) -> list:
         """
-        return asyncio.run(self.async_chat(model, messages, **kwargs))
+        Synchronous fan-out: run many chat completions concurrently and return their contents in order
+        Each request is a dict of async_chat arguments, e.g. {"model": ..., "messages": ..., "temperature": 0}.
+        With return_exceptions=True failed requests yield their exception instead of raising.
+        """
+        async def run_all():
+            return await asyncio.gather(
+                *(self.async_chat(**request) for request in requests), return_exceptions=return_exceptions
+            )
+        return self._run_sync(run_all())
     
     async def async_chat(self, model: str, messages: list, **kwargs):
         """
         Asynchronous chat completion using the OpenRouter API
-        Sends a POST request to the /chat/completions endpoint
+        Sends a POST request to the /chat/completions endpoint, retrying transient
+        failures according to the client's retry policy. With stream=True the
+        completion is received over SSE and the full content is returned at the end.
         """
-        url = f"{self.base_url}/chat/completions"
+        completion = await self.async_complete(model, messages, **kwargs)
+        return completion.content
+
+    async def async_complete(self, model: str, messages: list, **kwargs) -> ChatCompletion:
+        """
+        Like async_chat, but returns the full ChatCompletion (content, finish reason, usage, latency)
+        A `response_format` (see json_schema_response_format) is routed on OpenRouter only to
+        providers that support it; if the model rejects it the request is repeated once without it and the
+        model is remembered, so callers must still handle free-form content.
+        """
+        if "response_format" in kwargs:
+            if model in self.structured_output_unsupported:
+                kwargs = {k: v for k, v in kwargs.items() if k != "response_format"}
+            else:
+                provider = {**kwargs.get("provider", {}), "require_parameters": True}
+                try:
+                    return await self._complete(model, messages, **{**kwargs, "provider": provider})
+                except OpenRouterError as e:
+                    if not _rejects_structured_output(e):
+                        raise
+                    logger.warning(f"{model} rejected structured output ({e.status}), falling back to free-form output")
+                    self.structured_output_unsupported.add(model)
+                    kwargs = {k: v for k, v in kwargs.items() if k != "response_format"}
+        return await self._complete(model, messages, **kwargs)
+
+    async def _complete(self, model: str, messages: list, **kwargs) -> ChatCompletion:
+        stop_when = kwargs.pop("stop_when", None)  # only the streaming path can stop early
+        if kwargs.pop("stream", False):
+            stream = self.async_chat_stream(model, messages, stop_when=stop_when, **kwargs)
+            async for _ in stream:
+                pass
+            return stream.to_completion()
         payload = {
             "model": model,
             "messages": messages,
             **kwargs
         }
-        
-        # Create SSL context that doesn't verify certificates (for development)
-        ssl_context = ssl.create_default_context()
-        ssl_context.check_hostname = False
-        ssl_context.verify_mode = ssl.CERT_NONE
-        
-        connector = aiohttp.TCPConnector(ssl=ssl_context)
-        async with aiohttp.ClientSession(connector=connector) as session:
-            async with session.post(url, headers=self.headers, json=payload) as response:
-                if response.status != 200:
-                    raise Exception(f"Error: {response.status} - {await response.text()}")
-                data = await response.json()
-                return data["choices"][0]["message"]["content"]
+        start = time.monotonic()
+        data, billed = await self._single_flight(payload)
+        return ChatCompletion.from_response(data, latency=time.monotonic() - start, billed=billed)
+
+    async def _single_flight(self, payload: dict) -> tuple:
+        """
+        Coalesce concurrent identical requests into one upstream call; returns (data, billed)
+        The first caller starts a task; later callers with the same fingerprint await it.
+        The task is shielded so one caller being cancelled does not fail the others;
+        once every caller has been cancelled the upstream request is cancelled too.
+        """
+        key = request_fingerprint(self.base_url, payload)
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced_requests += 1
+            data, _ = await self._wait_shared(task)
+            return data, False
+
+        task = asyncio.ensure_future(self._fetch(payload))
+        self._inflight[key] = task
+        # Retrieve the exception even if every waiter was cancelled, and forget the key when done
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        task.add_done_callback(lambda t: self._inflight.pop(key, None))
+        return await self._wait_shared(task)
+
+    async def _wait_shared(self, task: asyncio.Future) -> tuple:
+        """Await a shared request task; the last waiter to be cancelled cancels the task"""
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[task] == 1:
+                task.cancel()
+            raise
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+
+    async def _fetch(self, payload: dict) -> tuple:
+        """Cache lookup, then the retried upstream request, then cache store; returns (data, billed)"""
+        cache_key = self._cache_key(payload)
+        data = self.cache.get(cache_key) if cache_key else None
+        if data is not None:
+            return data, False
+        if self.budget is not None:
+            self.budget.check()
+        tried: List[Endpoint] = []
+        if self.batch is not None:
+            # Batch mode: the request goes into the collector's next job instead of over HTTP
+            data = await self.retry_policy.call(lambda: self.batch.request(payload), self.retry_stats)
+            from_alternate = False
+        elif self.hedge_policy is None:
+            data = await self.retry_policy.call(lambda: self._post_chat(payload, tried), self.retry_stats)
+            from_alternate = False
+        else:
+            data, from_alternate = await self._hedged_call(payload, tried)
+        if self.budget is not None:
+            self.budget.add(normalize_usage(data.get("usage")))
+        # An answer from the hedge model route is not what this request's key describes
+        if cache_key and not from_alternate:
+            self.cache.put(cache_key, data)
+        return data, True
+
+    async def _hedged_call(self, payload: dict, tried: List[Endpoint]) -> tuple:
+        """
+        Retried request plus, if it is slow, a retried duplicate; returns (data, from_alternate)
+        `from_alternate` is True when the duplicate won and was sent to `hedge_model`.
+        The loser is cancelled, which closes its connection (the provider may still bill it).
+        """
+        policy, stats = self.hedge_policy, self.hedge_stats
+        model = payload["model"]
+        stats.requests += 1
+        start = time.monotonic()
+        primary = asyncio.ensure_future(
+            self.retry_policy.call(lambda: self._post_chat(payload, tried), self.retry_stats)
+        )
+        hedge = None
+        try:
+            delay = policy.hedge_delay(model)
+            if delay is not None:
+                await asyncio.wait({primary}, timeout=delay)
+            if primary.done() or delay is None or not policy.may_hedge(stats):
+                data = await primary
+                policy.record_latency(model, time.monotonic() - start)
+                return data, False
+
+            stats.hedged += 1
+            logger.info(f"Hedging request to {model} after {delay:.1f}s")
+            hedge_payload = {**payload, "model": policy.hedge_model} if policy.hedge_model else payload
+            # Prefer endpoints the original has not used
+            hedge_tried = list(tried)
+            hedge = asyncio.ensure_future(
+                self.retry_policy.call(lambda: self._post_chat(hedge_payload, hedge_tried), self.retry_stats)
+            )
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        if task is hedge:
+                            stats.hedge_failures += 1
+                        error = error or task.exception()
+                        continue
+                    elapsed = time.monotonic() - start
+                    if task is hedge:
+                        stats.hedge_wins += 1
+                        stats.estimated_time_saved += policy.estimate_saving(model, elapsed)
+                    # For a hedge win this is a lower bound on the original's latency
+                    policy.record_latency(model, elapsed)
+                    return task.result(), task is hedge and policy.hedge_model is not None
+            raise error
+        finally:
+            for task in (primary, hedge):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    def _cache_key(self, payload: dict) -> Optional[str]:
+        """Cache key for a request, or None when caching is off"""
+        if self.cache is None or not self.cache.enabled:
+            return None
+        return request_fingerprint(self.base_url, payload)
+
+    def async_chat_stream(self, model: str, messages: list, stop_when: Optional[Callable[[str], bool]] = None,
+                          **kwargs) -> ChatStream:
+        """
+        Streaming chat completion: returns a ChatStream that yields content deltas
+        The request is sent when iteration starts; see ChatStream for `stop_when`
+        """
+        payload = {
+            "model": model,
+            "messages": messages,
+            **kwargs,
+            "stream": True,
+            # Ask for the usage block in the final chunk
+            "stream_options": {"include_usage": True}
+        }
+        return ChatStream(self, payload, stop_when=stop_when)
+
+    async def _open_stream(self, payload: dict, estimated_tokens: int, tried: List[Endpoint]) -> tuple:
+        """
+        Single attempt at opening a streaming completion; returns (response, send time, endpoint)
+        On success the concurrency slot stays held until the ChatStream finishes
+        """
+        model = payload["model"]
+        endpoint = self.pool.choose(exclude=tried)
+        tried.append(endpoint)
+        scope = self._limiter_scope(endpoint)
+        await self.rate_limiter.acquire(model, estimated_tokens, scope)
+        if self.concurrency_limiter is not None:
+            await self.concurrency_limiter.acquire()
+        started_at = time.monotonic()
+        try:
+            url = f"{endpoint.base_url}/chat/completions"
+            response = await self._get_session().post(url, headers=endpoint.headers, json=endpoint_payload(endpoint, payload))
+            if response.status != 200:
+                try:
+                    message = await response.text()
+                finally:
+                    response.release()
+                raise OpenRouterError(
+                    response.status,
+                    message,
+                    retry_after=parse_retry_after(response.headers.get("Retry-After"))
+                )
+        except BaseException as e:
+            self.rate_limiter.reconcile(model, estimated_tokens, None, scope)
+            if self.concurrency_limiter is not None:
+                await self.concurrency_limiter.release(time.monotonic() - started_at, e)
+            self._endpoint_failed(endpoint, e, tried)
+            raise
+        return response, started_at, endpoint
+
+    async def _post_chat(self, payload: dict, tried: Optional[List[Endpoint]] = None) -> dict:
+        """
+        Single attempt at /chat/completions on an endpoint chosen by the pool
+        Every attempt is admitted by the rate limiter, which is corrected from `usage` afterwards.
+        `tried` collects the endpoints used by earlier attempts so a retry goes elsewhere.
+        """
+        tried = tried if tried is not None else []
+        endpoint = self.pool.choose(exclude=tried)
+        tried.append(endpoint)
+        scope = self._limiter_scope(endpoint)
+        model = payload["model"]
+        estimated_tokens = estimate_request_tokens(payload["messages"], payload.get("max_tokens"))
+        await self.rate_limiter.acquire(model, estimated_tokens, scope)
+        actual_tokens = None
+        start = time.monotonic()
+        try:
+            if self.concurrency_limiter is not None:
+                async with self.concurrency_limiter.slot():
+                    data = await self._send(endpoint, payload)
+            else:
+                data = await self._send(endpoint, payload)
+            endpoint.record_success(time.monotonic() - start)
+            # Keep the reservation as-is when the provider omits usage
+            actual_tokens = (data.get("usage") or {}).get("total_tokens", estimated_tokens)
+        except BaseException as e:
+            self._endpoint_failed(endpoint, e, tried)
+            raise
+        finally:
+            self.rate_limiter.reconcile(model, estimated_tokens, actual_tokens, scope)
+        return data
+
+    def _limiter_scope(self, endpoint: Endpoint) -> Optional[str]:
+        """Rate limits are per API key, so each endpoint gets its own buckets when there are several"""
+        return endpoint.name if len(self.pool.endpoints) > 1 else None
+
+    def _endpoint_failed(self, endpoint: Endpoint, exc: BaseException, tried: List[Endpoint]):
+        """
+        Record a failed attempt against the endpoint's breaker
+        Only transient errors and key/quota errors count; a bad request would fail anywhere.
+        When another healthy endpoint is left, mark the error so the retry fails over at once.
+        """
+        if not isinstance(exc, Exception):
+            # Cancellation says nothing about the endpoint, but must not keep a half-open trial forever
+            endpoint.record_cancelled()
+            return
+        if getattr(exc, 'status', None) not in ENDPOINT_FAULT_STATUSES and not self.retry_policy.is_retryable(exc):
+            endpoint.record_cancelled()  # the endpoint answered; a bad request would fail anywhere
+            return
+        endpoint.record_failure()
+        if self.pool.has_alternative(endpoint, exclude=tried):
+            exc.retry_elsewhere = True
+            self.pool.failovers += 1
+            logger.info(f"Failing over from {endpoint.name} after: {exc}")
             
 if __name__ == "__main__":
     client = OpenRouterClient(os.getenv('OPENROUTER_API_KEY'))
@@ -61,3 +759,4 @@ if __name__ == "__main__":
     print(client.chat(model="google/gemini-2.5-flash", messages=[{"role": "user", "content": "Hello, how are you?"}]))
     print(client.chat(model="z-ai/glm-4.5", messages=[{"role": "user", "content": "Hello, how are you?"}]))
     print(client.chat(model="qwen/qwen3-next-80b-a3b-thinking", messages=[{"role": "user", "content": "Hello, how are you?"}]))
+    client.shutdown()
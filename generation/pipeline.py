@@ -0,0 +1,213 @@
+"""
+Staged producer/consumer pipeline.
+
+Items flow through a fixed sequence of stages connected by bounded asyncio queues. Each
+stage has its own number of workers, so network-bound stages can keep many requests in
+flight while CPU-bound ones stay small, and a full queue pushes back on the stages
+before it instead of piling up work. Per-stage queue depth, throughput and utilization
+show which stage is the bottleneck.
+"""
+
+import asyncio
+import contextvars
+import logging
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def parse_stage_workers(values: Iterable[str]) -> Dict[str, int]:
+    """Parse ["llm=64", "sandbox=8"] into {"llm": 64, "sandbox": 8}"""
+    workers = {}
+    for value in values or ():
+        name, sep, count = value.partition("=")
+        if not sep or not count.strip().isdigit() or int(count) < 1:
+            raise ValueError(f"Expected STAGE=WORKERS with a positive count, got {value!r}")
+        workers[name.strip()] = int(count)
+    return workers
+
+
+@dataclass
+class Stage:
+    """A named step: `func(item)` returns the item for the next stage, or None when it is done with it"""
+    name: str
+    func: Callable[[Any], Awaitable[Any]]
+    workers: int = 1
+    queue_size: Optional[int] = None  # inbound queue bound; default 2 x workers
+
+
+@dataclass
+class StageStats:
+    """Counters for one stage over a pipeline run"""
+    name: str
+    workers: int
+    processed: int = 0
+    dropped: int = 0  # items the stage finished early (returned None or raised), not counting resubmits
+    busy_seconds: float = 0.0  # summed over workers
+    peak_depth: int = 0
+    depth_samples: int = 0
+    depth_total: int = 0
+
+    def sample_depth(self, depth: int):
+        self.peak_depth = max(self.peak_depth, depth)
+        self.depth_samples += 1
+        self.depth_total += depth
+
+    @property
+    def mean_depth(self) -> float:
+        return self.depth_total / self.depth_samples if self.depth_samples else 0.0
+
+    def utilization(self, elapsed: float) -> float:
+        """Fraction of the stage's worker time spent processing items"""
+        return self.busy_seconds / (self.workers * elapsed) if elapsed > 0 else 0.0
+
+
+class _Entry:
+    """An item's current value on its way through the queues, tagged with the source item it came from"""
+    __slots__ = ("key", "origin", "value", "resubmitted")
+
+    def __init__(self, key: int, origin: Any, value: Any):
+        self.key = key
+        self.origin = origin
+        self.value = value
+        self.resubmitted = False
+
+
+class Pipeline:
+    """
+    Runs items through `stages`; outputs of the last stage are returned by run()
+    A stage may send an item back to the start with resubmit() (e.g. to retry it with
+    another model) and then return None. Resubmitted items wait in an unbounded queue
+    so that sending work backwards can never deadlock against the bounded ones.
+    """
+    def __init__(self, stages: List[Stage], on_done: Optional[Callable[[Any, Any], None]] = None):
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self.stages = stages
+        self.on_done = on_done  # called with (item, output or None) whenever an item leaves
+        self.stats: Dict[str, StageStats] = {stage.name: StageStats(stage.name, stage.workers) for stage in stages}
+        self.elapsed = 0.0
+        self.unfinished: List[Any] = []  # items still in the pipeline when run() stopped
+        self._queues: List[asyncio.Queue] = []
+        self._resubmitted: Optional[asyncio.Queue] = None
+        self._inside: Dict[int, Any] = {}  # source items that have not finished, by entry key
+        self._fed = 0
+        self._source_done = False
+        self._finished: Optional[asyncio.Event] = None
+        self._current: contextvars.ContextVar = contextvars.ContextVar("pipeline_entry")
+
+    def resubmit(self, item: Any):
+        """From inside a stage: send `item` (the value being processed, or a replacement) back to the first stage"""
+        entry = self._current.get()
+        entry.resubmitted = True
+        self._resubmitted.put_nowait(_Entry(entry.key, entry.origin, item))
+
+    def _leave(self, entry: _Entry, output: Any = None):
+        if self._inside.pop(entry.key, None) is None:
+            return
+        if self.on_done is not None:
+            self.on_done(entry.origin, output)
+        self._check_finished()
+
+    def _check_finished(self):
+        if self._source_done and not self._inside:
+            self._finished.set()
+
+    async def _put(self, index: int, entry: _Entry):
+        queue = self._queues[index]
+        await queue.put(entry)
+        self.stats[self.stages[index].name].sample_depth(queue.qsize())
+
+    async def _feed(self, items: List[Any]):
+        """Move source items, and any resubmitted ones, into the first stage"""
+        for key, item in enumerate(items):
+            while not self._resubmitted.empty():
+                await self._put(0, self._resubmitted.get_nowait())
+            self._fed += 1
+            self._inside[key] = item
+            await self._put(0, _Entry(key, item, item))
+        self._source_done = True
+        self._check_finished()
+        while True:
+            await self._put(0, await self._resubmitted.get())
+
+    async def _work(self, index: int, outputs: List[Any]):
+        stage = self.stages[index]
+        stats = self.stats[stage.name]
+        queue = self._queues[index]
+        last = index == len(self.stages) - 1
+        while True:
+            entry = await queue.get()
+            self._current.set(entry)
+            started = time.monotonic()
+            try:
+                result = await stage.func(entry.value)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Pipeline stage {stage.name} failed: {e}")
+                result = None
+            finally:
+                stats.busy_seconds += time.monotonic() - started
+            stats.processed += 1
+            if result is None:
+                if not entry.resubmitted:
+                    stats.dropped += 1
+                    self._leave(entry)
+            elif last:
+                outputs.append(result)
+                self._leave(entry, result)
+            else:
+                entry.value = result
+                await self._put(index + 1, entry)
+
+    async def run(self, items: Iterable[Any], timeout: Optional[float] = None) -> List[Any]:
+        """
+        Push every item through the stages and return the last stage's outputs (in completion order)
+        Past `timeout` seconds the workers are cancelled, asyncio.TimeoutError is raised and
+        the items that did not finish are left in `unfinished`.
+        """
+        items = list(items)
+        self._queues = [asyncio.Queue(maxsize=stage.queue_size or 2 * stage.workers) for stage in self.stages]
+        self._resubmitted = asyncio.Queue()
+        self._inside = {}
+        self._fed = 0
+        self._source_done = False
+        self._finished = asyncio.Event()
+        self.unfinished = []
+        outputs: List[Any] = []
+        tasks = [asyncio.ensure_future(self._feed(items))]
+        for index, stage in enumerate(self.stages):
+            tasks.extend(asyncio.ensure_future(self._work(index, outputs)) for _ in range(stage.workers))
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(self._finished.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.unfinished = list(self._inside.values()) + items[self._fed:]
+            raise
+        finally:
+            self.elapsed += time.monotonic() - started
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+        return outputs
+
+    def bottleneck(self) -> Optional[str]:
+        """The stage with the highest utilization"""
+        if not self.elapsed:
+            return None
+        return max(self.stats.values(), key=lambda stats: stats.utilization(self.elapsed)).name
+
+    def format_report(self) -> str:
+        """Table of workers, items, queue depth and utilization per stage"""
+        header = f"{'stage':<10} {'workers':>7} {'items':>7} {'dropped':>7} {'mean q':>7} {'peak q':>7} {'util':>6}"
+        lines = [header, "-" * len(header)]
+        for stats in self.stats.values():
+            lines.append(
+                f"{stats.name:<10} {stats.workers:>7} {stats.processed:>7} {stats.dropped:>7} "
+                f"{stats.mean_depth:>7.1f} {stats.peak_depth:>7} {stats.utilization(self.elapsed):>6.0%}"
+            )
+        lines.append(f"bottleneck: {self.bottleneck()} ({self.elapsed:.1f}s)")
+        return "\n".join(lines)
@@ -8,19 +8,27 @@ logger = logging.getLogger(__name__)
 from utils import test_code_multi_cases
 from data_structures import CodeResult
 
-def get_naive_coder_prompt(problem_description: str, input_format: str) -> str:
-    """Generate prompt for naive coder persona."""
-    return f"""You are a competitive programmer who solves problems in a very straightforward way.
+# Part of every work ledger unit: bump it when a prompt changes so earlier responses are regenerated
+PROMPT_VERSION = "1"
+
+def get_problem_context(problem_description: str) -> str:
+    """
+    The problem block shared by every persona's prompt
+    In the prompt-cache layout it is sent first, identically for all personas of a problem,
+    so providers can reuse the cached prefix; the persona instructions follow it.
+    """
+    return f"""Problem:
+{problem_description}"""
+
+NAIVE_CODER_PREAMBLE = """You are a competitive programmer who solves problems in a very straightforward way.
 
 Given a competitive programming problem, write a solution that:
 - Uses the most obvious approach (even if inefficient)
 - Doesn't worry about time/space complexity
-- Guarantees correctness for very small test cases
+- Guarantees correctness for very small test cases"""
 
-Problem:
-{problem_description}
-
-Input format:
+def _naive_coder_task(input_format: str) -> str:
+    return f"""Input format:
 {input_format}
 
 Write your code in Python. The expected formatting is:
@@ -28,6 +36,14 @@ Write your code in Python. The expected formatting is:
 YOUR CODE HERE
 ```"""
 
+def get_naive_coder_prompt(problem_description: str, input_format: str) -> str:
+    """Generate prompt for naive coder persona."""
+    return f"{NAIVE_CODER_PREAMBLE}\n\n{get_problem_context(problem_description)}\n\n{_naive_coder_task(input_format)}"
+
+def get_naive_coder_instructions(input_format: str) -> str:
+    """Naive coder prompt without the problem, to follow get_problem_context() in the prompt-cache layout"""
+    return f"{NAIVE_CODER_PREAMBLE}\n\n{_naive_coder_task(input_format)}"
+
 def normalize_text(text):
     """Normalize text for comparison by removing extra whitespace and converting to lowercase."""
     if isinstance(text, list):
@@ -139,8 +155,46 @@ def filter_inputs_already_in_description(problem_description: str, test_inputs:
     
     return filtered_inputs, filtered_outputs
 
-def get_reasoner_prompt(problem_description: str, test_inputs: list, test_outputs: list = None, disable_filtering: bool = False) -> str:
-    """Generate prompt for reasoner persona."""
+def _reasoner_answer_format(structured: bool) -> str:
+    """Closing instructions of the reasoner prompt: a trailing ```json block, or the schema's JSON object"""
+    if structured:
+        return """
+Respond with a single JSON object: put your detailed step-by-step reasoning in "reasoning", then the expected output for each test input, in order, in "outputs". Do not repeat the outputs anywhere else."""
+    return """
+Please provide your detailed reasoning as text, and at the very end, include a JSON object with the outputs.
+
+IMPORTANT: You must end your response with a JSON object in this exact format:
+
+```json
+{
+  "outputs": ["4", "-1", "15"]
+}
+```"""
+
+REASONER_PREAMBLE = """You are a competitive programmer who reasons through test case inputs for problems to get the outputs.
+
+Given a competitive programming problem with sample inputs and outputs, and additional test inputs:
+1. Look at the problem description and understand the pattern from the sample inputs/outputs.
+2. For each additional test input, reason through it step-by-step like you would on paper.
+3. Show your work and explain your reasoning process.
+4. Provide the expected output for each test input."""
+
+def get_reasoner_prompt(problem_description: str, test_inputs: list, test_outputs: list = None, disable_filtering: bool = False, structured: bool = False) -> str:
+    """
+    Generate prompt for reasoner persona.
+    With structured=True the answer format is the JSON object of get_reasoner_schema(),
+    for use with a response_format that enforces it.
+    """
+    task = _reasoner_task(problem_description, test_inputs, test_outputs, disable_filtering, structured)
+    return f"{REASONER_PREAMBLE}\n\n{get_problem_context(problem_description)}\n\n{task}"
+
+def get_reasoner_instructions(problem_description: str, test_inputs: list, test_outputs: list = None, disable_filtering: bool = False, structured: bool = False) -> str:
+    """Reasoner prompt without the problem, to follow get_problem_context() in the prompt-cache layout"""
+    task = _reasoner_task(problem_description, test_inputs, test_outputs, disable_filtering, structured)
+    return f"{REASONER_PREAMBLE}\n\n{task}"
+
+def _reasoner_task(problem_description: str, test_inputs: list, test_outputs: list, disable_filtering: bool, structured: bool) -> str:
+    """The test inputs to reason through and the answer format"""
     # Filter out inputs that already appear in the problem description (unless disabled)
     if disable_filtering:
         filtered_inputs, filtered_outputs = test_inputs, test_outputs
@@ -155,47 +209,47 @@ def get_reasoner_prompt(problem_description: str, test_inputs: list, test_output
         inputs_text = "\n".join([f"Input {i+1}: {inp}" for i, inp in enumerate(filtered_inputs)])
         additional_instruction = "For each test input, show your step-by-step reasoning and provide the expected output."
     
-    res = f"""You are a competitive programmer who reasons through test case inputs for problems to get the outputs.
-
-Given a competitive programming problem with sample inputs and outputs, and additional test inputs:
-1. Look at the problem description and understand the pattern from the sample inputs/outputs.
-2. For each additional test input, reason through it step-by-step like you would on paper.
-3. Show your work and explain your reasoning process.
-4. Provide the expected output for each test input.
-
-Problem:
-{problem_description}
-
-Additional test inputs to reason through:
+    return f"""Additional test inputs to reason through:
 {inputs_text}
 
 {additional_instruction}
-
-Please provide your detailed reasoning as text, and at the very end, include a JSON object with the outputs.
-
-IMPORTANT: You must end your response with a JSON object in this exact format:
-
-```json
-{{
-  "outputs": ["4", "-1", "15"]
-}}
-```"""
-    return res
+""" + _reasoner_answer_format(structured)
 
 def get_reasoner_schema() -> Dict[str, Any]:
     """Get JSON schema for structured output from reasoner."""
     return {
         "type": "object",
         "properties": {
+            # Listed first so the model reasons before committing to outputs
+            "reasoning": {
+                "type": "string",
+                "description": "Step-by-step reasoning through each test input"
+            },
             "outputs": {
                 "type": "array",
                 "items": {"type": "string"},
                 "description": "Expected outputs for each test input in order"
             }
         },
-        "required": ["outputs"]
+        # Strict mode: every property required and no others allowed
+        "required": ["reasoning", "outputs"],
+        "additionalProperties": False
     }
 
+def get_reasoner_repair_prompt(num_outputs: int) -> str:
+    """Follow-up asking the reasoner for just the outputs JSON its previous reply was missing"""
+    return f"""Your previous reply did not end with a valid outputs JSON object. Reply with only that JSON object, one output for each of the {num_outputs} test inputs in order, and nothing else:
+
+```json
+{{
+  "outputs": ["4", "-1", "15"]
+}}
+```"""
+
+def get_naive_repair_prompt() -> str:
+    """Follow-up asking the naive coder for just the code block its previous reply was missing"""
+    return "Your previous reply did not contain a ```python code block. Reply with only your final solution as a single ```python code block, and nothing else."
+
 def parse_input_output(input_output_str: str) -> dict:
     """Parse the input_output field to extract inputs and outputs."""
     try:
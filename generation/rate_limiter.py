@@ -0,0 +1,144 @@
+"""
+Client-side rate limiting for LLM API calls.
+
+Tracks requests/min and tokens/min per model with token buckets. Token usage is
+estimated from the prompt (plus the requested completion budget) before a request
+is sent, and corrected from the actual `usage` block once the response arrives.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio for English text and code
+CHARS_PER_TOKEN = 4
+# Per-message overhead for role markers and separators
+TOKENS_PER_MESSAGE = 4
+
+
+def estimate_prompt_tokens(messages: list) -> int:
+    """Estimate the number of prompt tokens in a list of chat messages"""
+    total = 0
+    for message in messages:
+        content = message.get("content", "")
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        total += TOKENS_PER_MESSAGE + len(str(content)) // CHARS_PER_TOKEN
+    return total
+
+
+def estimate_request_tokens(messages: list, max_tokens: Optional[int] = None) -> int:
+    """
+    Estimate the tokens a request will be charged for
+    Providers count the completion against tokens/min, so max_tokens is reserved up front
+    """
+    return estimate_prompt_tokens(messages) + (max_tokens or 0)
+
+
+class TokenBucket:
+    """
+    Classic token bucket: holds up to `capacity` tokens and refills continuously
+    The level may go negative when a correction reveals that more was used than reserved
+    """
+    def __init__(self, capacity: float, refill_per_second: float):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.refill_per_second)
+        self.updated = now
+
+    def time_until(self, amount: float) -> float:
+        """Seconds until `amount` tokens are available (requests larger than capacity wait for a full bucket)"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.refill_per_second
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float):
+        """Return tokens (negative amount charges extra), never exceeding capacity"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """
+    Per-model requests/min and tokens/min limiter shared by every request a client makes
+    A limit of None disables that dimension; `model_limits` overrides the defaults per model
+    as {model: (requests_per_minute, tokens_per_minute)}. An optional `scope` (e.g. the
+    endpoint/API key) gives each scope its own buckets, since quotas are per key
+    """
+    def __init__(
+        self,
+        requests_per_minute: Optional[float] = None,
+        tokens_per_minute: Optional[float] = None,
+        model_limits: Optional[Dict[str, tuple]] = None
+    ):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.model_limits = dict(model_limits or {})
+        self._buckets: Dict[str, tuple] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self.waits = 0
+        self.wait_time = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.requests_per_minute or self.tokens_per_minute or self.model_limits)
+
+    def _get_buckets(self, model: str, scope: Optional[str] = None) -> tuple:
+        key = (scope, model)
+        if key not in self._buckets:
+            rpm, tpm = self.model_limits.get(model, (self.requests_per_minute, self.tokens_per_minute))
+            request_bucket = TokenBucket(rpm, rpm / 60.0) if rpm else None
+            token_bucket = TokenBucket(tpm, tpm / 60.0) if tpm else None
+            self._buckets[key] = (request_bucket, token_bucket)
+            self._locks[key] = asyncio.Lock()
+        return self._buckets[key]
+
+    async def acquire(self, model: str, estimated_tokens: int = 0, scope: Optional[str] = None):
+        """Wait until one request and `estimated_tokens` tokens are available for the model"""
+        if not self.enabled:
+            return
+        request_bucket, token_bucket = self._get_buckets(model, scope)
+        # Waiters queue on the lock so capacity is handed out in FIFO order
+        async with self._locks[(scope, model)]:
+            while True:
+                wait = 0.0
+                if request_bucket is not None:
+                    wait = max(wait, request_bucket.time_until(1))
+                if token_bucket is not None:
+                    wait = max(wait, token_bucket.time_until(estimated_tokens))
+                if wait <= 0:
+                    break
+                self.waits += 1
+                self.wait_time += wait
+                await asyncio.sleep(wait)
+            if request_bucket is not None:
+                request_bucket.consume(1)
+            if token_bucket is not None:
+                token_bucket.consume(estimated_tokens)
+
+    def reconcile(self, model: str, estimated_tokens: int, actual_tokens: Optional[int], scope: Optional[str] = None):
+        """Correct a reservation once the real token count is known (None refunds it entirely)"""
+        if not self.enabled:
+            return
+        _, token_bucket = self._get_buckets(model, scope)
+        if token_bucket is None:
+            return
+        token_bucket.refund(estimated_tokens - (actual_tokens or 0))
+
+    def __str__(self) -> str:
+        return (f"RateLimiter(rpm={self.requests_per_minute}, tpm={self.tokens_per_minute}, "
+                f"waits={self.waits}, wait_time={self.wait_time:.1f}s)")
@@ -0,0 +1,76 @@
+"""
+Targeted repair of responses whose answer could not be parsed.
+
+Rather than regenerating a whole trace, the conversation is continued with a short
+follow-up asking only for the missing piece: the reasoner's outputs JSON or the naive
+coder's final code block. The reasoning already in the reply is kept, and a follow-up
+costs a small fraction of the original completion.
+"""
+
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+# Only the answer block is wanted back, so follow-ups get a small completion budget
+REPAIR_MAX_TOKENS = 2000
+
+
+def repair_messages(messages: List[Dict[str, str]], reply: str, instruction: str) -> List[Dict[str, str]]:
+    """The conversation so far, the reply that could not be parsed and a follow-up asking for just the answer"""
+    return messages + [
+        {"role": "assistant", "content": reply},
+        {"role": "user", "content": instruction}
+    ]
+
+
+@dataclass
+class _PersonaStats:
+    responses: int = 0
+    parse_failures: int = 0
+    repaired: int = 0
+    attempts: int = 0
+    tokens: int = 0  # total tokens (prompt + completion) of the follow-up calls
+
+
+class RepairStats:
+    """Per-persona parse failures, how many follow-ups fixed them and the tokens they cost"""
+    def __init__(self):
+        self.personas: Dict[str, _PersonaStats] = defaultdict(_PersonaStats)
+
+    def record_response(self, persona: str):
+        self.personas[persona].responses += 1
+
+    def record_repair(self, persona: str, attempts: int, repaired: bool, usage: Optional[Dict[str, Any]]):
+        stats = self.personas[persona]
+        stats.parse_failures += 1
+        stats.repaired += int(repaired)
+        stats.attempts += attempts
+        stats.tokens += (usage or {}).get("total_tokens", 0)
+
+    def repair_rate(self, persona: str) -> float:
+        """Fraction of parse failures that a follow-up fixed"""
+        stats = self.personas[persona]
+        return stats.repaired / stats.parse_failures if stats.parse_failures else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            persona: {
+                'responses': stats.responses,
+                'parse_failures': stats.parse_failures,
+                'repaired': stats.repaired,
+                'repair_rate': self.repair_rate(persona),
+                'attempts': stats.attempts,
+                'tokens': stats.tokens
+            }
+            for persona, stats in self.personas.items()
+        }
+
+    def __str__(self) -> str:
+        if not self.personas:
+            return "RepairStats(no responses)"
+        parts = []
+        for persona, values in sorted(self.to_dict().items()):
+            parts.append(f"{persona}: {values['parse_failures']}/{values['responses']} unparsable, "
+                         f"{values['repaired']} repaired ({values['repair_rate']:.0%}) "
+                         f"in {values['attempts']} follow-ups, {values['tokens']} tokens")
+        return "RepairStats(" + "; ".join(parts) + ")"
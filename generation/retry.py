@@ -0,0 +1,163 @@
+"""
+Retry policy for LLM API calls.
+
+Classifies failures as retryable or fatal, computes exponential backoff with full
+jitter (honoring Retry-After when the provider sends it) and keeps counters that
+are reported in run statistics.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses that indicate a transient problem on the provider side
+RETRYABLE_STATUSES = frozenset({408, 409, 425, 429, 500, 502, 503, 504, 520, 522, 524, 529})
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a Retry-After header value into seconds
+    Accepts both the delta-seconds and the HTTP-date forms
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at is None:
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+@dataclass
+class RetryStats:
+    """Counters describing how often requests had to be retried"""
+    requests: int = 0
+    attempts: int = 0
+    retries: int = 0
+    recovered: int = 0  # requests that succeeded after at least one retry
+    gave_up: int = 0  # requests that failed after exhausting retries
+    fatal: int = 0  # requests that failed with a non-retryable error
+    retries_by_reason: Dict[str, int] = field(default_factory=dict)
+
+    def record_retry(self, reason: str):
+        self.retries += 1
+        self.retries_by_reason[reason] = self.retries_by_reason.get(reason, 0) + 1
+
+    def to_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'attempts': self.attempts,
+            'retries': self.retries,
+            'recovered': self.recovered,
+            'gave_up': self.gave_up,
+            'fatal': self.fatal,
+            'retries_by_reason': dict(self.retries_by_reason)
+        }
+
+    def __str__(self) -> str:
+        reasons = ", ".join(f"{k}={v}" for k, v in sorted(self.retries_by_reason.items())) or "none"
+        return (f"RetryStats(requests={self.requests}, attempts={self.attempts}, retries={self.retries}, "
+                f"recovered={self.recovered}, gave_up={self.gave_up}, fatal={self.fatal}, reasons: {reasons})")
+
+
+def error_reason(exc: BaseException) -> str:
+    """Short label for an error, used as the key in retry statistics"""
+    status = getattr(exc, 'status', None)
+    if status is not None:
+        return str(status)
+    if isinstance(exc, asyncio.TimeoutError):
+        return "timeout"
+    return type(exc).__name__
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Exponential backoff with full jitter, capped by attempts and total elapsed time
+    Delay for retry n is uniform(0, min(max_delay, base_delay * 2**n)), but never
+    shorter than a Retry-After value sent by the provider
+    """
+    max_attempts: int = 6
+    base_delay: float = 1.0
+    max_delay: float = 60.0
+    max_total_time: float = 600.0
+    retryable_statuses: frozenset = RETRYABLE_STATUSES
+
+    def is_retryable(self, exc: BaseException) -> bool:
+        """Classify an exception as retryable (transient) or fatal"""
+        if getattr(exc, 'retry_elsewhere', False):
+            return True  # the client has another endpoint to fail over to
+        status = getattr(exc, 'status', None)
+        if status is not None:
+            return status in self.retryable_statuses
+        return isinstance(exc, (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError))
+
+    def backoff_delay(self, retry_number: int) -> float:
+        """Full-jitter backoff for the given retry (0-based)"""
+        cap = min(self.max_delay, self.base_delay * (2 ** retry_number))
+        return random.uniform(0, cap)
+
+    def next_delay(self, retry_number: int, exc: BaseException) -> float:
+        """Delay before the next attempt, honoring Retry-After if present"""
+        if getattr(exc, 'retry_elsewhere', False):
+            return 0.0  # failing over to a different endpoint, which owes us no backoff
+        delay = self.backoff_delay(retry_number)
+        retry_after = getattr(exc, 'retry_after', None)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    async def call(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        stats: Optional[RetryStats] = None,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep
+    ) -> Any:
+        """
+        Run func until it succeeds, a fatal error occurs, or the attempt/time caps are hit
+        The last error is re-raised when giving up
+        """
+        stats = stats if stats is not None else RetryStats()
+        stats.requests += 1
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            stats.attempts += 1
+            try:
+                result = await func()
+            except Exception as e:
+                if not self.is_retryable(e):
+                    stats.fatal += 1
+                    raise
+                elapsed = time.monotonic() - start
+                delay = self.next_delay(attempt - 1, e)
+                if attempt >= self.max_attempts or elapsed + delay > self.max_total_time:
+                    stats.gave_up += 1
+                    logger.warning(f"Giving up after {attempt} attempts ({elapsed:.1f}s): {e}")
+                    raise
+                reason = error_reason(e)
+                stats.record_retry(reason)
+                logger.info(f"Retryable error ({reason}) on attempt {attempt}, retrying in {delay:.2f}s")
+                await sleep(delay)
+                continue
+            if attempt > 1:
+                stats.recovered += 1
+            return result
@@ -14,6 +14,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from CodeTest.code.map_codetest import load_codetest_dataset_pkl
 from dataset import get_val_problems, Config
+from lm_client import DEFAULT_REQUEST_TIMEOUT
 
 async def main():
     parser = argparse.ArgumentParser(description='Generate LLM reasoning traces')
@@ -21,6 +22,66 @@ async def main():
                        help='Dataset to use (default: taco)')
     parser.add_argument('--num-problems', type=int, default=300,
                        help='Number of problems to process (default: 300)')
+    parser.add_argument('--requests-per-minute', type=float, default=None,
+                       help='Provider requests/min quota per model (default: unlimited)')
+    parser.add_argument('--tokens-per-minute', type=float, default=None,
+                       help='Provider tokens/min quota per model (default: unlimited)')
+    parser.add_argument('--stream', action='store_true',
+                       help='Stream completions and record time-to-first-token and tokens/sec')
+    parser.add_argument('--structured-output', action='store_true',
+                       help='Request schema-constrained JSON from the reasoner (falls back to text parsing if unsupported)')
+    parser.add_argument('--early-stop', action='store_true',
+                       help='Stop the reasoner once its outputs JSON block is complete (a stop sequence, and closing streams); naive replies run to the end')
+    parser.add_argument('--max-repairs', type=int, default=1,
+                       help='Follow-ups asking for just the outputs JSON / code block when a reply cannot be parsed (default: 1, 0 disables)')
+    parser.add_argument('--cascade', type=str, nargs='+', default=None, metavar='MODEL',
+                       help='Models to try in order, escalating to the next only when an answer fails --cascade-check')
+    parser.add_argument('--cascade-check', choices=['parsed', 'ran', 'correct'], default='correct',
+                       help='What an answer must pass on the sample tests to stop the cascade (default: correct)')
+    parser.add_argument('--adaptive-max-tokens', action='store_true',
+                       help='Size max_tokens from past completion lengths per model/persona/difficulty (retries truncated responses)')
+    parser.add_argument('--prompt-cache', action='store_true',
+                       help='Send the problem statement first, shared by every persona, so providers can reuse the cached prompt prefix')
+    parser.add_argument('--cache-control', action='store_true',
+                       help='With --prompt-cache, also mark the shared prefix with a cache_control breakpoint (e.g. Anthropic models)')
+    parser.add_argument('--sandbox-concurrency', type=int, default=None,
+                       help='Generated programs run at once, off the event loop (default: number of CPUs)')
+    parser.add_argument('--stage-workers', type=str, nargs='+', default=None, metavar='STAGE=N',
+                       help='Workers per pipeline stage, e.g. llm=128 sandbox=4 (stages: prepare, llm, extract, sandbox, score, persist)')
+    parser.add_argument('--write-batch-size', type=int, default=256,
+                       help='Responses appended to the output file per write (default: 256)')
+    parser.add_argument('--write-interval', type=float, default=1.0,
+                       help='Seconds a response may wait for its write batch to fill (default: 1.0)')
+    parser.add_argument('--fsync', action='store_true',
+                       help='fsync the output file after every write batch, so a crash loses at most one batch')
+    parser.add_argument('--batch', choices=['local', 'openai'], default=None,
+                       help='Send completions as batch jobs: "local" runs them through a file-based stand-in, "openai" uses an OpenAI-compatible batch API')
+    parser.add_argument('--batch-base-url', type=str, default='https://api.openai.com/v1',
+                       help='Base URL of the batch API for --batch openai (key from OPENAI_API_KEY)')
+    parser.add_argument('--batch-poll-interval', type=float, default=30.0,
+                       help='Seconds between batch job status checks (default: 30)')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Do not read or write the on-disk completion cache')
+    parser.add_argument('--max-total-tokens', type=int, default=None,
+                       help='Stop sending requests once this many tokens were billed (default: unlimited)')
+    parser.add_argument('--max-total-cost', type=float, default=None,
+                       help='Stop sending requests once this many dollars were billed (default: unlimited)')
+    parser.add_argument('--endpoints-file', type=str, default=None,
+                       help='JSON list of upstream endpoints to load-balance and fail over between (default: OPENROUTER_API_KEY only)')
+    parser.add_argument('--hedge', action='store_true',
+                       help='Send a duplicate of requests slower than the observed p95 latency and keep the first answer')
+    parser.add_argument('--hedge-model', type=str, default=None,
+                       help='Model route for hedged duplicates (default: same model)')
+    parser.add_argument('--request-timeout', type=float, default=DEFAULT_REQUEST_TIMEOUT,
+                       help=f'Deadline in seconds for each API request attempt (default: {DEFAULT_REQUEST_TIMEOUT:.0f})')
+    parser.add_argument('--run-timeout', type=float, default=None,
+                       help='Wall-clock budget in seconds for the whole run; unfinished responses are cancelled and recorded')
+    parser.add_argument('--retry-timeouts', action='store_true',
+                       help='Only regenerate the responses listed in the timeouts file of the previous run')
+    parser.add_argument('--shard', type=str, default=None, metavar='I/N',
+                       help='Generate only shard I of N (0-based) of the (problem, persona) units into its own output segment; merge with tools/merge_shards.py')
+    parser.add_argument('--fresh', action='store_true',
+                       help='Start over: clear the output file and work ledger instead of generating only missing or failed responses')
     args = parser.parse_args()
     
     print("🚀 Starting LLM reasoning trace generation...")
@@ -49,14 +110,65 @@ async def main():
         # Run the trace generation
         print("📝 Generating reasoning traces...")
         from get_reasoning_traces import ReasoningTraceGenerator
+        from endpoints import load_endpoints
+        from pipeline import parse_stage_workers
+        from sharding import parse_shard, shard_output_file
+        
+        # A shard writes its own segment of the output file
+        shard = parse_shard(args.shard)
+        merged_file = output_file
+        if shard is not None:
+            output_file = shard_output_file(output_file, *shard)
+            print(f"🧩 Shard {shard[0]}/{shard[1]}, writing {output_file}")
         
         generator = ReasoningTraceGenerator(
             api_key=os.getenv('OPENROUTER_API_KEY'),
-            output_file=output_file
+            output_file=output_file,
+            requests_per_minute=args.requests_per_minute,
+            tokens_per_minute=args.tokens_per_minute,
+            use_cache=not args.no_cache,
+            max_total_tokens=args.max_total_tokens,
+            max_total_cost=args.max_total_cost,
+            endpoints=load_endpoints(args.endpoints_file) if args.endpoints_file else None,
+            hedge=args.hedge,
+            hedge_model=args.hedge_model,
+            request_timeout=args.request_timeout,
+            run_timeout=args.run_timeout,
+            adaptive_max_tokens=args.adaptive_max_tokens,
+            sandbox_concurrency=args.sandbox_concurrency
         )
-        await generator.process_problems_from_list(problems)
+        generator.stream = args.stream
+        generator.structured_output = args.structured_output
+        generator.early_stop = args.early_stop
+        generator.max_repairs = args.max_repairs
+        generator.cascade_models = args.cascade or []
+        generator.cascade_check = args.cascade_check
+        generator.prompt_cache = args.prompt_cache or args.cache_control
+        generator.stage_workers = parse_stage_workers(args.stage_workers)
+        generator.write_batch_size = args.write_batch_size
+        generator.write_interval = args.write_interval
+        generator.write_fsync = args.fsync
+        generator.cache_control = args.cache_control
+        generator.resume = not args.fresh
+        generator.shard = shard
+        if args.retry_timeouts:
+            await generator.retry_timed_out(problems)
+        elif args.batch:
+            from batch import OpenAIBatchBackend
+            backend = OpenAIBatchBackend(args.batch_base_url, os.getenv('OPENAI_API_KEY', '')) if args.batch == 'openai' else None
+            await generator.process_problems_batch(problems, backend=backend, poll_interval=args.batch_poll_interval)
+        else:
+            await generator.process_problems_from_list(problems)
+        if generator.timed_out:
+            print(f"⏱️  {len(generator.timed_out)} responses timed out; rerun with --retry-timeouts")
         generator.save_results()
         
+        if shard is not None:
+            # The web app files are built once every shard is done
+            print(f"✅ Shard {shard[0]}/{shard[1]} done. When all {shard[1]} shards have finished, merge them with:")
+            print(f"   python tools/merge_shards.py {merged_file} --shards {shard[1]}")
+            return
+        
         # Convert to JSON format
         print("🔄 Converting to JSON format...")
         from convert_to_json import convert_jsonl_to_json
@@ -0,0 +1,70 @@
+"""
+Sandbox execution off the asyncio event loop.
+
+Running generated code spawns processes and waits for them for up to the time limit;
+called directly from a coroutine that wait freezes the event loop, and with it every
+in-flight LLM request. SandboxPool runs those blocking calls on a dedicated thread pool
+with its own concurrency limit, so the generator only awaits their results.
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+
+def default_sandbox_concurrency() -> int:
+    """One program at a time per CPU: each run is a separate, mostly CPU-bound process"""
+    return os.cpu_count() or 4
+
+
+class SandboxPool:
+    """
+    Runs blocking sandbox calls on a dedicated thread pool, at most `max_concurrent` at a time
+    A cancelled caller stops waiting, but a program already running finishes (or hits
+    its time limit) in the background; it cannot be interrupted from the event loop.
+    """
+    def __init__(self, max_concurrent: Optional[int] = None):
+        self.max_concurrent = max_concurrent or default_sandbox_concurrency()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self.runs = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.busy_seconds = 0.0  # summed wall time of the runs themselves
+        self.wait_seconds = 0.0  # summed time runs queued for a free slot
+
+    def _ensure_started(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrent, thread_name_prefix="sandbox")
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """Await func(*args), executed on the pool once a slot is free"""
+        self._ensure_started()
+        queued_at = time.monotonic()
+        async with self._semaphore:
+            started_at = time.monotonic()
+            self.wait_seconds += started_at - queued_at
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            try:
+                return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+            finally:
+                self.in_flight -= 1
+                self.runs += 1
+                self.busy_seconds += time.monotonic() - started_at
+
+    def close(self):
+        """Stop the worker threads once running programs finish; the pool restarts on the next run"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        self._semaphore = None
+
+    def __str__(self) -> str:
+        mean = self.busy_seconds / self.runs if self.runs else 0.0
+        return (f"SandboxPool(max_concurrent={self.max_concurrent}, runs={self.runs}, "
+                f"mean run={mean:.2f}s, queued={self.wait_seconds:.1f}s, peak in flight={self.peak_in_flight})")
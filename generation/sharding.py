@@ -0,0 +1,100 @@
+"""
+Static sharding of a generation sweep across processes or hosts.
+
+Each (problem, persona) unit belongs to exactly one of N shards, chosen by a stable hash
+of its problem id and persona, so every process given the same problem list and
+`--shard i/N` computes the same split without coordinating. A shard writes its own
+output segment (with its own work ledger and timeouts file); merge_segments combines
+the segments into the final JSONL, dropping duplicates and ordering the records.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def parse_shard(value: Optional[str]) -> Optional[Tuple[int, int]]:
+    """Parse "i/N" (0 <= i < N) into (i, N); None stays None"""
+    if value is None:
+        return None
+    index, sep, count = value.partition("/")
+    if not sep or not index.strip().isdigit() or not count.strip().isdigit():
+        raise ValueError(f"Expected a shard as INDEX/COUNT, e.g. 0/4, got {value!r}")
+    index, count = int(index), int(count)
+    if count < 1 or index >= count:
+        raise ValueError(f"Shard index must be in 0..{count - 1} for {count} shards, got {value!r}")
+    return index, count
+
+
+def shard_of(problem_id, persona_type: str, count: int) -> int:
+    """The shard of a (problem, persona) unit; stable across processes, hosts and Python versions"""
+    digest = hashlib.sha256(f"{problem_id}|{persona_type}".encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def shard_output_file(output_file: str, index: int, count: int) -> str:
+    """Segment written by shard `index` of `count`: responses.jsonl -> responses.shard-1-of-4.jsonl"""
+    root, ext = os.path.splitext(output_file)
+    return f"{root}.shard-{index}-of-{count}{ext}"
+
+
+def _problem_order(problem_id) -> Tuple[int, Any]:
+    try:
+        return 0, int(problem_id)
+    except (TypeError, ValueError):
+        return 1, str(problem_id)
+
+
+def record_key(record: Dict[str, Any]) -> Tuple:
+    """Identity of a response in a merged file: one per problem, persona, model and prompt version"""
+    return (str(record["problem_id"]), record["type"], record.get("model"), record.get("prompt_version"))
+
+
+def merge_segments(segments: List[str], output_file: str) -> Dict[str, int]:
+    """
+    Merge shard segments into `output_file`, ordered by problem id, persona and model
+    A response that appears more than once (e.g. regenerated after a re-shard) keeps its
+    last copy in segment order. Lines cut short by a crash are skipped. The output is
+    written atomically (temp file + os.replace). Returns counts of what was merged.
+    """
+    records: Dict[Tuple, Dict[str, Any]] = {}
+    stats = {"segments": len(segments), "read": 0, "duplicates": 0, "unreadable": 0}
+    for segment in segments:
+        with open(segment, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                    key = record_key(record)
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    stats["unreadable"] += 1
+                    continue
+                stats["read"] += 1
+                if key in records:
+                    stats["duplicates"] += 1
+                records[key] = record
+    ordered = sorted(records.items(), key=lambda item: (_problem_order(item[0][0]), item[0][1], str(item[0][2])))
+
+    directory = os.path.dirname(os.path.abspath(output_file))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(record) + "\n" for _, record in ordered)
+        os.replace(tmp_path, output_file)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    stats["written"] = len(ordered)
+    if stats["unreadable"]:
+        logger.warning(f"Skipped {stats['unreadable']} unreadable lines while merging into {output_file}")
+    return stats
@@ -11,25 +11,15 @@ import argparse
 # Add parent directory to Python path to allow importing CodeTest
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from get_reasoning_traces import ReasoningTraceGenerator
+from get_reasoning_traces import ReasoningTraceGenerator, summarize_stream_metrics
+from endpoints import load_endpoints
+from pipeline import parse_stage_workers
+from sharding import parse_shard, shard_output_file
+from lm_client import DEFAULT_REQUEST_TIMEOUT
 from dataset import get_val_problems, Config
 from CodeTest.code.map_codetest import load_codetest_dataset_pkl
 
-async def process_with_semaphore(semaphore, generator, problem, persona_type, progress_callback, wait_time=0.1):
-    """Process a single response with semaphore control and rate limiting."""
-    async with semaphore:
-        try:
-            result = await generator.generate_response(problem, persona_type)
-            progress_callback()
-            # Add wait time to prevent rate limiting
-            if wait_time > 0:
-                await asyncio.sleep(wait_time)
-            return result
-        except Exception as e:
-            print(f"Error processing {persona_type} for problem {problem.id}: {e}")
-            return None
-
-async def test_generation(num_problems=1, disable_reasoning=False, disable_naive=False, max_concurrent=5, start_id=None, specific_problems=None, wait_time=0.1, use_codetest=False, disable_input_filtering=False, max_input_length=100, max_output_length=100):
+async def test_generation(num_problems=1, disable_reasoning=False, disable_naive=False, max_concurrent=32, start_id=None, specific_problems=None, requests_per_minute=None, tokens_per_minute=None, use_codetest=False, disable_input_filtering=False, max_input_length=100, max_output_length=100, stream=False, use_cache=True, max_total_tokens=None, max_total_cost=None, endpoints_file=None, hedge=False, hedge_model=None, request_timeout=DEFAULT_REQUEST_TIMEOUT, run_timeout=None, retry_timeouts=False, structured_output=False, early_stop=False, max_repairs=1, cascade=None, cascade_check="correct", adaptive_max_tokens=False, prompt_cache=False, cache_control=False, sandbox_concurrency=None, stage_workers=None, write_batch_size=256, write_interval=1.0, fsync=False, fresh=False, shard=None):
     """Test with specified number of problems and generation types."""
     api_key = os.getenv('OPENROUTER_API_KEY')
     if not api_key:
@@ -82,7 +72,9 @@ async def test_generation(num_problems=1, disable_reasoning=False, disable_naive
     
     print(f"Original number of problems: {num_problems}")
     print(f"🧪 Testing with {len(problems)} problems ({expected_responses} responses total)...")
-    print(f"   - Max concurrent requests: {max_concurrent}")
+    print(f"   - Max concurrent requests: {max_concurrent} (adaptive)")
+    if requests_per_minute or tokens_per_minute:
+        print(f"   - Rate limits: {requests_per_minute or 'unlimited'} requests/min, {tokens_per_minute or 'unlimited'} tokens/min")
     if specific_problems is not None:
         print(f"   - Specific problem IDs: {specific_problems}")
     elif start_id is not None:
@@ -97,42 +89,96 @@ async def test_generation(num_problems=1, disable_reasoning=False, disable_naive
         output_file = '../data/test_responses_codetest.jsonl'
     else:
         output_file = '../data/test_responses_taco.jsonl'
+    shard = parse_shard(shard)
+    if shard is not None:
+        output_file = shard_output_file(output_file, *shard)
+        print(f"   - Shard {shard[0]}/{shard[1]}, writing {output_file}")
     
-    generator = ReasoningTraceGenerator(api_key, output_file=output_file)
+    generator = ReasoningTraceGenerator(
+        api_key,
+        output_file=output_file,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        max_concurrent=max_concurrent,
+        use_cache=use_cache,
+        max_total_tokens=max_total_tokens,
+        max_total_cost=max_total_cost,
+        endpoints=load_endpoints(endpoints_file) if endpoints_file else None,
+        hedge=hedge,
+        hedge_model=hedge_model,
+        request_timeout=request_timeout,
+        run_timeout=run_timeout,
+        adaptive_max_tokens=adaptive_max_tokens,
+        sandbox_concurrency=sandbox_concurrency
+    )
     
     # Set filtering options
     generator.disable_input_filtering = disable_input_filtering
     generator.max_input_length = max_input_length
     generator.max_output_length = max_output_length
-    
-    # Create semaphore for controlled concurrency
-    semaphore = asyncio.Semaphore(max_concurrent)
+    generator.stream = stream
+    generator.structured_output = structured_output
+    generator.early_stop = early_stop
+    generator.max_repairs = max_repairs
+    generator.cascade_models = cascade or []
+    generator.cascade_check = cascade_check
+    generator.prompt_cache = prompt_cache or cache_control
+    generator.cache_control = cache_control
+    generator.stage_workers = parse_stage_workers(stage_workers)
+    generator.write_batch_size = write_batch_size
+    generator.write_interval = write_interval
+    generator.write_fsync = fsync
+    generator.resume = not fresh
+    generator.shard = shard
     
     # Track progress
     completed_count = 0
-    def progress_callback():
+    def progress_callback(job, response):
         nonlocal completed_count
         completed_count += 1
         print(f"Completed {completed_count}/{expected_responses} responses...")
     
-    # Create tasks for all responses
-    tasks = []
-    for problem in problems:
-        if not disable_naive:
-            task = process_with_semaphore(semaphore, generator, problem, "naive", progress_callback, wait_time)
-            tasks.append(task)
-        if not disable_reasoning:
-            task = process_with_semaphore(semaphore, generator, problem, "reasoning", progress_callback, wait_time)
-            tasks.append(task)
+    # Create jobs for all responses; with --retry-timeouts only those that timed out last run
+    persona_types = [persona for persona, disabled in (("naive", disable_naive), ("reasoning", disable_reasoning)) if not disabled]
+    if retry_timeouts:
+        jobs = generator.timed_out_jobs(problems, persona_types)
+        print(f"   - Retrying {len(jobs)} timed-out responses from {generator.timeouts_file}")
+    else:
+        jobs = generator.create_jobs(problems, persona_types)
     
-    # Process all tasks concurrently
-    print(f"Generating {len(tasks)} responses with controlled concurrency...")
-    results = await asyncio.gather(*tasks, return_exceptions=True)
+    # Only units the work ledger does not have as done are generated; responses are appended to the output file.
+    # --fresh starts over with an empty output file, except when retrying timeouts into the existing one.
+    generator.open_ledger(clear_output=not retry_timeouts)
+    print(f"   - Work ledger: {generator.ledger} ({generator.ledger_file})")
     
-    # Filter out exceptions and None results
-    valid_results = [r for r in results if r is not None and not isinstance(r, Exception)]
+    # Run all jobs through the generation pipeline, within the run timeout if one is set
+    print(f"Generating {len(jobs)} responses with controlled concurrency...")
+    async with generator.client:
+        valid_results = await generator._process_jobs(jobs, on_done=progress_callback)
+    if generator.timed_out:
+        print(f"   - Timed out: {len(generator.timed_out)} responses (rerun with --retry-timeouts)")
     
     generator.save_results()
+    print(f"   - API retries: {generator.client.retry_stats}")
+    print(f"   - Rate limiting: {generator.client.rate_limiter}")
+    print(f"   - Concurrency: {generator.client.concurrency_limiter}")
+    print(f"   - Cache: {generator.client.cache}")
+    print(f"   - Coalesced duplicate requests: {generator.client.coalesced_requests}")
+    print(f"   - Endpoints: {generator.client.pool}")
+    if hedge:
+        print(f"   - Hedging: {generator.client.hedge_stats}")
+    print(f"   - Budget: {generator.client.budget}")
+    print(generator.usage_tracker.format_report())
+    print(generator.pipeline.format_report())
+    if early_stop:
+        print(f"   - Early stopping: {generator.early_stop_stats}")
+    print(f"   - Repairs: {generator.repair_stats}")
+    if adaptive_max_tokens:
+        print(f"   - max_tokens: {generator.length_stats}")
+    if cascade:
+        print(f"   - Cascade: {generator.cascade_stats}")
+    if generator.stream_metrics:
+        print(f"   - Streaming: {summarize_stream_metrics(generator.stream_metrics)}")
     print(f"✅ Test completed! Generated {len(valid_results)} valid responses. Check test_responses.jsonl")
 
 def main():
@@ -143,14 +189,66 @@ def main():
                        help='Disable reasoning trace generation')
     parser.add_argument('--disable-naive', action='store_true',
                        help='Disable naive coder generation')
-    parser.add_argument('--max-concurrent', type=int, default=5,
-                       help='Maximum number of concurrent requests (default: 5)')
+    parser.add_argument('--max-concurrent', type=int, default=32,
+                       help='Upper bound for the adaptive number of concurrent requests (default: 32)')
     parser.add_argument('--start-id', type=str, default=None,
                        help='Minimum problem ID to start generation from (default: None)')
     parser.add_argument('--specific-problems', type=int, nargs='+', default=None,
                        help='Specific problem IDs to generate for (e.g., --specific-problems 203 193)')
-    parser.add_argument('--wait-time', type=float, default=0.1,
-                       help='Wait time between requests in seconds (default: 0.1)')
+    parser.add_argument('--requests-per-minute', type=float, default=None,
+                       help='Provider requests/min quota per model (default: unlimited)')
+    parser.add_argument('--tokens-per-minute', type=float, default=None,
+                       help='Provider tokens/min quota per model (default: unlimited)')
+    parser.add_argument('--stream', action='store_true',
+                       help='Stream completions and record time-to-first-token and tokens/sec')
+    parser.add_argument('--structured-output', action='store_true',
+                       help='Request schema-constrained JSON from the reasoner (falls back to text parsing if unsupported)')
+    parser.add_argument('--early-stop', action='store_true',
+                       help='Stop the reasoner once its outputs JSON block is complete (a stop sequence, and closing streams); naive replies run to the end')
+    parser.add_argument('--max-repairs', type=int, default=1,
+                       help='Follow-ups asking for just the outputs JSON / code block when a reply cannot be parsed (default: 1, 0 disables)')
+    parser.add_argument('--cascade', type=str, nargs='+', default=None, metavar='MODEL',
+                       help='Models to try in order, escalating to the next only when an answer fails --cascade-check')
+    parser.add_argument('--cascade-check', choices=['parsed', 'ran', 'correct'], default='correct',
+                       help='What an answer must pass on the sample tests to stop the cascade (default: correct)')
+    parser.add_argument('--adaptive-max-tokens', action='store_true',
+                       help='Size max_tokens from past completion lengths per model/persona/difficulty (retries truncated responses)')
+    parser.add_argument('--prompt-cache', action='store_true',
+                       help='Send the problem statement first, shared by every persona, so providers can reuse the cached prompt prefix')
+    parser.add_argument('--cache-control', action='store_true',
+                       help='With --prompt-cache, also mark the shared prefix with a cache_control breakpoint (e.g. Anthropic models)')
+    parser.add_argument('--sandbox-concurrency', type=int, default=None,
+                       help='Generated programs run at once, off the event loop (default: number of CPUs)')
+    parser.add_argument('--stage-workers', type=str, nargs='+', default=None, metavar='STAGE=N',
+                       help='Workers per pipeline stage, e.g. llm=128 sandbox=4 (stages: prepare, llm, extract, sandbox, score, persist)')
+    parser.add_argument('--write-batch-size', type=int, default=256,
+                       help='Responses appended to the output file per write (default: 256)')
+    parser.add_argument('--write-interval', type=float, default=1.0,
+                       help='Seconds a response may wait for its write batch to fill (default: 1.0)')
+    parser.add_argument('--fsync', action='store_true',
+                       help='fsync the output file after every write batch, so a crash loses at most one batch')
+    parser.add_argument('--no-cache', action='store_true',
+                       help='Do not read or write the on-disk completion cache')
+    parser.add_argument('--max-total-tokens', type=int, default=None,
+                       help='Stop sending requests once this many tokens were billed (default: unlimited)')
+    parser.add_argument('--max-total-cost', type=float, default=None,
+                       help='Stop sending requests once this many dollars were billed (default: unlimited)')
+    parser.add_argument('--endpoints-file', type=str, default=None,
+                       help='JSON list of upstream endpoints to load-balance and fail over between (default: OPENROUTER_API_KEY only)')
+    parser.add_argument('--hedge', action='store_true',
+                       help='Send a duplicate of requests slower than the observed p95 latency and keep the first answer')
+    parser.add_argument('--hedge-model', type=str, default=None,
+                       help='Model route for hedged duplicates (default: same model)')
+    parser.add_argument('--request-timeout', type=float, default=DEFAULT_REQUEST_TIMEOUT,
+                       help=f'Deadline in seconds for each API request attempt (default: {DEFAULT_REQUEST_TIMEOUT:.0f})')
+    parser.add_argument('--run-timeout', type=float, default=None,
+                       help='Wall-clock budget in seconds for the whole run; unfinished responses are cancelled and recorded')
+    parser.add_argument('--retry-timeouts', action='store_true',
+                       help='Only regenerate the responses listed in the timeouts file of the previous run')
+    parser.add_argument('--shard', type=str, default=None, metavar='I/N',
+                       help='Generate only shard I of N (0-based) of the (problem, persona) units into its own output segment')
+    parser.add_argument('--fresh', action='store_true',
+                       help='Start the work ledger over and regenerate every response instead of only missing or failed ones')
     parser.add_argument('--use-codetest', action='store_true',
                        help='Use CodeTest dataset instead of TACO dataset')
     parser.add_argument('--disable-input-filtering', action='store_true',
@@ -168,11 +266,37 @@ def main():
         max_concurrent=args.max_concurrent,
         start_id=args.start_id,
         specific_problems=args.specific_problems,
-        wait_time=args.wait_time,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
         use_codetest=args.use_codetest,
         disable_input_filtering=args.disable_input_filtering,
         max_input_length=args.max_input_length,
-        max_output_length=args.max_output_length
+        max_output_length=args.max_output_length,
+        stream=args.stream,
+        use_cache=not args.no_cache,
+        max_total_tokens=args.max_total_tokens,
+        max_total_cost=args.max_total_cost,
+        endpoints_file=args.endpoints_file,
+        hedge=args.hedge,
+        hedge_model=args.hedge_model,
+        request_timeout=args.request_timeout,
+        run_timeout=args.run_timeout,
+        retry_timeouts=args.retry_timeouts,
+        structured_output=args.structured_output,
+        early_stop=args.early_stop,
+        max_repairs=args.max_repairs,
+        cascade=args.cascade,
+        cascade_check=args.cascade_check,
+        adaptive_max_tokens=args.adaptive_max_tokens,
+        prompt_cache=args.prompt_cache,
+        cache_control=args.cache_control,
+        sandbox_concurrency=args.sandbox_concurrency,
+        stage_workers=args.stage_workers,
+        write_batch_size=args.write_batch_size,
+        write_interval=args.write_interval,
+        fsync=args.fsync,
+        fresh=args.fresh,
+        shard=args.shard
     ))
 
 if __name__ == "__main__":
@@ -0,0 +1,114 @@
+"""
+Adaptive max_tokens from completion lengths seen in past runs.
+
+Requesting the same large max_tokens for every call makes providers reserve capacity
+that is rarely used and makes the rate limiter's token estimates very pessimistic.
+Completion lengths are kept per (model, persona, difficulty) in a small JSON file, and
+once enough have been seen max_tokens is set at a high percentile plus a margin. A
+response cut off at that budget (finish_reason "length") is retried with a larger one.
+"""
+
+import json
+import logging
+import os
+import tempfile
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from hedging import percentile
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LENGTH_STATS_FILE = os.path.join(os.path.dirname(__file__), '../data/completion_lengths.json')
+DEFAULT_MAX_TOKENS = 16000
+
+
+class CompletionLengthStats:
+    """
+    Persistent per-(model, persona, difficulty) completion lengths and the max_tokens they suggest
+    Until `min_samples` lengths were seen for a key, `ceiling` is used. Truncated completions
+    are not recorded, since their real length is unknown.
+    """
+    def __init__(self, path: str = DEFAULT_LENGTH_STATS_FILE, enabled: bool = True, quantile: float = 0.99,
+                 margin: float = 0.25, min_samples: int = 20, window: int = 500, floor: int = 512,
+                 ceiling: int = DEFAULT_MAX_TOKENS):
+        self.path = os.path.abspath(path)
+        self.enabled = enabled
+        self.quantile = quantile
+        self.margin = margin
+        self.min_samples = min_samples
+        self.window = window
+        self.floor = floor
+        self.ceiling = ceiling
+        self.lengths: Dict[str, List[int]] = defaultdict(list)
+        self.requests = 0
+        self.sized = 0  # requests whose max_tokens came from history
+        self.requested_tokens = 0
+        self.truncation_retries = 0
+        if self.enabled:
+            self.load()
+
+    @staticmethod
+    def key(model: str, persona: str, difficulty) -> str:
+        return f"{model}|{persona}|{difficulty}"
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+        except FileNotFoundError:
+            return
+        except (json.JSONDecodeError, OSError) as e:
+            logger.warning(f"Ignoring unreadable completion length stats {self.path}: {e}")
+            return
+        for key, lengths in stored.items():
+            self.lengths[key] = [int(length) for length in lengths][-self.window:]
+
+    def save(self):
+        """Write the stats atomically (temp file + os.replace)"""
+        if not self.enabled:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(dict(self.lengths), f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to write completion length stats {self.path}: {e}")
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+
+    def record(self, model: str, persona: str, difficulty, completion_tokens: Optional[int]):
+        if not self.enabled or not completion_tokens:
+            return
+        lengths = self.lengths[self.key(model, persona, difficulty)]
+        lengths.append(int(completion_tokens))
+        del lengths[:-self.window]
+
+    def max_tokens(self, model: str, persona: str, difficulty) -> int:
+        """max_tokens for the next request: the quantile of past lengths plus margin, within floor..ceiling"""
+        self.requests += 1
+        lengths = self.lengths.get(self.key(model, persona, difficulty))
+        if not self.enabled or not lengths or len(lengths) < self.min_samples:
+            budget = self.ceiling
+        else:
+            self.sized += 1
+            budget = int(percentile(lengths, self.quantile) * (1 + self.margin))
+            budget = max(self.floor, min(self.ceiling, budget))
+        self.requested_tokens += budget
+        return budget
+
+    def next_budget(self, budget: int) -> Optional[int]:
+        """Larger max_tokens to retry a truncated response with, or None at the ceiling"""
+        if budget >= self.ceiling:
+            return None
+        self.truncation_retries += 1
+        return min(self.ceiling, budget * 2)
+
+    def __str__(self) -> str:
+        mean = self.requested_tokens / self.requests if self.requests else 0.0
+        return (f"CompletionLengthStats({len(self.lengths)} keys, {self.sized}/{self.requests} requests sized "
+                f"from history, mean max_tokens={mean:.0f}, truncation retries={self.truncation_retries})")
@@ -0,0 +1,177 @@
+"""
+Token usage and cost accounting for LLM calls.
+
+Normalizes the provider `usage` block into a flat per-call record, rolls records up
+per model/persona/difficulty for the end-of-run report, and enforces an optional hard
+budget on tokens or dollars.
+"""
+
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+USAGE_FIELDS = ("prompt_tokens", "cached_tokens", "completion_tokens", "reasoning_tokens", "total_tokens", "cost")
+
+
+class BudgetExhaustedError(Exception):
+    """Raised instead of sending a request once the run's token or cost budget is spent"""
+
+
+def normalize_usage(usage: Optional[Dict[str, Any]], latency: float = 0.0, billed: bool = True) -> Dict[str, Any]:
+    """
+    Flatten a provider usage block into the record stored with each response
+    Missing fields count as zero; cost is only present when the provider reports it
+    cached_tokens is the part of prompt_tokens served from the provider's prompt cache
+    """
+    usage = usage or {}
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    completion_details = usage.get("completion_tokens_details") or {}
+    prompt_tokens = usage.get("prompt_tokens") or 0
+    completion_tokens = usage.get("completion_tokens") or 0
+    return {
+        "prompt_tokens": prompt_tokens,
+        "cached_tokens": prompt_details.get("cached_tokens") or 0,
+        "completion_tokens": completion_tokens,
+        "reasoning_tokens": completion_details.get("reasoning_tokens") or 0,
+        "total_tokens": usage.get("total_tokens") or prompt_tokens + completion_tokens,
+        "cost": usage.get("cost") or 0.0,
+        "latency": latency,
+        "calls": 1,
+        "billed": billed
+    }
+
+
+def add_usage(a: Optional[Dict[str, Any]], b: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Sum two usage records (e.g. a response that needed several calls)
+    `billed` is set if any call was billed; the part from calls that were not is kept under `unbilled`
+    """
+    if not a:
+        return dict(b or {})
+    if not b:
+        return dict(a)
+    total = {field: a.get(field, 0) + b.get(field, 0) for field in USAGE_FIELDS}
+    total["latency"] = a.get("latency", 0.0) + b.get("latency", 0.0)
+    total["calls"] = a.get("calls", 1) + b.get("calls", 1)
+    total["billed"] = a.get("billed", True) or b.get("billed", True)
+    unbilled_a, unbilled_b = unbilled_usage(a), unbilled_usage(b)
+    if unbilled_a or unbilled_b:
+        total["unbilled"] = {field: unbilled_a.get(field, 0) + unbilled_b.get(field, 0)
+                             for field in USAGE_FIELDS + ("latency",)}
+    return total
+
+
+def unbilled_usage(usage: Dict[str, Any]) -> Dict[str, Any]:
+    """The part of a usage record from calls that cost nothing (cache hits, coalesced duplicates)"""
+    if "unbilled" in usage:
+        return usage["unbilled"]
+    if usage.get("billed", True):
+        return {}
+    return {field: usage.get(field, 0) for field in USAGE_FIELDS + ("latency",)}
+
+
+def billed_usage(usage: Dict[str, Any]) -> Dict[str, Any]:
+    """Tokens, cost and latency of a usage record's billed calls only"""
+    unbilled = unbilled_usage(usage)
+    return {field: usage.get(field, 0) - unbilled.get(field, 0) for field in USAGE_FIELDS + ("latency",)}
+
+
+class UsageBudget:
+    """
+    Hard cap on billed tokens and/or dollars for a run
+    Only billed calls (not cache hits or coalesced duplicates) count against it
+    """
+    def __init__(self, max_tokens: Optional[int] = None, max_cost: Optional[float] = None):
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.tokens = 0
+        self.cost = 0.0
+        self.rejected = 0
+
+    def add(self, usage: Dict[str, Any]):
+        billed = billed_usage(usage)
+        self.tokens += billed["total_tokens"]
+        self.cost += billed["cost"]
+
+    @property
+    def exhausted(self) -> bool:
+        if self.max_tokens is not None and self.tokens >= self.max_tokens:
+            return True
+        if self.max_cost is not None and self.cost >= self.max_cost:
+            return True
+        return False
+
+    def check(self):
+        """Raise BudgetExhaustedError if no further requests may be sent"""
+        if self.exhausted:
+            self.rejected += 1
+            raise BudgetExhaustedError(
+                f"Budget exhausted: {self.tokens} tokens (max {self.max_tokens}), "
+                f"${self.cost:.4f} (max {self.max_cost})"
+            )
+
+    def __str__(self) -> str:
+        return (f"UsageBudget(tokens={self.tokens}/{self.max_tokens or 'unlimited'}, "
+                f"cost=${self.cost:.4f}/{self.max_cost if self.max_cost is not None else 'unlimited'}, "
+                f"rejected={self.rejected})")
+
+
+class UsageTracker:
+    """Collects per-response usage records and rolls them up for reporting"""
+    def __init__(self):
+        self.records: List[Tuple[str, str, str, Dict[str, Any]]] = []
+
+    def record(self, model: str, persona: str, difficulty: str, usage: Dict[str, Any]):
+        self.records.append((model, persona, difficulty, usage))
+
+    def rollup(self, by: Iterable[str] = ("model", "persona", "difficulty")) -> Dict[tuple, Dict[str, Any]]:
+        """
+        Sum usage grouped by any of model, persona and difficulty
+        Tokens, cost and latency count billed calls only; responses served entirely from the
+        completion cache or a coalesced duplicate are counted in `unbilled_responses`
+        """
+        by = tuple(by)
+        groups: Dict[tuple, Dict[str, Any]] = defaultdict(
+            lambda: {"responses": 0, "unbilled_responses": 0, **{field: 0 for field in USAGE_FIELDS + ("latency",)}}
+        )
+        for model, persona, difficulty, usage in self.records:
+            values = {"model": model, "persona": persona, "difficulty": difficulty}
+            key = tuple(values[name] for name in by)
+            group = groups[key]
+            group["responses"] += 1
+            if not usage.get("billed", True):
+                group["unbilled_responses"] += 1
+            for field, value in billed_usage(usage).items():
+                group[field] += value
+        for group in groups.values():
+            billed = group["responses"] - group["unbilled_responses"]
+            group["unbilled_share"] = group["unbilled_responses"] / group["responses"]
+            group["cache_hit_rate"] = (group["cached_tokens"] / group["prompt_tokens"]) if group["prompt_tokens"] else 0.0
+            group["tokens_per_second"] = (group["completion_tokens"] / group["latency"]) if group["latency"] else 0.0
+            group["cost_per_response"] = (group["cost"] / billed) if billed else 0.0
+        return dict(groups)
+
+    def format_report(self) -> str:
+        """
+        Table of billed tokens, cost and throughput per model/persona/difficulty, plus totals
+        `unbilled` is the share of responses that cost nothing (cache hits, coalesced duplicates)
+        """
+        if not self.records:
+            return "No usage recorded"
+        header = (f"{'model':<40} {'persona':<10} {'difficulty':<18} {'resp':>5} {'unbilled':>8} {'prompt':>10} "
+                  f"{'cached':>10} {'completion':>11} {'reasoning':>10} {'cost $':>9} {'tok/s':>7}")
+        lines = [header, "-" * len(header)]
+        for (model, persona, difficulty), group in sorted(self.rollup().items()):
+            lines.append(
+                f"{model[:40]:<40} {persona:<10} {str(difficulty)[:18]:<18} {group['responses']:>5} "
+                f"{group['unbilled_share']:>8.0%} {group['prompt_tokens']:>10} {group['cached_tokens']:>10} "
+                f"{group['completion_tokens']:>11} {group['reasoning_tokens']:>10} {group['cost']:>9.4f} "
+                f"{group['tokens_per_second']:>7.1f}"
+            )
+        total = self.rollup(by=())[()]
+        lines.append("-" * len(header))
+        lines.append(
+            f"{'TOTAL':<70} {total['responses']:>5} {total['unbilled_share']:>8.0%} {total['prompt_tokens']:>10} "
+            f"{total['cached_tokens']:>10} {total['completion_tokens']:>11} {total['reasoning_tokens']:>10} "
+            f"{total['cost']:>9.4f} {total['tokens_per_second']:>7.1f}"
+        )
+        return "\n".join(lines)
@@ -1,12 +1,29 @@
 """Integration tests for the generation pipeline."""
+import json
 import pytest
+import pytest_asyncio
 import sys
 import os
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent.parent / "generation"))
+sys.path.insert(0, str(Path(__file__).parent.parent.parent / "tools"))
 
 from data_structures import Problem
+from get_reasoning_traces import ReasoningTraceGenerator
+from mock_openrouter import MockConfig, start_mock_server
+
+
+def sum_problems(count):
+    """Problems 1..count whose first sample sums to id + 2"""
+    return [
+        Problem(
+            id=str(i), name=f"Sum {i}", statement="Print the sum of the integers on the line.",
+            sample_inputs=[f"{i} 2", "3 4"], sample_outputs=[str(i + 2), "7"],
+            difficulty="EASY", solutions=[]
+        )
+        for i in range(1, count + 1)
+    ]
 
 
 class TestGenerationPipeline:
@@ -86,3 +103,355 @@ print(a + b)
         assert "8" in result.output
 
 
+
+
+class TestMockServerPipeline:
+    """Run the generator end to end against the local mock server."""
+    
+    @pytest_asyncio.fixture
+    async def mock_server(self, request):
+        """A mock server; parametrize indirectly with MockConfig fields (default: no latency)"""
+        config = {"latency_mean": 0, **getattr(request, "param", {})}
+        runner, base_url, mock = await start_mock_server(MockConfig(**config))
+        yield base_url, mock
+        await runner.cleanup()
+    
+    @pytest.fixture
+    def sum_problem(self):
+        """A problem the mock answers correctly (the generator needs a numeric id)"""
+        return sum_problems(1)[0]
+    
+    @pytest.fixture
+    def make_generator(self, tmp_path, mock_server):
+        """Build a generator against the mock server; `settings` are set as attributes after construction"""
+        base_url, _ = mock_server
+        
+        def make(output_file="responses.jsonl", settings=None, **kwargs):
+            generator = ReasoningTraceGenerator(
+                "test-key", output_file=str(tmp_path / output_file), use_cache=False, base_url=base_url, **kwargs
+            )
+            for name, value in (settings or {}).items():
+                setattr(generator, name, value)
+            return generator
+        
+        return make
+    
+    @pytest.mark.asyncio
+    async def test_generates_both_personas(self, tmp_path, make_generator, sum_problem):
+        """Test that naive and reasoning responses are generated and saved."""
+        generator = make_generator()
+        async with generator.client:
+            naive = await generator.generate_response(sum_problem, "naive")
+            reasoning = await generator.generate_response(sum_problem, "reasoning")
+        
+        assert naive["type"] == "naive"
+        assert naive["generated_outputs"][0] == "3"
+        assert reasoning["generated_outputs"] == ["3", "7"]
+        assert len((tmp_path / "responses.jsonl").read_text().splitlines()) == 2
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mock_server", [{"latency_mean": 30}], indirect=True)
+    async def test_run_timeout_records_and_retries(self, tmp_path, mock_server, make_generator, sum_problem):
+        """Test that a run deadline cancels stragglers, records them and --retry-timeouts redoes only those."""
+        _, mock = mock_server
+        output_file = tmp_path / "responses.jsonl"
+        
+        slow = make_generator(run_timeout=0.3)
+        await slow.process_problems_from_list([sum_problem])
+        timeouts = json.loads(Path(slow.timeouts_file).read_text())
+        assert sorted((t["problem_id"], t["type"], t["reason"]) for t in timeouts) == [
+            (sum_problem.id, "naive", "run_timeout"), (sum_problem.id, "reasoning", "run_timeout")
+        ]
+        assert output_file.read_text() == ""
+        
+        mock.config.latency_mean = 0
+        sent = mock.requests
+        fast = make_generator()
+        await fast.retry_timed_out([sum_problem])
+        assert mock.requests - sent == 2
+        assert len(output_file.read_text().splitlines()) == 2
+        assert json.loads(Path(fast.timeouts_file).read_text()) == []
+    
+    @pytest.mark.asyncio
+    async def test_structured_output(self, make_generator, sum_problem):
+        """Test that the reasoner's schema-constrained JSON is used directly."""
+        generator = make_generator(settings={"structured_output": True})
+        async with generator.client:
+            reasoning = await generator.generate_response(sum_problem, "reasoning")
+        
+        assert reasoning["structured_output"] is True
+        assert reasoning["generated_outputs"] == ["3", "7"]
+        assert "sum to 3" in reasoning["trace"]
+        assert generator.parse_modes["structured"] == 1
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("stream", [False, True])
+    async def test_early_stop(self, make_generator, sum_problem, stream):
+        """Test that stop sequences / stream closing keep answers intact and are counted."""
+        generator = make_generator(settings={"early_stop": True, "early_stop_calibration": 0.0, "stream": stream})
+        async with generator.client:
+            naive = await generator.generate_response(sum_problem, "naive")
+            reasoning = await generator.generate_response(sum_problem, "reasoning")
+        
+        assert naive["generated_outputs"][0] == "3"
+        assert reasoning["generated_outputs"] == ["3", "7"]
+        stats = generator.early_stop_stats.to_dict()
+        assert "naive" not in stats
+        assert stats["reasoning"]["stopped"] == 1
+    
+    DRAFT_THEN_FINAL = (
+        "The input looks like:\n```\n1 2\n```\n\nA first draft:\n```python\nprint(1)\n```\n\n"
+        "That ignores the input. Final version:\n```python\nimport sys\nprint(sum(map(int, sys.stdin.read().split())))\n```\n"
+    )
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mock_server", [{"reply": DRAFT_THEN_FINAL}], indirect=True)
+    @pytest.mark.parametrize("stream", [False, True])
+    async def test_early_stop_grades_final_code_block(self, make_generator, sum_problem, stream):
+        """Test that a bare fence and a draft block do not cut the naive reply short of its final block."""
+        generator = make_generator(settings={"early_stop": True, "early_stop_calibration": 0.0, "stream": stream})
+        async with generator.client:
+            naive = await generator.generate_response(sum_problem, "naive")
+        
+        assert naive["trace"] == self.DRAFT_THEN_FINAL
+        assert naive["generated_outputs"][0] == "3"  # the draft would print 1
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mock_server", [{"rate_malformed": 1.0}], indirect=True)
+    @pytest.mark.parametrize("max_repairs", [0, 1])
+    async def test_repair_follow_up(self, mock_server, make_generator, sum_problem, max_repairs):
+        """Test that replies without an answer block are fixed by a short follow-up (or recorded as failures)."""
+        _, mock = mock_server
+        generator = make_generator(settings={"max_repairs": max_repairs})
+        async with generator.client:
+            naive = await generator.generate_response(sum_problem, "naive")
+            reasoning = await generator.generate_response(sum_problem, "reasoning")
+        
+        assert mock.requests == 2 + 2 * max_repairs
+        stats = generator.repair_stats.to_dict()
+        if max_repairs:
+            assert naive["generated_outputs"][0] == "3"
+            assert "```python" in naive["trace"]
+            assert reasoning["generated_outputs"] == ["3", "7"]
+            assert "sum to 3" in reasoning["trace"]
+            assert reasoning["repair"]["repaired"] is True
+            assert reasoning["usage"]["calls"] == 2
+            assert stats["reasoning"]["repaired"] == stats["naive"]["repaired"] == 1
+        else:
+            assert naive["generated_outputs"] == ["NO_CODE_EXTRACTED", "NO_CODE_EXTRACTED"]
+            assert reasoning["generated_outputs"] == ["N/A", "N/A"]
+            assert reasoning["repair"] == {"repaired": False, "usage": None}
+            assert stats["reasoning"]["parse_failures"] == 1
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mock_server", [{"malformed_models": ("cheap",)}], indirect=True)
+    async def test_cascade_escalates_failed_answers(self, mock_server, make_generator, sum_problem):
+        """Test that a model whose answer fails the check is escalated and both attempts are recorded."""
+        _, mock = mock_server
+        generator = make_generator(settings={"cascade_models": ["cheap", "strong"], "cascade_check": "parsed",
+                                             "max_repairs": 0})
+        async with generator.client:
+            reasoning = await generator.generate_response(sum_problem, "reasoning")
+            generator.cascade_models = ["strong", "cheap"]
+            naive = await generator.generate_response(sum_problem, "naive")
+        
+        assert reasoning["model"] == "strong"
+        assert reasoning["generated_outputs"] == ["3", "7"]
+        assert [(a["model"], a["passed"]) for a in reasoning["attempts"]] == [("cheap", False), ("strong", True)]
+        assert reasoning["usage"]["calls"] == 2
+        assert [a["model"] for a in naive["attempts"]] == ["strong"]
+        assert mock.requests == 3
+        assert generator.cascade_stats.escalation_rate("reasoning") == 1.0
+        assert generator.usage_tracker.format_report().count("cheap") >= 1
+    
+    @pytest.mark.asyncio
+    async def test_adaptive_max_tokens_retries_truncation(self, tmp_path, mock_server, make_generator, sum_problem):
+        """Test that a learned budget too small for a reply is retried with a larger one and lengths are saved."""
+        _, mock = mock_server
+        stats_file = tmp_path / "lengths.json"
+        stats_file.write_text(json.dumps({"m|reasoning|EASY": [20] * 20}))
+        generator = make_generator(model="m", adaptive_max_tokens=True, length_stats_file=str(stats_file))
+        generator.length_stats.floor = 16
+        async with generator.client:
+            reasoning = await generator.generate_response(sum_problem, "reasoning")
+        generator.length_stats.save()
+        
+        assert reasoning["generated_outputs"] == ["3", "7"]
+        assert mock.requests > 1
+        assert reasoning["usage"]["calls"] == mock.requests
+        assert generator.length_stats.truncation_retries == mock.requests - 1
+        saved = json.loads(stats_file.read_text())["m|reasoning|EASY"]
+        assert len(saved) == 21 and saved[-1] > 20
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mock_server", [{"malformed_models": ("m",)}], indirect=True)
+    @pytest.mark.parametrize("backend_name", ["local", "openai"])
+    async def test_batch_mode_matches_online(self, tmp_path, mock_server, make_generator, backend_name):
+        """Test that batch mode produces the same records as the online path."""
+        from batch import OpenAIBatchBackend
+        
+        base_url, mock = mock_server
+        problems = sum_problems(3)
+        
+        def records(path):
+            lines = [json.loads(line) for line in path.read_text().splitlines()]
+            for line in lines:
+                del line["id"]
+                for usage in (line["usage"], line.get("repair", {}).get("usage") or {}):
+                    usage.pop("latency", None)
+            return sorted(lines, key=lambda r: (r["problem_id"], r["type"]))
+        
+        # Every first reply lacks its answer block, so the repair follow-ups go through batches too
+        online = make_generator("online.jsonl", model="m")
+        await online.process_problems_from_list(problems)
+        
+        batched = make_generator("batch.jsonl", model="m")
+        backend = OpenAIBatchBackend(base_url, "test-key") if backend_name == "openai" else None
+        await batched.process_problems_batch(
+            problems, backend=backend, batch_dir=str(tmp_path / "batches"), poll_interval=0.01
+        )
+        
+        batch_records = records(tmp_path / "batch.jsonl")
+        assert batch_records == records(tmp_path / "online.jsonl")
+        assert all(record["repair"]["repaired"] for record in batch_records)
+        # One job for the first completions, one for the follow-ups
+        assert len(list((tmp_path / "batches").glob("*-input.jsonl"))) == 2
+        if backend_name == "openai":
+            assert mock.batched_requests == 12
+    
+    @pytest.mark.asyncio
+    async def test_prompt_cache_layout(self, mock_server, make_generator, sum_problem):
+        """Test that both personas share the problem prefix and the second call reports it as cached."""
+        _, mock = mock_server
+        generator = make_generator(settings={"prompt_cache": True, "cache_control": True})
+        async with generator.client:
+            naive = await generator.generate_response(sum_problem, "naive")
+            reasoning = await generator.generate_response(sum_problem, "reasoning")
+        
+        assert naive["generated_outputs"][0] == "3"
+        assert reasoning["generated_outputs"] == ["3", "7"]
+        assert naive["usage"]["cached_tokens"] == 0
+        assert reasoning["usage"]["cached_tokens"] > 0
+        assert mock.cached_tokens == reasoning["usage"]["cached_tokens"]
+        assert "cached" in generator.usage_tracker.format_report()
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("mock_server", [{"latency_mean": 0.01, "malformed_models": ("cheap",)}], indirect=True)
+    async def test_staged_pipeline_with_cascade(self, tmp_path, mock_server, make_generator):
+        """Test a pipeline run: every response is saved, escalations loop back and stages report their load."""
+        _, mock = mock_server
+        generator = make_generator(settings={
+            "cascade_models": ["cheap", "strong"], "cascade_check": "parsed", "max_repairs": 0,
+            "stage_workers": {"llm": 3, "sandbox": 2}
+        })
+        await generator.process_problems_from_list(sum_problems(5))
+        
+        records = [json.loads(line) for line in (tmp_path / "responses.jsonl").read_text().splitlines()]
+        assert sorted((r["problem_id"], r["type"]) for r in records) == [
+            (i, persona) for i in range(1, 6) for persona in ("naive", "reasoning")
+        ]
+        assert all(r["model"] == "strong" and len(r["attempts"]) == 2 for r in records)
+        assert mock.requests == 20
+        stats = generator.pipeline.stats
+        assert stats["llm"].workers == 3 and stats["llm"].processed == 20
+        assert stats["persist"].processed == 10
+        assert stats["score"].dropped == 0
+        assert "bottleneck" in generator.pipeline.format_report()
+    
+    @pytest.mark.asyncio
+    async def test_resume_from_work_ledger(self, tmp_path, mock_server, make_generator):
+        """Test that a rerun generates only the units lost in a crash, and --fresh starts over."""
+        from ledger import IN_FLIGHT, WorkLedger
+        
+        _, mock = mock_server
+        problems = sum_problems(3)
+        output_file = tmp_path / "responses.jsonl"
+        
+        async def run(resume=True):
+            """Run the sweep; returns the generator and how many requests it sent"""
+            sent = mock.requests
+            generator = make_generator(settings={"resume": resume})
+            await generator.process_problems_from_list(problems)
+            return generator, mock.requests - sent
+        
+        def saved():
+            return sorted((r["problem_id"], r["type"]) for r in map(json.loads, output_file.read_text().splitlines()))
+        
+        generator, requests = await run()
+        assert requests == 6
+        assert str(generator.ledger).startswith("WorkLedger(6 done")
+        
+        # A crash: two units were in flight, one of them had its response written already
+        lines = output_file.read_text().splitlines()
+        lost = json.loads(lines[-1])
+        output_file.write_text("\n".join(lines[:-1]) + "\n" + lines[-1][:20])
+        ledger = WorkLedger(generator.ledger_file)
+        ledger.mark_many([generator.unit_key(job) for job in generator.create_jobs(problems)
+                          if (int(job.problem.id), job.persona_type) in {(lost["problem_id"], lost["type"]), (1, "naive")}],
+                         IN_FLIGHT)
+        ledger.close()
+        
+        generator, requests = await run()
+        assert requests == 1
+        assert saved() == [(i, persona) for i in range(1, 4) for persona in ("naive", "reasoning")]
+        
+        generator, requests = await run()
+        assert requests == 0
+        
+        generator, requests = await run(resume=False)
+        assert requests == 6
+        assert len(saved()) == 6
+    
+    @pytest.mark.asyncio
+    async def test_sharded_run_merges_to_full_run(self, tmp_path, mock_server, make_generator):
+        """Test that shards split the units between them and their merged segments match one full run."""
+        from sharding import merge_segments, shard_output_file
+        
+        _, mock = mock_server
+        problems = sum_problems(6)
+        
+        def records(path):
+            lines = [json.loads(line) for line in path.read_text().splitlines()]
+            return [(r["problem_id"], r["type"], r["generated_outputs"]) for r in lines]
+        
+        await make_generator("full.jsonl").process_problems_from_list(problems)
+        
+        merged = tmp_path / "responses.jsonl"
+        segments = []
+        for index in range(2):
+            segment = shard_output_file(str(merged), index, 2)
+            await make_generator(segment, settings={"shard": (index, 2)}).process_problems_from_list(problems)
+            segments.append(segment)
+        
+        assert mock.requests == 24
+        sizes = [len(Path(segment).read_text().splitlines()) for segment in segments]
+        assert sum(sizes) == 12 and all(sizes)
+        stats = merge_segments(segments + segments[:1], str(merged))
+        assert stats["duplicates"] == sizes[0]
+        assert records(merged) == sorted(records(tmp_path / "full.jsonl"), key=lambda r: (r[0], r[1]))
+    
+    @pytest.mark.asyncio
+    async def test_ledger_commits_with_output_batches(self, make_generator, monkeypatch):
+        """Test that with fsync the ledger is forced to disk once per output batch, off the event loop."""
+        import threading
+        import jsonl_writer
+        import ledger
+        
+        loop_fsyncs = []
+        real_fsync = os.fsync
+        
+        def counting_fsync(fd):
+            loop_fsyncs.append(threading.current_thread() is threading.main_thread())
+            real_fsync(fd)
+        
+        monkeypatch.setattr(jsonl_writer.os, "fsync", counting_fsync)
+        monkeypatch.setattr(ledger.os, "fsync", counting_fsync)
+        generator = make_generator(settings={"write_fsync": True, "write_batch_size": 10})
+        await generator.process_problems_from_list(sum_problems(25))
+        
+        batches = generator.ledger.appends
+        assert str(generator.ledger).startswith("WorkLedger(50 done")
+        assert batches <= 6
+        # One fsync per output batch and one per ledger append; on the loop only the final ledger flush
+        assert len(loop_fsyncs) <= 2 * batches + 1
+        assert sum(loop_fsyncs) <= 1
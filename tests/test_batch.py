@@ -0,0 +1,132 @@
+"""Unit tests for batch.py module."""
+import asyncio
+import json
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from batch import (
+    BatchBackend,
+    BatchCollector,
+    LocalBatchBackend,
+    batch_line,
+    parse_result_line,
+    result_line
+)
+from lm_client import OpenRouterError
+
+
+def reply(content):
+    return {"choices": [{"message": {"content": content}, "finish_reason": "stop"}]}
+
+
+class EchoBackend(BatchBackend):
+    """In-memory backend answering each request with its last message, recording job sizes."""
+    
+    def __init__(self, fail_ids=(), state="completed"):
+        self.jobs = {}
+        self.sizes = []
+        self.fail_ids = set(fail_ids)
+        self.state = state
+    
+    async def submit(self, input_path):
+        lines = [json.loads(line) for line in Path(input_path).read_text().splitlines()]
+        self.sizes.append(len(lines))
+        job_id = f"job-{len(self.jobs)}"
+        self.jobs[job_id] = lines
+        return job_id
+    
+    async def status(self, job_id):
+        return self.state
+    
+    async def download(self, job_id, output_path):
+        with open(output_path, 'w') as f:
+            for line in self.jobs[job_id]:
+                if line["custom_id"] in self.fail_ids:
+                    out = result_line(line["custom_id"], status_code=400, error="bad request")
+                else:
+                    out = result_line(line["custom_id"], reply(line["body"]["messages"][-1]["content"]))
+                f.write(json.dumps(out) + '\n')
+
+
+class TestBatchLines:
+    """Tests for the batch file formats."""
+    
+    def test_round_trip(self):
+        """Test input lines and parsing of successful and failed output lines."""
+        line = batch_line("request-0", {"model": "m", "messages": []})
+        assert line["url"] == "/v1/chat/completions" and line["method"] == "POST"
+        assert parse_result_line(result_line("request-0", reply("hi")))["choices"][0]["message"]["content"] == "hi"
+        with pytest.raises(OpenRouterError) as exc_info:
+            parse_result_line(result_line("request-0", status_code=429, error="slow down"))
+        assert exc_info.value.status == 429
+        with pytest.raises(OpenRouterError):
+            parse_result_line(result_line("request-0", {"error": {"code": 502, "message": "upstream"}}))
+
+
+class TestBatchCollector:
+    """Tests for gathering requests into jobs."""
+    
+    @pytest.mark.asyncio
+    async def test_concurrent_requests_share_a_job(self, tmp_path):
+        """Test that requests arriving together go into one job and each caller gets its own result."""
+        backend = EchoBackend()
+        collector = BatchCollector(backend, str(tmp_path), linger=0.05, poll_interval=0.01)
+        results = await asyncio.gather(*(
+            collector.request({"model": "m", "messages": [{"role": "user", "content": f"q{i}"}]}) for i in range(5)
+        ))
+        assert [r["choices"][0]["message"]["content"] for r in results] == [f"q{i}" for i in range(5)]
+        assert backend.sizes == [5]
+        assert len(list(tmp_path.glob("*-input.jsonl"))) == 1
+        await collector.close()
+    
+    @pytest.mark.asyncio
+    async def test_max_batch_size_splits_jobs(self, tmp_path):
+        """Test that a full batch is submitted without waiting for the linger timer."""
+        backend = EchoBackend()
+        collector = BatchCollector(backend, str(tmp_path), max_batch_size=2, linger=0.05, poll_interval=0.01)
+        await asyncio.gather(*(
+            collector.request({"model": "m", "messages": [{"role": "user", "content": "q"}]}) for _ in range(5)
+        ))
+        assert backend.sizes == [2, 2, 1]
+        await collector.close()
+    
+    @pytest.mark.asyncio
+    async def test_failed_lines_and_jobs_raise(self, tmp_path):
+        """Test that per-request errors and failed jobs surface as OpenRouterError."""
+        collector = BatchCollector(EchoBackend(fail_ids={"request-0"}), str(tmp_path), linger=0.01, poll_interval=0.01)
+        with pytest.raises(OpenRouterError) as exc_info:
+            await collector.request({"model": "m", "messages": [{"role": "user", "content": "q"}]})
+        assert exc_info.value.status == 400
+        
+        collector = BatchCollector(EchoBackend(state="expired"), str(tmp_path), linger=0.01, poll_interval=0.01)
+        with pytest.raises(OpenRouterError, match="expired"):
+            await collector.request({"model": "m", "messages": [{"role": "user", "content": "q"}]})
+        assert collector.failed_requests == 1
+
+
+class TestLocalBatchBackend:
+    """Tests for the file-based stand-in."""
+    
+    @pytest.mark.asyncio
+    async def test_runs_job_through_send(self, tmp_path):
+        """Test that a local job answers every line through `send`, keeping errors per request."""
+        async def send(payload):
+            if payload["messages"][0]["content"] == "bad":
+                raise OpenRouterError(400, "bad request")
+            return reply("ok")
+        
+        backend = LocalBatchBackend(send, str(tmp_path / "jobs"))
+        collector = BatchCollector(backend, str(tmp_path), linger=0.01, poll_interval=0.01)
+        good, bad = await asyncio.gather(
+            collector.request({"model": "m", "messages": [{"role": "user", "content": "good"}]}),
+            collector.request({"model": "m", "messages": [{"role": "user", "content": "bad"}]}),
+            return_exceptions=True
+        )
+        assert good["choices"][0]["message"]["content"] == "ok"
+        assert isinstance(bad, OpenRouterError) and bad.status == 400
+        job_dir = next((tmp_path / "jobs").iterdir())
+        assert json.loads((job_dir / "status.json").read_text())["status"] == "completed"
+        await collector.close()
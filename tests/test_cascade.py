@@ -0,0 +1,53 @@
+"""Unit tests for cascade.py module."""
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from cascade import CASCADE_CHECKS, CascadeStats, answer_correct, answer_parsed, answer_ran
+from confusion_matrix_utils import calculate_confusion_matrix_stats
+
+
+def record(persona, generated, expected=("3", "7")):
+    return {
+        "type": persona,
+        "expected_outputs": list(expected),
+        "generated_outputs": list(generated),
+        "confusion_matrix": calculate_confusion_matrix_stats(list(expected), list(generated))
+    }
+
+
+class TestCascadeChecks:
+    """Tests for the checks that stop a cascade."""
+    
+    def test_parsed(self):
+        """Test that missing code / outputs fail the parse check."""
+        assert not answer_parsed(record("naive", ["NO_CODE_EXTRACTED"] * 2))
+        assert not answer_parsed(record("reasoning", ["N/A", "N/A"]))
+        assert answer_parsed(record("reasoning", ["3", "8"]))
+    
+    def test_ran(self):
+        """Test that code that raised fails the ran check but wrong output does not."""
+        assert not answer_ran(record("naive", ["ERROR: Traceback"] * 2))
+        assert answer_ran(record("naive", ["3", "8"]))
+    
+    def test_correct(self):
+        """Test that every sample case must match."""
+        assert answer_correct(record("naive", ["3", "7"]))
+        assert not answer_correct(record("naive", ["3", "8"]))
+        assert set(CASCADE_CHECKS) == {"parsed", "ran", "correct"}
+
+
+class TestCascadeStats:
+    """Tests for cascade accounting."""
+    
+    def test_escalation_rate(self):
+        """Test per-model pass counts and the share of escalated responses."""
+        stats = CascadeStats()
+        stats.record("naive", [{"model": "cheap", "passed": True}])
+        stats.record("naive", [{"model": "cheap", "passed": False}, {"model": "strong", "passed": True}])
+        values = stats.to_dict()["naive"]
+        assert values["models"] == {"cheap": {"attempts": 2, "passed": 1}, "strong": {"attempts": 1, "passed": 1}}
+        assert stats.escalation_rate("naive") == 0.5
+        assert "cheap 1/2" in str(stats)
@@ -0,0 +1,100 @@
+"""Unit tests for completion_cache.py module."""
+import os
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from completion_cache import CompletionCache, request_fingerprint
+from lm_client import OpenRouterClient
+
+MESSAGES = [{"role": "user", "content": "Hello"}]
+RESPONSE = {"choices": [{"message": {"content": "Hi!"}, "finish_reason": "stop"}]}
+
+
+class TestRequestFingerprint:
+    """Tests for cache key computation."""
+    
+    def test_stable_across_key_order(self):
+        """Test that dict ordering does not change the key."""
+        a = request_fingerprint("https://x/api", {"model": "m", "messages": MESSAGES, "temperature": 0.0})
+        b = request_fingerprint("https://x/api", {"temperature": 0.0, "messages": MESSAGES, "model": "m"})
+        assert a == b
+    
+    def test_sensitive_to_inputs(self):
+        """Test that model, params and base URL all change the key."""
+        base = request_fingerprint("https://x/api", {"model": "m", "messages": MESSAGES})
+        assert base != request_fingerprint("https://x/api", {"model": "n", "messages": MESSAGES})
+        assert base != request_fingerprint("https://x/api", {"model": "m", "messages": MESSAGES, "temperature": 1})
+        assert base != request_fingerprint("https://y/api", {"model": "m", "messages": MESSAGES})
+    
+    def test_stream_flag_ignored(self):
+        """Test that streaming and non-streaming requests share a key."""
+        a = request_fingerprint("https://x/api", {"model": "m", "messages": MESSAGES})
+        b = request_fingerprint("https://x/api", {"model": "m", "messages": MESSAGES, "stream": True})
+        assert a == b
+
+
+class TestCompletionCache:
+    """Tests for the on-disk cache."""
+    
+    def test_put_then_get(self, tmp_path):
+        """Test round-tripping an entry and hit/miss counters."""
+        cache = CompletionCache(str(tmp_path))
+        assert cache.get("ab" * 32) is None
+        cache.put("ab" * 32, RESPONSE)
+        assert cache.get("ab" * 32) == RESPONSE
+        assert cache.hits == 1
+        assert cache.misses == 1
+    
+    def test_disabled_cache(self, tmp_path):
+        """Test that a disabled cache never stores anything."""
+        cache = CompletionCache(str(tmp_path / "off"), enabled=False)
+        cache.put("ab" * 32, RESPONSE)
+        assert cache.get("ab" * 32) is None
+        assert not (tmp_path / "off").exists()
+    
+    def test_lru_eviction(self, tmp_path):
+        """Test that the least recently used entries are evicted first."""
+        cache = CompletionCache(str(tmp_path), max_bytes=10 ** 9)
+        keys = [f"{i:02d}" * 32 for i in range(3)]
+        for i, key in enumerate(keys):
+            cache.put(key, RESPONSE)
+            os.utime(cache._path(key), (1000 + i, 1000 + i))
+        # Touch the oldest entry so it becomes the most recently used
+        cache.get(keys[0])
+        cache.max_bytes = os.path.getsize(cache._path(keys[0])) + os.path.getsize(cache._path(keys[2]))
+        cache.evict()
+        assert os.path.exists(cache._path(keys[0]))
+        assert not os.path.exists(cache._path(keys[1]))
+        assert os.path.exists(cache._path(keys[2]))
+        assert cache.evictions == 1
+
+
+class TestClientCaching:
+    """Tests for cache integration in OpenRouterClient."""
+    
+    @pytest.mark.asyncio
+    async def test_second_call_is_served_from_cache(self, tmp_path):
+        """Test that identical requests only hit the API once."""
+        client = OpenRouterClient("test_api_key", cache=CompletionCache(str(tmp_path)))
+        with patch.object(client, '_post_chat', AsyncMock(return_value=RESPONSE)) as post:
+            first = await client.async_chat("m", MESSAGES, temperature=0.0)
+            second = await client.async_chat("m", MESSAGES, temperature=0.0)
+        assert first == second == "Hi!"
+        assert post.await_count == 1
+        assert client.cache.hits == 1
+    
+    @pytest.mark.asyncio
+    async def test_cached_completion_replays_as_stream(self, tmp_path):
+        """Test that a cached completion is replayed through async_chat_stream."""
+        client = OpenRouterClient("test_api_key", cache=CompletionCache(str(tmp_path)))
+        with patch.object(client, '_post_chat', AsyncMock(return_value=RESPONSE)):
+            await client.async_chat("m", MESSAGES)
+        stream = client.async_chat_stream("m", MESSAGES)
+        deltas = [delta async for delta in stream]
+        assert deltas == ["Hi!"]
+        assert stream.from_cache
+        assert stream.finish_reason == "stop"
@@ -0,0 +1,95 @@
+"""Unit tests for concurrency.py module."""
+import asyncio
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from concurrency import AdaptiveConcurrencyLimiter, is_overload
+from lm_client import OpenRouterError
+
+
+class TestIsOverload:
+    """Tests for overload classification."""
+    
+    def test_overload_signals(self):
+        """Test 429/503 and timeouts are overloads, other errors are not."""
+        assert is_overload(OpenRouterError(429, "slow down"))
+        assert is_overload(OpenRouterError(503, "unavailable"))
+        assert is_overload(asyncio.TimeoutError())
+        assert not is_overload(OpenRouterError(500, "oops"))
+        assert not is_overload(ValueError("bad json"))
+
+
+class TestAdaptiveConcurrencyLimiter:
+    """Tests for the AIMD limiter."""
+    
+    @pytest.mark.asyncio
+    async def test_additive_increase(self):
+        """Test that healthy successes grow the limit by about one per window."""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4, max_limit=10)
+        for _ in range(4):
+            await limiter.acquire()
+            await limiter.release(0.1)
+        assert int(limiter.limit) == 4
+        for _ in range(20):
+            await limiter.acquire()
+            await limiter.release(0.1)
+        assert int(limiter.limit) > 5
+    
+    @pytest.mark.asyncio
+    async def test_limit_is_capped(self):
+        """Test that the limit never exceeds max_limit."""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=3)
+        for _ in range(100):
+            await limiter.acquire()
+            await limiter.release(0.1)
+        assert int(limiter.limit) == 3
+    
+    @pytest.mark.asyncio
+    async def test_multiplicative_decrease_on_429(self):
+        """Test that overloads halve the limit once per cooldown."""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=16, max_limit=16, cooldown=60)
+        for _ in range(3):
+            await limiter.acquire()
+            await limiter.release(0.1, OpenRouterError(429, "slow down"))
+        assert int(limiter.limit) == 8
+        assert limiter.overloads == 3
+        assert limiter.history[-1][1:] == (8, "decrease")
+    
+    @pytest.mark.asyncio
+    async def test_other_errors_do_not_change_limit(self):
+        """Test that non-overload errors leave the limit alone."""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4)
+        await limiter.acquire()
+        await limiter.release(0.1, OpenRouterError(400, "bad request"))
+        assert int(limiter.limit) == 4
+        assert limiter.errors == 1
+    
+    @pytest.mark.asyncio
+    async def test_slow_responses_do_not_increase(self):
+        """Test that latency far above the average blocks increases."""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=4, latency_tolerance=2.0)
+        await limiter.acquire()
+        await limiter.release(0.1)
+        before = limiter.limit
+        await limiter.acquire()
+        await limiter.release(5.0)
+        assert limiter.limit == before
+    
+    @pytest.mark.asyncio
+    async def test_in_flight_is_bounded(self):
+        """Test that no more than `limit` slots are held at once."""
+        limiter = AdaptiveConcurrencyLimiter(initial_limit=2, max_limit=2)
+        
+        async def work():
+            async with limiter.slot():
+                await asyncio.sleep(0.01)
+        
+        await asyncio.gather(*(work() for _ in range(10)))
+        assert limiter.peak_in_flight == 2
+        assert limiter.in_flight == 0
+        metrics = limiter.metrics()
+        assert metrics["successes"] == 10
+        assert metrics["limit"] == 2
@@ -0,0 +1,110 @@
+"""Unit tests for early_stop.py module."""
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from early_stop import (
+    REASONER_STOP_SEQUENCES,
+    AnswerDetector,
+    EarlyStopStats,
+    is_calibration_sample,
+    json_block_end,
+    restore_stop_sequence
+)
+from get_reasoning_traces import parse_reasoner_response
+
+REASONER = 'Reasoning.\n\n```json\n{\n  "outputs": ["1"]\n}\n```\n\nMore words.'
+
+
+class TestAnswerEnd:
+    """Tests for detecting where the answer ends."""
+    
+    def test_json_block_end(self):
+        """Test the end of the first closed json block."""
+        end = json_block_end(REASONER)
+        assert REASONER[:end].endswith("}\n```")
+        assert json_block_end('```json\n{"outputs": [') is None
+
+
+class TestRestoreStopSequence:
+    """Tests for closing fences cut off by stop sequences."""
+    
+    def test_reasoner_stop(self):
+        """Test that a reasoner reply cut inside its JSON block parses again."""
+        cut = REASONER[:REASONER.index(REASONER_STOP_SEQUENCES[0])]
+        restored = restore_stop_sequence(cut, REASONER_STOP_SEQUENCES)
+        assert json_block_end(restored) == len(restored)
+    
+    def test_code_block_before_answer(self):
+        """Test that a non-JSON fence ending in a brace does not match the stop sequence."""
+        text = ('The C++ version would be:\n```cpp\nint main() {\n  return 0;\n}\n```\n\n'
+                'Input 1 sums to 3.\n\n```json\n{\n  "outputs": ["3"]\n}\n```\n\nDone.')
+        stop = REASONER_STOP_SEQUENCES[0]
+        cut = text[:text.index(stop)]
+        assert "```cpp" in cut and "```json" in cut
+        restored = restore_stop_sequence(cut, REASONER_STOP_SEQUENCES)
+        _, _, generated = parse_reasoner_response(restored, ["1 2"], ["3"])
+        assert generated == ["3"]
+    
+    def test_truncated_reply_untouched(self):
+        """Test that a reply cut off at max_tokens is not closed as if a stop sequence had matched."""
+        truncated = 'Reasoning.\n\n```json\n{\n  "outputs": ["3", "4'
+        assert restore_stop_sequence(truncated, REASONER_STOP_SEQUENCES, "length") == truncated
+        assert restore_stop_sequence(truncated, REASONER_STOP_SEQUENCES, "stop") != truncated
+    
+    def test_complete_text_untouched(self):
+        """Test that text with balanced fences is returned as is."""
+        assert restore_stop_sequence(REASONER, REASONER_STOP_SEQUENCES) == REASONER
+
+
+class TestAnswerDetector:
+    """Tests for the streaming stop hook."""
+    
+    def test_fires_once_answer_is_complete(self):
+        """Test the detector on growing prefixes of a reply."""
+        detector = AnswerDetector(json_block_end)
+        end = json_block_end(REASONER)
+        assert not detector(REASONER[:end - 1])
+        assert detector(REASONER[:end])
+    
+    def test_skips_rescan_without_backticks(self):
+        """Test that new text without backticks is not re-parsed."""
+        calls = []
+        
+        def answer_end(text):
+            calls.append(text)
+            return None
+        
+        detector = AnswerDetector(answer_end)
+        detector("plain text")
+        detector("plain text and more")
+        detector("plain text and more ```")
+        assert calls == ["plain text and more ```"]
+
+
+class TestEarlyStopStats:
+    """Tests for savings accounting."""
+    
+    def test_calibration_sample_is_deterministic(self):
+        """Test that sampling depends only on the key."""
+        keys = [f"{i}/reasoning" for i in range(1000)]
+        picked = [k for k in keys if is_calibration_sample(k, 0.1)]
+        assert picked == [k for k in keys if is_calibration_sample(k, 0.1)]
+        assert 50 < len(picked) < 150
+        assert not any(is_calibration_sample(k, 0.0) for k in keys)
+    
+    def test_estimated_savings(self):
+        """Test that savings are stops times the mean calibration tail."""
+        stats = EarlyStopStats()
+        stats.record_calibration("reasoning", REASONER, json_block_end, tokens_per_second=10.0)
+        stats.record_stopped("reasoning", True)
+        stats.record_stopped("reasoning", True)
+        stats.record_stopped("reasoning", False)
+        tail_tokens = (len(REASONER) - json_block_end(REASONER)) / 4
+        tokens, seconds = stats.estimated_savings("reasoning")
+        assert tokens == pytest.approx(2 * tail_tokens)
+        assert seconds == pytest.approx(2 * tail_tokens / 10.0)
+        assert stats.to_dict()["reasoning"]["completions"] == 4
+        assert stats.estimated_savings("naive") == (0.0, 0.0)
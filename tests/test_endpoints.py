@@ -0,0 +1,213 @@
+"""Unit tests for endpoints.py module."""
+import json
+import random
+import time
+import pytest
+import pytest_asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+sys.path.insert(0, str(Path(__file__).parent.parent / "tools"))
+
+from endpoints import CircuitBreaker, Endpoint, EndpointPool, load_endpoints
+from lm_client import OpenRouterClient, OpenRouterError
+from mock_openrouter import MockConfig, start_mock_server
+from retry import RetryPolicy
+
+
+class TestCircuitBreaker:
+    """Tests for the per-endpoint circuit breaker."""
+
+    def test_opens_after_threshold(self):
+        """Test that consecutive failures open the breaker."""
+        breaker = CircuitBreaker(failure_threshold=3)
+        for _ in range(2):
+            breaker.record_failure()
+        assert breaker.available()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert not breaker.available()
+        assert breaker.times_opened == 1
+
+    def test_success_resets_count(self):
+        """Test that a success clears the consecutive failure count."""
+        breaker = CircuitBreaker(failure_threshold=2)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open_admits_one_trial(self):
+        """Test that after the reset timeout a single trial request is allowed."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=10.0)
+        breaker.record_failure()
+        breaker.opened_at = time.monotonic() - 11.0
+        assert breaker.available()
+        breaker.on_routed()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert not breaker.available()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_available_has_no_side_effects(self):
+        """Test that checking availability does not move an open breaker to half-open."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+        assert breaker.available() and breaker.available()
+        assert breaker.state == CircuitBreaker.OPEN
+
+    def test_cancelled_trial_is_released(self):
+        """Test that a cancelled half-open trial lets the next request be the trial, without counting a failure."""
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.0)
+        breaker.record_failure()
+        breaker.on_routed()
+        assert not breaker.available()
+        breaker.release_trial()
+        assert breaker.available()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.consecutive_failures == 1 and breaker.times_opened == 1
+
+    def test_half_open_failure_reopens(self):
+        """Test that a failed trial opens the breaker again."""
+        breaker = CircuitBreaker(failure_threshold=5, reset_timeout=0.0)
+        for _ in range(5):
+            breaker.record_failure()
+        assert breaker.available()
+        breaker.on_routed()
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        assert breaker.times_opened == 2
+
+
+class TestEndpointPool:
+    """Tests for weighted, health-aware routing."""
+
+    def test_weighted_choice(self):
+        """Test that traffic follows the configured weights."""
+        heavy = Endpoint("http://a", "k1", weight=3.0)
+        light = Endpoint("http://b", "k2", weight=1.0)
+        pool = EndpointPool([heavy, light], rng=random.Random(0))
+        picks = [pool.choose() for _ in range(2000)]
+        share = picks.count(heavy) / len(picks)
+        assert 0.7 < share < 0.8
+
+    def test_slow_endpoint_gets_less_traffic(self):
+        """Test that latency scales the effective weight down."""
+        fast = Endpoint("http://a", "k1")
+        slow = Endpoint("http://b", "k2")
+        fast.record_success(1.0)
+        slow.record_success(4.0)
+        pool = EndpointPool([fast, slow], rng=random.Random(0))
+        picks = [pool.choose() for _ in range(2000)]
+        assert picks.count(fast) > 3 * picks.count(slow)
+
+    def test_skips_open_and_excluded(self):
+        """Test that open breakers and already-tried endpoints are avoided."""
+        a, b, c = Endpoint("http://a", "k"), Endpoint("http://b", "k"), Endpoint("http://c", "k")
+        pool = EndpointPool([a, b, c])
+        a.breaker = CircuitBreaker(failure_threshold=1)
+        a.record_failure()
+        assert {pool.choose(exclude=[b]) for _ in range(50)} == {c}
+        assert pool.has_alternative(c, exclude=[b]) is False
+        assert pool.has_alternative(b) is True
+
+    def test_all_open_falls_back(self):
+        """Test that the oldest open endpoint is still used when every breaker is open."""
+        a, b = Endpoint("http://a", "k"), Endpoint("http://b", "k")
+        for endpoint in (a, b):
+            endpoint.breaker = CircuitBreaker(failure_threshold=1)
+        a.record_failure()
+        b.record_failure()
+        assert EndpointPool([a, b]).choose() is a
+
+    def test_load_endpoints(self, tmp_path, monkeypatch):
+        """Test loading endpoints from JSON, with keys from the environment."""
+        monkeypatch.setenv("SECOND_KEY", "sk-env")
+        path = tmp_path / "endpoints.json"
+        path.write_text(json.dumps([
+            {"base_url": "http://a/v1/", "api_key": "sk-1", "weight": 2},
+            {"base_url": "http://b/v1", "api_key_env": "SECOND_KEY", "name": "local"}
+        ]))
+        first, second = load_endpoints(str(path))
+        assert first.base_url == "http://a/v1"
+        assert first.weight == 2.0
+        assert second.api_key == "sk-env"
+        assert second.name == "local"
+
+
+class TestClientFailover:
+    """Tests for failover between real (mock) servers."""
+
+    @pytest_asyncio.fixture
+    async def mock_server(self):
+        servers = []
+
+        async def start(config):
+            runner, base_url, mock = await start_mock_server(config)
+            servers.append(runner)
+            return base_url, mock
+
+        yield start
+        for runner in servers:
+            await runner.cleanup()
+
+    @pytest.mark.asyncio
+    async def test_fails_over_without_backoff(self, mock_server):
+        """Test that a failing endpoint is skipped and its breaker opens."""
+        broken_url, broken = await mock_server(MockConfig(rate_5xx=1.0, latency_mean=0))
+        healthy_url, healthy = await mock_server(MockConfig(reply="ok", latency_mean=0))
+        broken_endpoint = Endpoint(broken_url, "k1", breaker=CircuitBreaker(failure_threshold=2))
+        endpoints = [broken_endpoint, Endpoint(healthy_url, "k2")]
+        # A long base delay would make the test hang if failover backed off
+        policy = RetryPolicy(max_attempts=3, base_delay=30.0)
+        async with OpenRouterClient("unused", retry_policy=policy, endpoints=endpoints) as client:
+            for i in range(10):
+                messages = [{"role": "user", "content": f"q{i}"}]
+                assert await client.async_chat("m", messages) == "ok"
+        assert healthy.requests == 10
+        assert broken.requests <= 2
+        assert broken_endpoint.breaker.state == CircuitBreaker.OPEN
+        assert client.pool.failovers == broken.requests
+
+    @pytest.mark.asyncio
+    async def test_bad_request_does_not_fail_over(self, mock_server):
+        """Test that client errors are fatal and do not count against the endpoint."""
+        base_url, _ = await mock_server(MockConfig(latency_mean=0))
+        endpoints = [Endpoint(base_url, "k1"), Endpoint(base_url, "k2")]
+        async with OpenRouterClient("unused", endpoints=endpoints) as client:
+            error = OpenRouterError(400, "bad request")
+            client._endpoint_failed(endpoints[0], error, [endpoints[0]])
+        assert not getattr(error, "retry_elsewhere", False)
+        assert endpoints[0].failures == 0
+
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("stream", [False, True])
+    async def test_cancelled_half_open_trial(self, mock_server, stream):
+        """Test that cancelling the half-open trial request (e.g. a hedge loser) does not strand the endpoint."""
+        import asyncio
+        base_url, _ = await mock_server(MockConfig(reply="x" * 400, latency_mean=0 if stream else 30,
+                                                   tokens_per_second=5 if stream else 0))
+        endpoint = Endpoint(base_url, "k1", breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0.0))
+        endpoint.record_failure()
+        async with OpenRouterClient("unused", endpoints=[endpoint]) as client:
+            started = asyncio.Event()
+
+            async def request():
+                messages = [{"role": "user", "content": "q"}]
+                if stream:
+                    async for _ in client.async_chat_stream("m", messages):
+                        started.set()
+                else:
+                    started.set()
+                    await client.async_chat("m", messages)
+
+            task = asyncio.ensure_future(request())
+            await started.wait()
+            await asyncio.sleep(0.05)
+            assert endpoint.breaker.state == CircuitBreaker.HALF_OPEN
+            assert not endpoint.breaker.available()
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        assert endpoint.breaker.available()
+        assert endpoint.failures == 1
@@ -0,0 +1,148 @@
+"""Unit tests for get_reasoning_traces.py module."""
+import json
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from data_structures import Problem
+from early_stop import REASONER_STOP_SEQUENCES, json_block_end
+from get_reasoning_traces import ReasoningTraceGenerator, load_problems_json, parse_reasoner_response
+from lm_client import ChatCompletion
+
+
+class TestParseReasonerResponse:
+    """Tests for the free-form reasoner response parser."""
+    
+    def test_json_fence(self):
+        """Test outputs in a trailing ```json block."""
+        response = 'Input 1 sums to 3.\n\n```json\n{"outputs": ["3", 7]}\n```'
+        reasoning, expected, generated = parse_reasoner_response(response, ["1 2", "3 4"], ["3", "7"])
+        assert reasoning == "Input 1 sums to 3."
+        assert expected == generated == ["3", "7"]
+    
+    def test_trailing_object(self):
+        """Test a bare JSON object at the end of the response."""
+        reasoning, _, generated = parse_reasoner_response('Thinking.\n{"outputs": ["5"]}', ["2 3"], ["5"])
+        assert reasoning == "Thinking."
+        assert generated == ["5"]
+    
+    def test_expected_outputs_line(self):
+        """Test the "Expected outputs: [...]" text fallback, truncated to the inputs."""
+        response = "So the answers are clear. Expected outputs: ['4', '-1', '9']"
+        reasoning, expected, generated = parse_reasoner_response(response, ["a", "b"], ["4", "-1"])
+        assert reasoning == response
+        assert expected == generated == ["4", "-1"]
+    
+    def test_unparsable(self):
+        """Test that unparsable responses record N/A outputs."""
+        reasoning, expected, generated = parse_reasoner_response("I am not sure {oops", ["a"], ["1"])
+        assert reasoning == "I am not sure {oops"
+        assert expected == ["1"]
+        assert generated == ["N/A"]
+    
+    def test_object_without_outputs(self):
+        """Test JSON without an outputs key falls back to N/A."""
+        _, expected, generated = parse_reasoner_response('Done.\n```json\n{}\n```', ["a"], ["1"])
+        assert expected == ["1"]
+        assert generated == ["N/A"]
+
+
+class TestLoadProblemsJson:
+    """Tests for reading the column-oriented problems file."""
+    
+    def test_problems(self, tmp_path):
+        """Test that rows become Problem objects with their sample tests."""
+        path = tmp_path / "problems.json"
+        path.write_text(json.dumps({
+            "question": {"0": "Add.", "1": "Echo."},
+            "difficulty": {"0": "EASY"},
+            "input_output": {"0": json.dumps({"inputs": ["1 2"], "outputs": ["3"]}), "1": {"inputs": ["x"], "outputs": ["x"]}}
+        }))
+        problems = load_problems_json(str(path))
+        assert [p.id for p in problems] == ["0", "1"]
+        assert problems[0].statement == "Add."
+        assert problems[0].sample_inputs == ["1 2"] and problems[0].sample_outputs == ["3"]
+        assert problems[1].difficulty == "UNKNOWN_DIFFICULTY"
+        assert problems[1].sample_inputs == ["x"]
+        assert len(load_problems_json(str(path), max_problems=1)) == 1
+
+
+class TestTimedOutJobs:
+    """Tests for selecting the responses to retry with --retry-timeouts."""
+    
+    def test_matches_non_string_problem_ids(self, tmp_path):
+        """Test that integer problem ids match the string ids stored in the timeouts file."""
+        generator = ReasoningTraceGenerator("test-key", output_file=str(tmp_path / "responses.jsonl"), use_cache=False)
+        problems = [
+            Problem(id=i, name=f"Sum {i}", statement="Add.", sample_inputs=["1 2"], sample_outputs=["3"],
+                    difficulty="EASY", solutions=[])
+            for i in (1, 2)
+        ]
+        generator.record_timeout(2, "reasoning", "run_timeout")
+        generator.write_timeouts()
+        
+        jobs = generator.timed_out_jobs(problems)
+        assert [(job.problem.id, job.persona_type) for job in jobs] == [(2, "reasoning")]
+        assert generator.timed_out_jobs(problems, ["naive"]) == []
+
+
+class TestFinishEarlyStop:
+    """Tests for closing replies cut by a stop sequence and counting early stops."""
+    
+    @pytest.mark.parametrize("finish_reason, stopped", [("stop", 1), ("length", 0)])
+    def test_only_stop_sequence_cuts_are_restored(self, tmp_path, finish_reason, stopped):
+        """Test that a truncated reply is neither closed again nor counted as an early stop."""
+        generator = ReasoningTraceGenerator("test-key", output_file=str(tmp_path / "responses.jsonl"), use_cache=False)
+        generator.early_stop = True
+        generator.early_stop_calibration = 0.0
+        content = 'Reasoning.\n\n```json\n{\n  "outputs": ["3", "4"'
+        completion = ChatCompletion(content, finish_reason=finish_reason)
+        
+        finished = generator._finish_early_stop(completion, 1, "reasoning", json_block_end, REASONER_STOP_SEQUENCES)
+        assert (json_block_end(finished) is not None) == bool(stopped)
+        assert generator.early_stop_stats.to_dict()["reasoning"]["stopped"] == stopped
+
+
+class TestCompletionLengthRecording:
+    """Tests for which completion lengths feed the adaptive max_tokens statistics."""
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("billed, finish_reason, kwargs, recorded", [
+        (True, "stop", {}, True),
+        (False, "stop", {}, False),
+        (True, "early_stop", {}, False),
+        (True, "stop", {"stop": REASONER_STOP_SEQUENCES}, False)
+    ])
+    async def test_records_only_billed_natural_ends(self, tmp_path, billed, finish_reason, kwargs, recorded):
+        """Test that cache hits and replies cut short early are not recorded."""
+        generator = ReasoningTraceGenerator(
+            "test-key", model="m", output_file=str(tmp_path / "responses.jsonl"), use_cache=False,
+            adaptive_max_tokens=True, length_stats_file=str(tmp_path / "lengths.json")
+        )
+        completion = ChatCompletion("reply", finish_reason=finish_reason, usage={"completion_tokens": 700}, billed=billed)
+        with patch.object(generator, "complete", AsyncMock(return_value=completion)):
+            await generator.complete_sized([], "m", "reasoning", "EASY", **kwargs)
+        
+        assert generator.length_stats.lengths.get("m|reasoning|EASY", []) == ([700] if recorded else [])
+
+
+class TestOpenLedger:
+    """Tests for resuming or starting over at the start of a run."""
+    
+    @pytest.mark.parametrize("resume", [True, False])
+    def test_fresh_run_clears_output(self, tmp_path, resume):
+        """Test that a fresh run empties the output file and the ledger, and a resumed one keeps both."""
+        output_file = tmp_path / "responses.jsonl"
+        generator = ReasoningTraceGenerator("test-key", output_file=str(output_file), use_cache=False)
+        output_file.write_text(json.dumps({"problem_id": 1, "type": "naive", "prompt_version": "1"}) + "\n")
+        generator.open_ledger()
+        generator.ledger.mark("1|naive|m|1", "done")
+        generator.ledger.close()
+        
+        generator.resume = resume
+        ledger = generator.open_ledger()
+        assert (output_file.read_text() != "") == resume
+        assert ledger.is_done("1|naive|m|1") == resume
@@ -0,0 +1,144 @@
+"""Unit tests for hedging.py module."""
+import asyncio
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from hedging import HedgePolicy, HedgeStats, percentile
+from lm_client import OpenRouterClient, OpenRouterError
+
+
+def seeded_policy(latency=0.05, **kwargs):
+    """Policy that has already seen enough samples to hedge after `latency` seconds."""
+    policy = HedgePolicy(min_samples=5, min_delay=0.0, max_hedge_rate=1.0, **kwargs)
+    for _ in range(5):
+        policy.record_latency("m", latency)
+    return policy
+
+
+def reply(content):
+    return {"choices": [{"message": {"content": content}}]}
+
+
+class TestHedgePolicy:
+    """Tests for hedge delay and budget decisions."""
+
+    def test_percentile(self):
+        """Test nearest-rank percentile."""
+        assert percentile([5, 1, 3, 2, 4], 0.5) == 3
+        assert percentile(list(range(100)), 0.95) == 95
+
+    def test_no_delay_without_samples(self):
+        """Test that nothing is hedged before min_samples latencies are known."""
+        policy = HedgePolicy(min_samples=3)
+        policy.record_latency("m", 1.0)
+        assert policy.hedge_delay("m") is None
+        assert policy.hedge_delay("other") is None
+
+    def test_delay_tracks_quantile(self):
+        """Test that the delay is the configured quantile, floored at min_delay."""
+        policy = HedgePolicy(quantile=0.9, min_samples=10, min_delay=0.5)
+        for i in range(1, 11):
+            policy.record_latency("m", float(i))
+        assert policy.hedge_delay("m") == 10.0
+        fast = HedgePolicy(min_samples=1, min_delay=0.5)
+        fast.record_latency("m", 0.1)
+        assert fast.hedge_delay("m") == 0.5
+
+    def test_hedge_rate_cap(self):
+        """Test that max_hedge_rate limits duplicates."""
+        policy = HedgePolicy(max_hedge_rate=0.1)
+        assert policy.may_hedge(HedgeStats(requests=20, hedged=1))
+        assert not policy.may_hedge(HedgeStats(requests=20, hedged=2))
+
+    def test_estimate_saving(self):
+        """Test the conditional remaining-latency estimate."""
+        policy = HedgePolicy()
+        for latency in (1.0, 2.0, 10.0, 20.0, 30.0):
+            policy.record_latency("m", latency)
+        assert policy.estimate_saving("m", 5.0) == 15.0
+        assert policy.estimate_saving("m", 40.0) == 0.0
+
+
+class TestClientHedging:
+    """Tests for hedged requests in OpenRouterClient."""
+
+    @pytest.mark.asyncio
+    async def test_fast_request_is_not_hedged(self):
+        """Test that requests finishing before the delay send no duplicate."""
+        client = OpenRouterClient("test_api_key", hedge_policy=seeded_policy(latency=1.0))
+        calls = []
+
+        async def post(payload, tried=None):
+            calls.append(payload)
+            return reply("fast")
+
+        with patch.object(client, '_post_chat', side_effect=post):
+            assert await client.async_chat("m", [{"role": "user", "content": "q"}]) == "fast"
+        assert len(calls) == 1
+        assert client.hedge_stats.hedged == 0
+        assert client.hedge_stats.requests == 1
+
+    @pytest.mark.asyncio
+    async def test_slow_request_is_hedged_and_loser_cancelled(self):
+        """Test that a slow original is duplicated, the hedge wins and the original is cancelled."""
+        client = OpenRouterClient("test_api_key", hedge_policy=seeded_policy())
+        cancelled = asyncio.Event()
+        calls = 0
+
+        async def post(payload, tried=None):
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    cancelled.set()
+                    raise
+            return reply(f"call {calls}")
+
+        with patch.object(client, '_post_chat', side_effect=post):
+            result = await asyncio.wait_for(client.async_chat("m", [{"role": "user", "content": "q"}]), 2)
+        await asyncio.wait_for(cancelled.wait(), 1)
+        assert result == "call 2"
+        assert client.hedge_stats.hedged == 1
+        assert client.hedge_stats.hedge_wins == 1
+
+    @pytest.mark.asyncio
+    async def test_hedge_model_route(self):
+        """Test that the duplicate goes to hedge_model and its answer is not cached."""
+        client = OpenRouterClient("test_api_key", hedge_policy=seeded_policy(hedge_model="backup"))
+        models = []
+
+        async def post(payload, tried=None):
+            models.append(payload["model"])
+            if payload["model"] == "m":
+                await asyncio.sleep(10)
+            return reply(payload["model"])
+
+        with patch.object(client, '_post_chat', side_effect=post):
+            data, billed = await asyncio.wait_for(client._fetch({"model": "m", "messages": []}), 2)
+        assert models == ["m", "backup"]
+        assert data["choices"][0]["message"]["content"] == "backup"
+
+    @pytest.mark.asyncio
+    async def test_failed_hedge_falls_back_to_original(self):
+        """Test that an erroring duplicate does not fail a request whose original succeeds."""
+        client = OpenRouterClient("test_api_key", hedge_policy=seeded_policy())
+        calls = 0
+
+        async def post(payload, tried=None):
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                await asyncio.sleep(0.2)
+                return reply("original")
+            raise OpenRouterError(400, "bad request")
+
+        with patch.object(client, '_post_chat', side_effect=post):
+            assert await client.async_chat("m", [{"role": "user", "content": "q"}]) == "original"
+        assert client.hedge_stats.hedge_failures == 1
+        assert client.hedge_stats.hedge_wins == 0
@@ -0,0 +1,119 @@
+"""Unit tests for jsonl_writer.py module."""
+import asyncio
+import json
+import os
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from jsonl_writer import AsyncJsonlWriter, truncate_partial_line
+
+
+def read_records(path):
+    return [json.loads(line) for line in Path(path).read_text().splitlines()]
+
+
+class TestAsyncJsonlWriter:
+    """Tests for the buffered group-commit writer."""
+    
+    @pytest.mark.asyncio
+    async def test_close_drains_queued_records(self, tmp_path):
+        """Test that records still queued at shutdown are written, in order."""
+        path = tmp_path / "out.jsonl"
+        async with AsyncJsonlWriter(str(path), max_batch=1000, max_delay=60) as writer:
+            for i in range(10):
+                await writer.write({"i": i})
+            assert not path.exists() or path.read_text() == ""
+        
+        assert read_records(path) == [{"i": i} for i in range(10)]
+        assert writer.batches == 1
+    
+    @pytest.mark.asyncio
+    async def test_flush_by_size(self, tmp_path):
+        """Test that a full batch is written without waiting for the interval."""
+        path = tmp_path / "out.jsonl"
+        async with AsyncJsonlWriter(str(path), max_batch=4, max_delay=60) as writer:
+            for i in range(8):
+                await writer.write({"i": i})
+            await asyncio.wait_for(writer.flush(), 5)
+            assert len(read_records(path)) == 8
+            assert writer.batches == 2
+    
+    @pytest.mark.asyncio
+    async def test_flush_by_time(self, tmp_path):
+        """Test that a partial batch is written once the interval has passed."""
+        path = tmp_path / "out.jsonl"
+        async with AsyncJsonlWriter(str(path), max_batch=1000, max_delay=0.05) as writer:
+            await writer.write({"i": 0})
+            await asyncio.sleep(0.3)
+            assert read_records(path) == [{"i": 0}]
+    
+    @pytest.mark.asyncio
+    async def test_appends_to_existing_file(self, tmp_path):
+        """Test that the writer appends rather than truncating."""
+        path = tmp_path / "out.jsonl"
+        path.write_text('{"i": -1}\n')
+        async with AsyncJsonlWriter(str(path)) as writer:
+            await writer.write({"i": 0})
+        assert read_records(path) == [{"i": -1}, {"i": 0}]
+    
+    @pytest.mark.asyncio
+    async def test_on_commit_reports_batch_tags(self, tmp_path):
+        """Test that each batch's tags are reported once, on the writer thread, after the batch is in the file."""
+        import threading
+        path = tmp_path / "out.jsonl"
+        commits = []
+        
+        def on_commit(tags):
+            commits.append((tags, len(read_records(path)), threading.current_thread() is threading.main_thread()))
+        
+        async with AsyncJsonlWriter(str(path), max_batch=3, max_delay=60, on_commit=on_commit) as writer:
+            for i in range(4):
+                await writer.write({"i": i}, tag=f"u{i}" if i != 1 else None)
+            assert commits[:1] in ([], [(["u0", "u2"], 3, False)])
+        assert commits == [(["u0", "u2"], 3, False), (["u3"], 4, False)]
+    
+    @pytest.mark.asyncio
+    async def test_partial_last_line_is_cut(self, tmp_path):
+        """Test that a line left unfinished by a crash is removed before appending."""
+        path = tmp_path / "out.jsonl"
+        path.write_text('{"i": -1}\n{"i": ')
+        async with AsyncJsonlWriter(str(path)) as writer:
+            await writer.write({"i": 0})
+        assert read_records(path) == [{"i": -1}, {"i": 0}]
+    
+    def test_truncate_partial_line(self, tmp_path):
+        """Test cutting back to the last newline, and leaving complete files alone."""
+        path = tmp_path / "out.jsonl"
+        path.write_text("no newline at all")
+        assert truncate_partial_line(str(path)) == 17
+        assert path.read_text() == ""
+        path.write_text("a\nb\n")
+        assert truncate_partial_line(str(path)) == 0
+        assert truncate_partial_line(str(tmp_path / "missing.jsonl")) == 0
+    
+    @pytest.mark.asyncio
+    async def test_fsync_per_batch(self, tmp_path):
+        """Test that fsync runs once per batch when enabled."""
+        path = tmp_path / "out.jsonl"
+        with patch("jsonl_writer.os.fsync", wraps=os.fsync) as fsync:
+            async with AsyncJsonlWriter(str(path), max_batch=5, max_delay=60, fsync=True) as writer:
+                for i in range(10):
+                    await writer.write({"i": i})
+        assert fsync.call_count == writer.batches == 2
+    
+    @pytest.mark.asyncio
+    async def test_write_error_surfaces(self, tmp_path):
+        """Test that a failed write is raised instead of silently losing later records."""
+        writer = AsyncJsonlWriter(str(tmp_path / "out.jsonl"), max_batch=1)
+        await writer.start()
+        await writer.write({"bad": object()})
+        with pytest.raises(TypeError):
+            await asyncio.wait_for(writer.flush(), 5)
+        with pytest.raises(TypeError):
+            await writer.write({"i": 1})
+        with pytest.raises(TypeError):
+            await writer.close()
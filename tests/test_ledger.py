@@ -0,0 +1,88 @@
+"""Unit tests for ledger.py module."""
+import json
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from ledger import DONE, FAILED, IN_FLIGHT, PENDING, WorkLedger, unit_key
+
+
+class TestWorkLedger:
+    """Tests for the persistent unit states."""
+    
+    def test_unit_key(self):
+        """Test that a cascade is one unit and the prompt version is part of the key."""
+        assert unit_key("7", "naive", ["cheap", "strong"], "1") == "7|naive|cheap>strong|1"
+        assert unit_key(7, "naive", ["m"], "1") != unit_key(7, "naive", ["m"], "2")
+    
+    def test_last_state_wins_across_reload(self, tmp_path):
+        """Test that states are replayed from the log and compacted to one line per unit."""
+        path = tmp_path / "run.ledger.jsonl"
+        ledger = WorkLedger(str(path))
+        ledger.mark_many(["a", "b", "c"], PENDING)
+        ledger.mark("a", IN_FLIGHT)
+        ledger.mark("a", DONE)
+        ledger.mark("b", FAILED, reason="TimeoutError")
+        ledger.close()
+        
+        reloaded = WorkLedger(str(path))
+        assert reloaded.state("a") == DONE and reloaded.is_done("a")
+        assert reloaded.units["b"]["reason"] == "TimeoutError"
+        assert reloaded.state("c") == PENDING
+        assert reloaded.state("d") is None
+        assert len(path.read_text().splitlines()) == 3
+    
+    def test_in_flight_units_are_interrupted(self, tmp_path):
+        """Test that units left in flight by a crash are counted and not done."""
+        path = tmp_path / "run.ledger.jsonl"
+        ledger = WorkLedger(str(path))
+        ledger.mark_many(["a", "b"], IN_FLIGHT)
+        ledger.mark("b", DONE)
+        ledger.close()
+        
+        reloaded = WorkLedger(str(path))
+        assert reloaded.interrupted == 1
+        assert not reloaded.is_done("a")
+        assert "1 done" in str(reloaded) and "1 in flight" in str(reloaded)
+    
+    def test_partial_last_line(self, tmp_path):
+        """Test that an entry cut short by a crash is ignored and later entries start on a new line."""
+        path = tmp_path / "run.ledger.jsonl"
+        path.write_text(json.dumps({"unit": "a", "state": IN_FLIGHT}) + "\n" + '{"unit": "a", "sta')
+        ledger = WorkLedger(str(path))
+        assert ledger.state("a") == IN_FLIGHT
+        ledger.mark("a", DONE)
+        ledger.close()
+        assert WorkLedger(str(path)).is_done("a")
+    
+    def test_marks_are_written_together(self, tmp_path):
+        """Test that marks are queued until flushed, and commit marks only known units done in one append."""
+        path = tmp_path / "run.ledger.jsonl"
+        ledger = WorkLedger(str(path), fsync=True)
+        ledger.mark_many(["a", "b"], PENDING)
+        ledger.mark("a", IN_FLIGHT)
+        assert ledger.state("a") == IN_FLIGHT
+        assert not path.exists() or path.read_text() == ""
+        ledger.commit(["a", "unknown"])
+        assert ledger.appends == 1
+        assert len(path.read_text().splitlines()) == 4
+        assert ledger.is_done("a") and ledger.state("unknown") is None
+        ledger.flush()
+        assert ledger.appends == 1
+        ledger.close()
+    
+    def test_reset(self, tmp_path):
+        """Test that a reset forgets every unit."""
+        path = tmp_path / "run.ledger.jsonl"
+        ledger = WorkLedger(str(path))
+        ledger.mark("a", DONE)
+        ledger.reset()
+        assert ledger.state("a") is None
+        assert WorkLedger(str(path)).units == {}
+    
+    def test_unknown_state(self, tmp_path):
+        """Test that only the known states can be recorded."""
+        with pytest.raises(ValueError):
+            WorkLedger(str(tmp_path / "run.ledger.jsonl")).mark("a", "finished")
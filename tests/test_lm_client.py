@@ -1,12 +1,15 @@
 """Unit tests for lm_client.py module."""
+import asyncio
+import json
 import pytest
+import pytest_asyncio
 import sys
 from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock, patch
 
 sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
 
-from lm_client import OpenRouterClient
+from lm_client import ChatCompletion, OpenRouterClient, OpenRouterError, json_schema_response_format
 
 
 class TestOpenRouterClient:
@@ -34,7 +37,7 @@ class TestOpenRouterClient:
         """Test successful async chat completion."""
         client = OpenRouterClient("test_api_key")
         
-        # Mock the aiohttp session
+        # Mock the response returned by the pooled session
         mock_response = AsyncMock()
         mock_response.status = 200
         mock_response.json = AsyncMock(return_value={
@@ -42,17 +45,82 @@ class TestOpenRouterClient:
                 {"message": {"content": "Hello, I'm an AI assistant!"}}
             ]
         })
+        mock_response.__aenter__.return_value = mock_response
+        mock_session = MagicMock()
+        mock_session.post.return_value = mock_response
         
-        with patch('aiohttp.ClientSession.post', return_value=mock_response):
-            with patch('aiohttp.ClientSession.__aenter__', return_value=AsyncMock()):
-                with patch('aiohttp.ClientSession.__aexit__', return_value=AsyncMock()):
-                    result = await client.async_chat(
-                        model="test-model",
-                        messages=[{"role": "user", "content": "Hello"}]
-                    )
+        with patch.object(client, '_get_session', return_value=mock_session):
+            result = await client.async_chat(
+                model="test-model",
+                messages=[{"role": "user", "content": "Hello"}]
+            )
         
-        # Note: This test is simplified and may not work without proper mocking
-        # In real scenarios, you'd want to use a proper async testing framework
+        assert result == "Hello, I'm an AI assistant!"
+        payload = mock_session.post.call_args.kwargs["json"]
+        assert payload["model"] == "test-model"
+    
+    @pytest.mark.asyncio
+    @pytest.mark.parametrize("base_url, kept", [("https://openrouter.ai/api/v1", True), ("http://localhost:8000/v1", False)])
+    async def test_openrouter_fields_only_sent_to_openrouter(self, base_url, kept):
+        """Test that usage accounting and provider routing fields are dropped for other servers."""
+        client = OpenRouterClient("test_api_key", base_url=base_url)
+        mock_response = AsyncMock()
+        mock_response.status = 200
+        mock_response.json = AsyncMock(return_value={"choices": [{"message": {"content": "ok"}}]})
+        mock_response.__aenter__.return_value = mock_response
+        mock_session = MagicMock()
+        mock_session.post.return_value = mock_response
+        
+        with patch.object(client, '_get_session', return_value=mock_session):
+            await client.async_complete(
+                "test-model", [{"role": "user", "content": "Hello"}], usage={"include": True},
+                response_format=json_schema_response_format("answer", {"type": "object"})
+            )
+        
+        payload = mock_session.post.call_args.kwargs["json"]
+        assert "response_format" in payload
+        assert ("usage" in payload) == kept
+        assert ("provider" in payload) == kept
+    
+    @pytest.mark.asyncio
+    async def test_session_is_reused_across_calls(self):
+        """Test that the client keeps one pooled session until closed."""
+        client = OpenRouterClient("test_api_key", max_connections_per_host=4)
+        async with client:
+            first = client._get_session()
+            second = client._get_session()
+            assert first is second
+            assert first.connector.limit_per_host == 4
+        
+        assert first.closed
+        assert client._session is None
+    
+    @pytest.mark.asyncio
+    async def test_request_timeout(self):
+        """Test that a request exceeding its deadline raises TimeoutError once retries are spent."""
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+        from retry import RetryPolicy
+        
+        async def handler(request):
+            await asyncio.sleep(5)
+            return web.json_response({"choices": [{"message": {"content": "late"}}]})
+        
+        app = web.Application()
+        app.router.add_post("/chat/completions", handler)
+        server = TestServer(app)
+        await server.start_server()
+        client = OpenRouterClient(
+            "test_api_key", base_url=str(server.make_url("")).rstrip("/"),
+            request_timeout=0.2, retry_policy=RetryPolicy(max_attempts=1)
+        )
+        try:
+            async with client:
+                with pytest.raises(asyncio.TimeoutError):
+                    await client.async_chat("m", [{"role": "user", "content": "hi"}])
+        finally:
+            await server.close()
+        assert client.retry_stats.gave_up == 1
     
     def test_headers_format(self):
         """Test that headers are correctly formatted."""
@@ -63,3 +131,255 @@ class TestOpenRouterClient:
         assert client.headers["Content-Type"] == "application/json"
 
 
+class TestSyncApi:
+    """Tests for the synchronous facade on the background event loop."""
+
+    def test_chat_reuses_background_loop(self):
+        """Test that repeated sync calls share one loop and shutdown stops it."""
+        client = OpenRouterClient("test_api_key")
+        post = AsyncMock(return_value={"choices": [{"message": {"content": "hi"}}]})
+        with patch.object(client, '_post_chat', post):
+            assert client.chat("m", [{"role": "user", "content": "a"}]) == "hi"
+            loop, thread = client._loop, client._loop_thread
+            assert client.chat("m", [{"role": "user", "content": "b"}]) == "hi"
+            assert client._loop is loop
+        client.shutdown()
+        assert not thread.is_alive()
+        assert loop.is_closed()
+        assert client._loop is None
+
+    @pytest.mark.asyncio
+    async def test_chat_inside_running_loop(self):
+        """Test that chat() works when the calling thread already runs an event loop."""
+        with OpenRouterClient("test_api_key") as client:
+            post = AsyncMock(return_value={"choices": [{"message": {"content": "ok"}}]})
+            with patch.object(client, '_post_chat', post):
+                assert client.chat("m", [{"role": "user", "content": "hi"}]) == "ok"
+
+    def test_chat_many_runs_concurrently_in_order(self):
+        """Test that chat_many fans out concurrently and keeps request order."""
+        in_flight = peak = 0
+
+        async def post(payload, tried=None):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            await asyncio.sleep(0.05)
+            in_flight -= 1
+            if payload["messages"][0]["content"] == "bad":
+                raise OpenRouterError(400, "bad request")
+            return {"choices": [{"message": {"content": payload["messages"][0]["content"].upper()}}]}
+
+        requests = [{"model": "m", "messages": [{"role": "user", "content": c}]} for c in ("a", "b", "bad", "c")]
+        with OpenRouterClient("test_api_key") as client:
+            with patch.object(client, '_post_chat', side_effect=post):
+                results = client.chat_many(requests, return_exceptions=True)
+        assert results[:2] == ["A", "B"] and results[3] == "C"
+        assert isinstance(results[2], OpenRouterError)
+        assert peak == 4
+
+
+
+class TestChatStream:
+    """Tests for streaming completions against a local SSE server."""
+    
+    @pytest_asyncio.fixture
+    async def sse_server(self):
+        """Local /chat/completions endpoint that streams three content deltas."""
+        from aiohttp import web
+        from aiohttp.test_utils import TestServer
+        
+        async def handler(request):
+            body = await request.json()
+            assert body["stream"] is True
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            await response.write(b": OPENROUTER PROCESSING\n\n")
+            for piece in ["Hel", "lo", "!"]:
+                chunk = {"choices": [{"delta": {"content": piece}, "finish_reason": None}]}
+                await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            final = {"choices": [{"delta": {}, "finish_reason": "stop"}],
+                     "usage": {"prompt_tokens": 5, "completion_tokens": 3, "total_tokens": 8}}
+            await response.write(f"data: {json.dumps(final)}\n\n".encode())
+            await response.write(b"data: [DONE]\n\n")
+            return response
+        
+        app = web.Application()
+        app.router.add_post("/chat/completions", handler)
+        server = TestServer(app)
+        await server.start_server()
+        yield str(server.make_url("")).rstrip("/")
+        await server.close()
+    
+    @pytest.mark.asyncio
+    async def test_stream_yields_deltas_and_metrics(self, sse_server):
+        """Test that deltas arrive in order and timing metrics are recorded."""
+        async with OpenRouterClient("test_api_key", base_url=sse_server) as client:
+            stream = client.async_chat_stream("test-model", [{"role": "user", "content": "Hi"}])
+            deltas = [delta async for delta in stream]
+        
+        assert deltas == ["Hel", "lo", "!"]
+        assert stream.content == "Hello!"
+        assert stream.finish_reason == "stop"
+        assert stream.completion_tokens == 3
+        metrics = stream.metrics()
+        assert metrics["time_to_first_token"] is not None
+        assert metrics["duration"] >= metrics["time_to_first_token"]
+    
+    @pytest.mark.asyncio
+    async def test_stop_when_closes_stream_early(self, sse_server):
+        """Test that the stop hook ends the stream and usage is estimated."""
+        async with OpenRouterClient("test_api_key", base_url=sse_server) as client:
+            stream = client.async_chat_stream("test-model", [{"role": "user", "content": "Hi"}],
+                                              stop_when=lambda text: text.endswith("lo"))
+            deltas = [delta async for delta in stream]
+        
+        assert deltas == ["Hel", "lo"]
+        assert stream.stopped_early
+        assert stream.finish_reason == "early_stop"
+        assert stream.usage["completion_tokens"] == len("Hello") // 4
+        assert stream.metrics()["stopped_early"] is True
+    
+    @pytest.mark.asyncio
+    async def test_async_chat_with_stream_flag(self, sse_server):
+        """Test that async_chat(stream=True) returns the accumulated content."""
+        async with OpenRouterClient("test_api_key", base_url=sse_server) as client:
+            result = await client.async_chat("test-model", [{"role": "user", "content": "Hi"}], stream=True)
+        assert result == "Hello!"
+
+class TestRequestCoalescing:
+    """Tests for single-flight coalescing of identical concurrent requests."""
+    
+    @pytest.mark.asyncio
+    async def test_identical_requests_share_one_call(self):
+        """Test that concurrent identical calls make one upstream request."""
+        client = OpenRouterClient("test_api_key")
+        calls = []
+        
+        async def slow_post(payload, tried=None):
+            calls.append(payload)
+            await asyncio.sleep(0.05)
+            return {"choices": [{"message": {"content": "shared"}}]}
+        
+        messages = [{"role": "user", "content": "Hello"}]
+        with patch.object(client, '_post_chat', side_effect=slow_post):
+            results = await asyncio.gather(*(client.async_chat("m", messages) for _ in range(5)))
+        
+        assert results == ["shared"] * 5
+        assert len(calls) == 1
+        assert client.coalesced_requests == 4
+        assert client._inflight == {}
+    
+    @pytest.mark.asyncio
+    async def test_different_requests_are_not_coalesced(self):
+        """Test that requests with different fingerprints run independently."""
+        client = OpenRouterClient("test_api_key")
+        post = AsyncMock(return_value={"choices": [{"message": {"content": "x"}}]})
+        with patch.object(client, '_post_chat', post):
+            await asyncio.gather(
+                client.async_chat("m", [{"role": "user", "content": "a"}]),
+                client.async_chat("m", [{"role": "user", "content": "b"}])
+            )
+        assert post.await_count == 2
+        assert client.coalesced_requests == 0
+    
+    @pytest.mark.asyncio
+    async def test_errors_reach_every_waiter(self):
+        """Test that a failed shared request raises in all coalesced callers."""
+        client = OpenRouterClient("test_api_key")
+        
+        async def failing_post(payload, tried=None):
+            await asyncio.sleep(0.01)
+            raise OpenRouterError(400, "bad request")
+        
+        messages = [{"role": "user", "content": "Hello"}]
+        with patch.object(client, '_post_chat', side_effect=failing_post):
+            results = await asyncio.gather(
+                *(client.async_chat("m", messages) for _ in range(3)), return_exceptions=True
+            )
+        assert all(isinstance(r, OpenRouterError) for r in results)
+    
+    @pytest.mark.asyncio
+    async def test_cancelling_every_waiter_cancels_request(self):
+        """Test that the shared request stops once all coalesced callers are cancelled."""
+        client = OpenRouterClient("test_api_key")
+        started, cancelled = asyncio.Event(), asyncio.Event()
+        
+        async def hanging_post(payload, tried=None):
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+        
+        messages = [{"role": "user", "content": "Hello"}]
+        with patch.object(client, '_post_chat', side_effect=hanging_post):
+            callers = [asyncio.ensure_future(client.async_chat("m", messages)) for _ in range(2)]
+            await started.wait()
+            callers[0].cancel()
+            await asyncio.sleep(0.01)
+            assert not cancelled.is_set()
+            callers[1].cancel()
+            await asyncio.wait_for(cancelled.wait(), 1)
+            await asyncio.sleep(0)
+        assert client._inflight == {}
+        assert client._waiters == {}
+
+
+class TestStructuredOutput:
+    """Tests for response_format requests and their fallback."""
+    
+    def test_response_format_helper(self):
+        """Test the json_schema response_format shape."""
+        fmt = json_schema_response_format("answer", {"type": "object"})
+        assert fmt["type"] == "json_schema"
+        assert fmt["json_schema"]["name"] == "answer"
+        assert fmt["json_schema"]["strict"] is True
+    
+    def test_parse_json(self):
+        """Test ChatCompletion.parse_json on JSON and free-form content."""
+        assert ChatCompletion('{"outputs": ["1"]}').parse_json() == {"outputs": ["1"]}
+        assert ChatCompletion('reasoning... {"outputs": []}').parse_json() is None
+        assert ChatCompletion('["not", "an", "object"]').parse_json() is None
+    
+    @pytest.mark.asyncio
+    async def test_unsupported_model_falls_back(self):
+        """Test that a rejected response_format is retried without it and remembered per model."""
+        client = OpenRouterClient("test_api_key")
+        payloads = []
+        
+        async def post(payload, tried=None):
+            payloads.append(payload)
+            if "response_format" in payload:
+                raise OpenRouterError(400, "response_format is not supported")
+            return {"choices": [{"message": {"content": "free form"}}]}
+        
+        fmt = json_schema_response_format("answer", {"type": "object"})
+        messages = [{"role": "user", "content": "Hi"}]
+        with patch.object(client, '_post_chat', side_effect=post):
+            first = await client.async_complete("m", messages, response_format=fmt)
+            second = await client.async_complete("m", [{"role": "user", "content": "Again"}], response_format=fmt)
+        
+        assert first.content == second.content == "free form"
+        assert payloads[0]["provider"] == {"require_parameters": True}
+        assert [("response_format" in p) for p in payloads] == [True, False, False]
+        assert client.structured_output_unsupported == {"m"}
+    
+    @pytest.mark.asyncio
+    async def test_unrelated_bad_request_does_not_fall_back(self):
+        """Test that a 400 that does not name response_format is raised and the model is not remembered."""
+        client = OpenRouterClient("test_api_key")
+        payloads = []
+        
+        async def post(payload, tried=None):
+            payloads.append(payload)
+            raise OpenRouterError(400, "This model's maximum context length is 8192 tokens")
+        
+        fmt = json_schema_response_format("answer", {"type": "object"})
+        with patch.object(client, '_post_chat', side_effect=post):
+            with pytest.raises(OpenRouterError):
+                await client.async_complete("m", [{"role": "user", "content": "Hi"}], response_format=fmt)
+        
+        assert len(payloads) == 1
+        assert client.structured_output_unsupported == set()
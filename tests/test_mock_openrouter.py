@@ -0,0 +1,137 @@
+"""Unit tests for tools/mock_openrouter.py."""
+import json
+import pytest
+import pytest_asyncio
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+sys.path.insert(0, str(Path(__file__).parent.parent / "tools"))
+
+from mock_openrouter import (
+    MockConfig,
+    answer_block,
+    cache_prefix,
+    drop_answer_block,
+    is_repair_request,
+    message_text,
+    start_mock_server,
+    templated_reply
+)
+from lm_client import OpenRouterClient, OpenRouterError
+from prompts import get_naive_coder_prompt, get_reasoner_prompt, get_reasoner_repair_prompt
+from retry import RetryPolicy
+from utils import extract_code
+
+
+class TestTemplatedReply:
+    """Tests for persona-aware canned replies."""
+    
+    def test_naive_reply_has_code_fence(self):
+        """Test that naive prompts get a python code block."""
+        prompt = get_naive_coder_prompt("Sum two numbers.", "Two integers")
+        reply = templated_reply([{"role": "user", "content": prompt}])
+        assert extract_code(reply, language="python") is not None
+    
+    def test_reasoning_reply_has_outputs_json(self):
+        """Test that reasoner prompts get one output per input in a JSON block."""
+        prompt = get_reasoner_prompt("Sum two numbers.", ["1 2", "3 4"], ["3", "7"], disable_filtering=True)
+        reply = templated_reply([{"role": "user", "content": prompt}])
+        block = reply.split("```json")[1].split("```")[0]
+        assert json.loads(block) == {"outputs": ["3", "7"]}
+    
+    def test_repair_request_gets_only_the_block(self):
+        """Test that a follow-up asking for only the answer gets just the answer block."""
+        prompt = get_reasoner_prompt("Sum two numbers.", ["1 2", "3 4"], ["3", "7"], disable_filtering=True)
+        messages = [
+            {"role": "user", "content": prompt},
+            {"role": "assistant", "content": "Input 1: the values sum to 3."},
+            {"role": "user", "content": get_reasoner_repair_prompt(2)}
+        ]
+        assert is_repair_request(messages)
+        reply = answer_block(templated_reply(messages))
+        assert reply.startswith("```json") and reply.endswith("```")
+        assert json.loads(reply[len("```json"):-3]) == {"outputs": ["3", "7"]}
+    
+    def test_malformed_reply_has_no_block(self):
+        """Test that dropping the answer block leaves nothing to parse."""
+        prompt = get_naive_coder_prompt("Sum two numbers.", "Two integers")
+        reply = drop_answer_block(templated_reply([{"role": "user", "content": prompt}]))
+        assert extract_code(reply, language="python") is None
+        assert "simplest approach" in reply
+    
+    def test_content_parts(self):
+        """Test that list content is read as its text parts and cache breakpoints end the cached prefix."""
+        messages = [
+            {"role": "system", "content": "sys "},
+            {"role": "user", "content": [
+                {"type": "text", "text": "problem ", "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": "instructions"}
+            ]}
+        ]
+        assert message_text(messages[1]) == "problem instructions"
+        assert cache_prefix(messages) == "sys problem "
+        assert cache_prefix([{"role": "user", "content": "plain"}]) is None
+
+
+class TestMockServer:
+    """Tests for the running mock server."""
+    
+    @pytest_asyncio.fixture
+    async def mock_server(self):
+        servers = []
+        
+        async def start(config):
+            runner, base_url, mock = await start_mock_server(config)
+            servers.append(runner)
+            return base_url, mock
+        
+        yield start
+        for runner in servers:
+            await runner.cleanup()
+    
+    @pytest.mark.asyncio
+    async def test_json_completion(self, mock_server):
+        """Test a plain completion with a fixed reply."""
+        base_url, mock = await mock_server(MockConfig(reply="pong", latency_mean=0))
+        async with OpenRouterClient("key", base_url=base_url) as client:
+            assert await client.async_chat("m", [{"role": "user", "content": "ping"}]) == "pong"
+        assert mock.requests == 1
+    
+    @pytest.mark.asyncio
+    async def test_repeated_prefix_reports_cached_tokens(self, mock_server):
+        """Test that a cache_control prefix sent twice is reported as cached the second time."""
+        base_url, mock = await mock_server(MockConfig(reply="ok", latency_mean=0))
+        prefix = {"type": "text", "text": "shared problem statement " * 20, "cache_control": {"type": "ephemeral"}}
+        async with OpenRouterClient("key", base_url=base_url, cache=None) as client:
+            cached = []
+            for question in ("first", "second"):
+                completion = await client.async_complete(
+                    "m", [{"role": "user", "content": [prefix, {"type": "text", "text": question}]}]
+                )
+                cached.append(completion.usage["prompt_tokens_details"]["cached_tokens"])
+        assert cached[0] == 0 and cached[1] > 0
+        assert mock.cached_tokens == cached[1]
+    
+    @pytest.mark.asyncio
+    async def test_streaming_completion(self, mock_server):
+        """Test that streaming replies reassemble to the full text."""
+        base_url, _ = await mock_server(MockConfig(reply="a longer streamed reply", latency_mean=0, tokens_per_second=500))
+        async with OpenRouterClient("key", base_url=base_url) as client:
+            stream = client.async_chat_stream("m", [{"role": "user", "content": "ping"}])
+            deltas = [delta async for delta in stream]
+        assert "".join(deltas) == "a longer streamed reply"
+        assert len(deltas) > 1
+        assert stream.usage["completion_tokens"] > 0
+    
+    @pytest.mark.asyncio
+    async def test_injected_429_is_retried(self, mock_server):
+        """Test that injected 429s carry Retry-After and surface as OpenRouterError."""
+        base_url, mock = await mock_server(MockConfig(rate_429=1.0, retry_after=0.01, latency_mean=0))
+        policy = RetryPolicy(max_attempts=2, base_delay=0.001)
+        async with OpenRouterClient("key", base_url=base_url, retry_policy=policy) as client:
+            with pytest.raises(OpenRouterError) as exc_info:
+                await client.async_chat("m", [{"role": "user", "content": "ping"}])
+        assert exc_info.value.status == 429
+        assert exc_info.value.retry_after == 0.01
+        assert mock.injected_429 == 2
@@ -0,0 +1,141 @@
+"""Unit tests for pipeline.py module."""
+import asyncio
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from pipeline import Pipeline, Stage, parse_stage_workers
+
+
+class TestPipeline:
+    """Tests for the staged producer/consumer pipeline."""
+    
+    @pytest.mark.asyncio
+    async def test_items_pass_through_stages_in_order(self):
+        """Test that every item goes through each stage and the last stage's outputs are returned."""
+        async def double(x):
+            return x * 2
+        
+        async def label(x):
+            return f"item {x}"
+        
+        pipeline = Pipeline([Stage("double", double, 2), Stage("label", label, 1)])
+        outputs = await pipeline.run(range(5))
+        
+        assert sorted(outputs) == [f"item {x}" for x in (0, 2, 4, 6, 8)]
+        assert pipeline.stats["double"].processed == 5
+        assert pipeline.stats["label"].processed == 5
+    
+    @pytest.mark.asyncio
+    async def test_workers_bound_concurrency_per_stage(self):
+        """Test that each stage runs at most its worker count at once and queues stay bounded."""
+        running = {"slow": 0, "fast": 0}
+        peak = {"slow": 0, "fast": 0}
+        
+        def stage(name, delay):
+            async def func(x):
+                running[name] += 1
+                peak[name] = max(peak[name], running[name])
+                await asyncio.sleep(delay)
+                running[name] -= 1
+                return x
+            return func
+        
+        pipeline = Pipeline([
+            Stage("fast", stage("fast", 0.001), 8),
+            Stage("slow", stage("slow", 0.01), 2, queue_size=3)
+        ])
+        await pipeline.run(range(20))
+        
+        assert peak["fast"] <= 8 and peak["slow"] == 2
+        assert pipeline.stats["slow"].peak_depth <= 3
+        assert pipeline.bottleneck() == "slow"
+    
+    @pytest.mark.asyncio
+    async def test_dropped_and_failed_items_finish(self):
+        """Test that None results and exceptions end an item without stalling the run."""
+        finished = []
+        
+        async def check(x):
+            if x == 1:
+                return None
+            if x == 2:
+                raise ValueError("bad item")
+            return x
+        
+        pipeline = Pipeline([Stage("check", check, 2), Stage("keep", lambda x: asyncio.sleep(0, x))],
+                            on_done=lambda item, output: finished.append((item, output)))
+        outputs = await pipeline.run([0, 1, 2, 3])
+        
+        assert sorted(outputs) == [0, 3]
+        assert sorted(finished) == [(0, 0), (1, None), (2, None), (3, 3)]
+        assert pipeline.stats["check"].dropped == 2
+    
+    @pytest.mark.asyncio
+    async def test_resubmit_goes_back_to_first_stage(self):
+        """Test that a resubmitted item runs through the stages again before finishing."""
+        visits = []
+        
+        class Job:
+            def __init__(self, name):
+                self.name = name
+                self.rounds = 0
+        
+        async def work(job):
+            visits.append(job.name)
+            return job
+        
+        async def decide(job):
+            job.rounds += 1
+            if job.rounds < 3:
+                pipeline.resubmit(job)
+                return None
+            return job.name
+        
+        pipeline = Pipeline([Stage("work", work, 1, queue_size=1), Stage("decide", decide, 1, queue_size=1)])
+        outputs = await pipeline.run([Job("a"), Job("b")])
+        
+        assert sorted(outputs) == ["a", "b"]
+        assert sorted(visits) == ["a"] * 3 + ["b"] * 3
+        assert pipeline.stats["decide"].dropped == 0
+    
+    @pytest.mark.asyncio
+    async def test_timeout_reports_unfinished_items(self):
+        """Test that a run timeout cancels the workers and lists the items that did not finish."""
+        async def slow(x):
+            if x:
+                await asyncio.sleep(10)
+            return x
+        
+        pipeline = Pipeline([Stage("slow", slow, 1, queue_size=1)])
+        with pytest.raises(asyncio.TimeoutError):
+            await pipeline.run([0, 1, 2, 3], timeout=0.1)
+        
+        assert sorted(pipeline.unfinished) == [1, 2, 3]
+    
+    @pytest.mark.asyncio
+    async def test_report(self):
+        """Test that the report lists every stage and the bottleneck."""
+        pipeline = Pipeline([Stage("a", lambda x: asyncio.sleep(0, x)), Stage("b", lambda x: asyncio.sleep(0.01, x))])
+        await pipeline.run(range(3))
+        report = pipeline.format_report()
+        
+        assert "a " in report and "b " in report
+        assert "bottleneck: b" in report
+
+
+class TestParseStageWorkers:
+    """Tests for the --stage-workers option."""
+    
+    def test_parse(self):
+        """Test parsing STAGE=N pairs."""
+        assert parse_stage_workers(["llm=64", "sandbox=4"]) == {"llm": 64, "sandbox": 4}
+        assert parse_stage_workers(None) == {}
+    
+    @pytest.mark.parametrize("value", ["llm", "llm=", "llm=0", "llm=x"])
+    def test_invalid(self, value):
+        """Test that malformed values are rejected."""
+        with pytest.raises(ValueError):
+            parse_stage_workers([value])
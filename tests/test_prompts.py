@@ -6,7 +6,10 @@ from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
 
 from prompts import (
+    get_naive_coder_instructions,
     get_naive_coder_prompt,
+    get_problem_context,
+    get_reasoner_instructions,
     get_reasoner_prompt,
     get_reasoner_schema,
     normalize_text,
@@ -87,6 +90,44 @@ Sample Output:
         assert "properties" in schema
         assert "outputs" in schema["properties"]
         assert "required" in schema
+    
+    def test_reasoner_schema_is_strict_valid(self):
+        """Test the schema against strict json_schema rules: every property required, no extra properties."""
+        def check(node):
+            if node.get("type") == "object":
+                assert node["additionalProperties"] is False
+                assert sorted(node["required"]) == sorted(node["properties"])
+                for child in node["properties"].values():
+                    check(child)
+            elif node.get("type") == "array":
+                check(node["items"])
+            else:
+                assert node["type"] in ("string", "number", "integer", "boolean", "null")
+        
+        check(get_reasoner_schema())
+    
+    def test_reasoner_prompt_structured(self):
+        """Test that structured mode asks for the schema's JSON object instead of a trailing block."""
+        plain = get_reasoner_prompt("Sum two numbers.", ["1 2"], ["3"], disable_filtering=True)
+        structured = get_reasoner_prompt("Sum two numbers.", ["1 2"], ["3"], disable_filtering=True, structured=True)
+        
+        assert "```json" in plain
+        assert "```json" not in structured
+        assert '"reasoning"' in structured and '"outputs"' in structured
+        assert list(get_reasoner_schema()["properties"])[0] == "reasoning"
+    
+    def test_prompt_cache_layout_has_same_parts(self):
+        """Test that the shared problem context plus persona instructions hold the same text as the classic prompts."""
+        problem = "Sum two numbers."
+        context = get_problem_context(problem)
+        naive = get_naive_coder_instructions("Two integers")
+        reasoner = get_reasoner_instructions(problem, ["1 2"], ["3"], disable_filtering=True)
+        
+        assert problem in context
+        assert problem not in naive and problem not in reasoner
+        assert context in get_naive_coder_prompt(problem, "Two integers")
+        assert context in get_reasoner_prompt(problem, ["1 2"], ["3"], disable_filtering=True)
+        assert "Input 1: 1 2" in reasoner
 
 
 class TestTextNormalization:
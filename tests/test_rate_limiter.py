@@ -0,0 +1,106 @@
+"""Unit tests for rate_limiter.py module."""
+import time
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from rate_limiter import (
+    RateLimiter,
+    TokenBucket,
+    estimate_prompt_tokens,
+    estimate_request_tokens
+)
+
+
+class TestTokenEstimation:
+    """Tests for token estimation helpers."""
+    
+    def test_prompt_estimate_grows_with_length(self):
+        """Test that longer prompts produce larger estimates."""
+        short = estimate_prompt_tokens([{"role": "user", "content": "hi"}])
+        long = estimate_prompt_tokens([{"role": "user", "content": "hi " * 400}])
+        assert long > short > 0
+    
+    def test_request_estimate_reserves_completion(self):
+        """Test that max_tokens is added to the estimate."""
+        messages = [{"role": "user", "content": "x" * 400}]
+        assert estimate_request_tokens(messages, 1000) == estimate_prompt_tokens(messages) + 1000
+    
+    def test_content_parts_are_counted(self):
+        """Test multi-part message content is handled."""
+        messages = [{"role": "user", "content": [{"type": "text", "text": "x" * 400}]}]
+        assert estimate_prompt_tokens(messages) >= 100
+
+
+class TestTokenBucket:
+    """Tests for the TokenBucket primitive."""
+    
+    def test_starts_full(self):
+        """Test a new bucket allows immediate consumption."""
+        bucket = TokenBucket(10, 1)
+        assert bucket.time_until(10) == 0.0
+    
+    def test_wait_after_consumption(self):
+        """Test that draining the bucket produces a wait proportional to refill rate."""
+        bucket = TokenBucket(10, 10)
+        bucket.consume(10)
+        assert 0.4 < bucket.time_until(5) <= 0.5
+    
+    def test_refund_is_capped(self):
+        """Test refunds never exceed capacity."""
+        bucket = TokenBucket(10, 1)
+        bucket.refund(100)
+        assert bucket.tokens == 10
+
+
+class TestRateLimiter:
+    """Tests for the per-model RateLimiter."""
+    
+    @pytest.mark.asyncio
+    async def test_disabled_limiter_never_waits(self):
+        """Test that a limiter without limits is a no-op."""
+        limiter = RateLimiter()
+        start = time.monotonic()
+        for _ in range(100):
+            await limiter.acquire("m", 10_000)
+        assert time.monotonic() - start < 0.1
+        assert limiter.waits == 0
+    
+    @pytest.mark.asyncio
+    async def test_requests_per_minute_enforced(self):
+        """Test that exceeding the request bucket causes a wait."""
+        limiter = RateLimiter(requests_per_minute=600)  # 10 requests/sec, burst of 600
+        limiter._get_buckets("m")[0].tokens = 1
+        start = time.monotonic()
+        await limiter.acquire("m")
+        await limiter.acquire("m")
+        assert time.monotonic() - start >= 0.08
+        assert limiter.waits == 1
+    
+    @pytest.mark.asyncio
+    async def test_models_are_tracked_separately(self):
+        """Test that each model has its own buckets."""
+        limiter = RateLimiter(requests_per_minute=60)
+        limiter._get_buckets("a")[0].tokens = 0
+        start = time.monotonic()
+        await limiter.acquire("b")
+        assert time.monotonic() - start < 0.05
+    
+    @pytest.mark.asyncio
+    async def test_reconcile_returns_unused_tokens(self):
+        """Test that overestimates are refunded from actual usage."""
+        limiter = RateLimiter(tokens_per_minute=1000)
+        await limiter.acquire("m", 800)
+        token_bucket = limiter._get_buckets("m")[1]
+        assert token_bucket.tokens == pytest.approx(200, abs=1)
+        limiter.reconcile("m", 800, 300)
+        assert token_bucket.tokens == pytest.approx(700, abs=1)
+    
+    def test_model_overrides(self):
+        """Test per-model limit overrides."""
+        limiter = RateLimiter(requests_per_minute=60, model_limits={"slow": (6, None)})
+        request_bucket, token_bucket = limiter._get_buckets("slow")
+        assert request_bucket.capacity == 6
+        assert token_bucket is None
@@ -0,0 +1,53 @@
+"""Unit tests for repair.py module."""
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from repair import RepairStats, repair_messages
+from prompts import get_naive_repair_prompt, get_reasoner_repair_prompt
+
+
+class TestRepairMessages:
+    """Tests for the follow-up conversation."""
+    
+    def test_appends_reply_and_instruction(self):
+        """Test that the failed reply and the follow-up are appended without touching the original."""
+        messages = [{"role": "user", "content": "Solve it."}]
+        followup = repair_messages(messages, "Here is my thinking", get_naive_repair_prompt())
+        assert messages == [{"role": "user", "content": "Solve it."}]
+        assert followup[1] == {"role": "assistant", "content": "Here is my thinking"}
+        assert followup[2]["role"] == "user"
+        assert "```python" in followup[2]["content"]
+    
+    def test_reasoner_prompt_names_output_count(self):
+        """Test that the reasoner follow-up asks for one output per input."""
+        assert "3 test inputs" in get_reasoner_repair_prompt(3)
+
+
+class TestRepairStats:
+    """Tests for repair accounting."""
+    
+    def test_rates_and_tokens(self):
+        """Test per-persona failures, repair rate and follow-up tokens."""
+        stats = RepairStats()
+        for _ in range(4):
+            stats.record_response("reasoning")
+        stats.record_repair("reasoning", 1, True, {"total_tokens": 120})
+        stats.record_repair("reasoning", 2, False, {"total_tokens": 200})
+        values = stats.to_dict()["reasoning"]
+        assert values["responses"] == 4
+        assert values["parse_failures"] == 2
+        assert values["repaired"] == 1
+        assert values["attempts"] == 3
+        assert values["tokens"] == 320
+        assert stats.repair_rate("reasoning") == 0.5
+    
+    def test_disabled_repair_counts_failure(self):
+        """Test that a failure with no follow-up (max_repairs=0) is still counted."""
+        stats = RepairStats()
+        stats.record_repair("naive", 0, False, None)
+        assert stats.to_dict()["naive"]["parse_failures"] == 1
+        assert stats.repair_rate("naive") == 0.0
+        assert "naive: 1/0 unparsable" in str(stats)
@@ -0,0 +1,122 @@
+"""Unit tests for retry.py module."""
+import asyncio
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from retry import RetryPolicy, RetryStats, parse_retry_after
+from lm_client import OpenRouterError
+
+
+async def no_sleep(delay):
+    """Sleep replacement that records nothing and returns immediately."""
+    return None
+
+
+class TestParseRetryAfter:
+    """Tests for Retry-After header parsing."""
+    
+    def test_seconds(self):
+        """Test delta-seconds form."""
+        assert parse_retry_after("7") == 7.0
+    
+    def test_missing(self):
+        """Test missing or empty header."""
+        assert parse_retry_after(None) is None
+        assert parse_retry_after("") is None
+    
+    def test_http_date_in_past(self):
+        """Test HTTP-date form in the past clamps to zero."""
+        assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    
+    def test_garbage(self):
+        """Test unparsable values are ignored."""
+        assert parse_retry_after("soon") is None
+
+
+class TestRetryPolicy:
+    """Tests for RetryPolicy classification, backoff and the retry loop."""
+    
+    def test_classification(self):
+        """Test retryable vs fatal classification."""
+        policy = RetryPolicy()
+        assert policy.is_retryable(OpenRouterError(429, "rate limited"))
+        assert policy.is_retryable(OpenRouterError(502, "bad gateway"))
+        assert policy.is_retryable(asyncio.TimeoutError())
+        assert not policy.is_retryable(OpenRouterError(400, "bad request"))
+        assert not policy.is_retryable(OpenRouterError(401, "unauthorized"))
+        assert not policy.is_retryable(KeyError("choices"))
+    
+    def test_backoff_is_capped(self):
+        """Test full-jitter backoff stays within [0, max_delay]."""
+        policy = RetryPolicy(base_delay=1.0, max_delay=5.0)
+        for retry in range(10):
+            assert 0.0 <= policy.backoff_delay(retry) <= 5.0
+    
+    def test_retry_after_is_honored(self):
+        """Test Retry-After sets a lower bound on the delay."""
+        policy = RetryPolicy(base_delay=0.01, max_delay=0.01)
+        assert policy.next_delay(0, OpenRouterError(429, "slow down", retry_after=3.0)) >= 3.0
+    
+    @pytest.mark.asyncio
+    async def test_recovers_after_transient_errors(self):
+        """Test that transient errors are retried and counted."""
+        policy = RetryPolicy(max_attempts=5)
+        stats = RetryStats()
+        calls = []
+        
+        async def flaky():
+            calls.append(1)
+            if len(calls) < 3:
+                raise OpenRouterError(429 if len(calls) == 1 else 503, "transient")
+            return "ok"
+        
+        assert await policy.call(flaky, stats, sleep=no_sleep) == "ok"
+        assert stats.attempts == 3
+        assert stats.retries == 2
+        assert stats.recovered == 1
+        assert stats.retries_by_reason == {"429": 1, "503": 1}
+    
+    @pytest.mark.asyncio
+    async def test_fatal_error_is_not_retried(self):
+        """Test that fatal errors are raised immediately."""
+        policy = RetryPolicy(max_attempts=5)
+        stats = RetryStats()
+        
+        async def bad_request():
+            raise OpenRouterError(400, "invalid model")
+        
+        with pytest.raises(OpenRouterError):
+            await policy.call(bad_request, stats, sleep=no_sleep)
+        assert stats.attempts == 1
+        assert stats.fatal == 1
+    
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_attempts(self):
+        """Test that the attempt cap is enforced."""
+        policy = RetryPolicy(max_attempts=3)
+        stats = RetryStats()
+        
+        async def always_busy():
+            raise OpenRouterError(429, "busy")
+        
+        with pytest.raises(OpenRouterError):
+            await policy.call(always_busy, stats, sleep=no_sleep)
+        assert stats.attempts == 3
+        assert stats.gave_up == 1
+    
+    @pytest.mark.asyncio
+    async def test_gives_up_when_total_time_exceeded(self):
+        """Test that a Retry-After beyond the total time cap stops retrying."""
+        policy = RetryPolicy(max_attempts=10, max_total_time=5.0)
+        stats = RetryStats()
+        
+        async def long_wait():
+            raise OpenRouterError(429, "busy", retry_after=60)
+        
+        with pytest.raises(OpenRouterError):
+            await policy.call(long_wait, stats, sleep=no_sleep)
+        assert stats.attempts == 1
+        assert stats.gave_up == 1
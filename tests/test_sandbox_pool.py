@@ -0,0 +1,89 @@
+"""Unit tests for sandbox_pool.py module."""
+import asyncio
+import threading
+import time
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from sandbox_pool import SandboxPool
+from prompts import SandboxExecutor
+
+
+class TestSandboxPool:
+    """Tests for running blocking sandbox calls off the event loop."""
+    
+    @pytest.mark.asyncio
+    async def test_returns_result_from_worker_thread(self):
+        """Test that the call runs on a pool thread and its result is returned."""
+        pool = SandboxPool(max_concurrent=2)
+        try:
+            name = await pool.run(lambda: threading.current_thread().name)
+        finally:
+            pool.close()
+        assert name.startswith("sandbox")
+        assert pool.runs == 1
+    
+    @pytest.mark.asyncio
+    async def test_event_loop_keeps_running(self):
+        """Test that other coroutines progress while a blocking call is running."""
+        pool = SandboxPool(max_concurrent=1)
+        ticks = 0
+        
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+        
+        task = asyncio.ensure_future(ticker())
+        try:
+            await pool.run(time.sleep, 0.3)
+        finally:
+            task.cancel()
+            pool.close()
+        assert ticks >= 10
+    
+    @pytest.mark.asyncio
+    async def test_concurrency_limit(self):
+        """Test that no more than max_concurrent calls run at once and the rest queue."""
+        pool = SandboxPool(max_concurrent=2)
+        try:
+            await asyncio.gather(*(pool.run(time.sleep, 0.05) for _ in range(6)))
+        finally:
+            pool.close()
+        assert pool.peak_in_flight == 2
+        assert pool.runs == 6
+        assert pool.wait_seconds > 0
+    
+    @pytest.mark.asyncio
+    async def test_exceptions_propagate(self):
+        """Test that an exception raised by the call reaches the awaiting coroutine."""
+        def fail():
+            raise ValueError("boom")
+        
+        pool = SandboxPool(max_concurrent=1)
+        try:
+            with pytest.raises(ValueError):
+                await pool.run(fail)
+        finally:
+            pool.close()
+        assert pool.in_flight == 0
+    
+    @pytest.mark.asyncio
+    async def test_runs_generated_code(self):
+        """Test executing code through the pool with the local sandbox, and reuse after close."""
+        pool = SandboxPool(max_concurrent=1)
+        sandbox = SandboxExecutor()
+        code = "a, b = map(int, input().split())\nprint(a + b)"
+        try:
+            first = await pool.run(sandbox.execute_code_multiple_inputs, code, ["1 2"])
+            pool.close()
+            second = await pool.run(sandbox.execute_code_multiple_inputs, code, ["3 4"])
+        finally:
+            pool.close()
+        assert first[0]["output"] == "3"
+        assert second[0]["output"] == "7"
+        assert "runs=2" in str(pool)
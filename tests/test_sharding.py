@@ -0,0 +1,72 @@
+"""Unit tests for sharding.py module."""
+import json
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from sharding import merge_segments, parse_shard, shard_of, shard_output_file
+
+
+class TestShards:
+    """Tests for assigning units to shards."""
+    
+    def test_parse_shard(self):
+        """Test INDEX/COUNT parsing and validation."""
+        assert parse_shard("0/4") == (0, 4)
+        assert parse_shard(" 3 / 4 ") == (3, 4)
+        assert parse_shard(None) is None
+        for value in ("4/4", "1/0", "-1/4", "2", "a/b"):
+            with pytest.raises(ValueError):
+                parse_shard(value)
+    
+    def test_every_unit_in_exactly_one_shard(self):
+        """Test that shards partition the units, stably and roughly evenly."""
+        units = [(str(i), persona) for i in range(400) for persona in ("naive", "reasoning")]
+        shards = [shard_of(problem_id, persona, 4) for problem_id, persona in units]
+        assert shards == [shard_of(problem_id, persona, 4) for problem_id, persona in units]
+        assert all(0 <= shard < 4 for shard in shards)
+        assert min(shards.count(shard) for shard in range(4)) > len(units) / 4 * 0.8
+        # Personas of one problem are independent units
+        assert len({shard_of(str(i), "naive", 4) == shard_of(str(i), "reasoning", 4) for i in range(50)}) == 2
+        # Integer and string ids of the same problem land together
+        assert shard_of(17, "naive", 8) == shard_of("17", "naive", 8)
+    
+    def test_shard_output_file(self):
+        assert shard_output_file("data/responses.jsonl", 1, 4) == "data/responses.shard-1-of-4.jsonl"
+
+
+class TestMergeSegments:
+    """Tests for merging shard segments."""
+    
+    def write(self, path, records, tail=""):
+        path.write_text("".join(json.dumps(record) + "\n" for record in records) + tail)
+        return str(path)
+    
+    def test_merge_orders_and_dedups(self, tmp_path):
+        """Test ordering by problem id and persona, and that a later duplicate wins."""
+        first = self.write(tmp_path / "a.jsonl", [
+            {"problem_id": 10, "type": "naive", "model": "m", "v": 1},
+            {"problem_id": 2, "type": "reasoning", "model": "m"}
+        ], tail='{"problem_id": 3, "ty')
+        second = self.write(tmp_path / "b.jsonl", [
+            {"problem_id": 2, "type": "naive", "model": "m"},
+            {"problem_id": 10, "type": "naive", "model": "m", "v": 2}
+        ])
+        output = tmp_path / "merged.jsonl"
+        stats = merge_segments([first, second], str(output))
+        
+        records = [json.loads(line) for line in output.read_text().splitlines()]
+        assert [(r["problem_id"], r["type"]) for r in records] == [(2, "naive"), (2, "reasoning"), (10, "naive")]
+        assert records[-1]["v"] == 2
+        assert stats == {"segments": 2, "read": 4, "duplicates": 1, "unreadable": 1, "written": 3}
+    
+    def test_models_are_kept_apart(self, tmp_path):
+        """Test that responses of different models for the same unit are not duplicates."""
+        segment = self.write(tmp_path / "a.jsonl", [
+            {"problem_id": 1, "type": "naive", "model": "a"},
+            {"problem_id": 1, "type": "naive", "model": "b"}
+        ])
+        stats = merge_segments([segment], str(tmp_path / "merged.jsonl"))
+        assert stats["written"] == 2 and stats["duplicates"] == 0
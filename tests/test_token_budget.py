@@ -0,0 +1,60 @@
+"""Unit tests for token_budget.py module."""
+import json
+import pytest
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from token_budget import CompletionLengthStats, DEFAULT_MAX_TOKENS
+
+
+class TestCompletionLengthStats:
+    """Tests for adaptive max_tokens."""
+    
+    def test_ceiling_until_enough_samples(self, tmp_path):
+        """Test that the default budget is used before min_samples lengths were seen."""
+        stats = CompletionLengthStats(str(tmp_path / "lengths.json"), min_samples=3)
+        stats.record("m", "naive", "EASY", 800)
+        assert stats.max_tokens("m", "naive", "EASY") == DEFAULT_MAX_TOKENS
+        assert stats.sized == 0
+    
+    def test_quantile_plus_margin(self, tmp_path):
+        """Test that the budget is the quantile of past lengths plus margin, clamped to floor/ceiling."""
+        stats = CompletionLengthStats(str(tmp_path / "lengths.json"), min_samples=10, quantile=0.5, margin=0.5)
+        for length in range(1000, 11000, 1000):
+            stats.record("m", "naive", "EASY", length)
+        assert stats.max_tokens("m", "naive", "EASY") == 9000
+        stats.quantile, stats.margin = 1.0, 1.0
+        assert stats.max_tokens("m", "naive", "EASY") == DEFAULT_MAX_TOKENS  # 10000 * 2 is over the ceiling
+        for _ in range(10):
+            stats.record("m", "naive", "HARD", 100)
+        assert stats.max_tokens("m", "naive", "HARD") == stats.floor
+        assert stats.max_tokens("m", "reasoning", "HARD") == DEFAULT_MAX_TOKENS
+    
+    def test_next_budget_doubles_up_to_ceiling(self, tmp_path):
+        """Test truncation retries grow the budget and stop at the ceiling."""
+        stats = CompletionLengthStats(str(tmp_path / "lengths.json"), ceiling=3000)
+        assert stats.next_budget(1000) == 2000
+        assert stats.next_budget(2000) == 3000
+        assert stats.next_budget(3000) is None
+        assert stats.truncation_retries == 2
+    
+    def test_persists_across_runs(self, tmp_path):
+        """Test that lengths are saved and loaded, keeping only the last `window`."""
+        path = tmp_path / "lengths.json"
+        stats = CompletionLengthStats(str(path), window=3)
+        for length in (1, 2, 3, 4):
+            stats.record("m", "naive", "EASY", length)
+        stats.save()
+        assert json.loads(path.read_text()) == {"m|naive|EASY": [2, 3, 4]}
+        assert CompletionLengthStats(str(path)).lengths["m|naive|EASY"] == [2, 3, 4]
+    
+    def test_disabled(self, tmp_path):
+        """Test that a disabled store always uses the ceiling and writes nothing."""
+        path = tmp_path / "lengths.json"
+        stats = CompletionLengthStats(str(path), enabled=False, min_samples=1)
+        stats.record("m", "naive", "EASY", 10)
+        stats.save()
+        assert stats.max_tokens("m", "naive", "EASY") == DEFAULT_MAX_TOKENS
+        assert not path.exists()
@@ -0,0 +1,168 @@
+"""Unit tests for usage.py module."""
+import pytest
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, patch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "generation"))
+
+from usage import (
+    BudgetExhaustedError,
+    UsageBudget,
+    UsageTracker,
+    add_usage,
+    billed_usage,
+    normalize_usage
+)
+from lm_client import OpenRouterClient
+
+OPENROUTER_USAGE = {
+    "prompt_tokens": 100,
+    "completion_tokens": 400,
+    "total_tokens": 500,
+    "cost": 0.002,
+    "prompt_tokens_details": {"cached_tokens": 60},
+    "completion_tokens_details": {"reasoning_tokens": 300}
+}
+
+
+class TestNormalizeUsage:
+    """Tests for usage normalization."""
+    
+    def test_full_usage_block(self):
+        """Test that all fields are extracted."""
+        usage = normalize_usage(OPENROUTER_USAGE, latency=2.0)
+        assert usage["prompt_tokens"] == 100
+        assert usage["cached_tokens"] == 60
+        assert usage["completion_tokens"] == 400
+        assert usage["reasoning_tokens"] == 300
+        assert usage["total_tokens"] == 500
+        assert usage["cost"] == 0.002
+        assert usage["latency"] == 2.0
+        assert usage["billed"] is True
+    
+    def test_missing_usage(self):
+        """Test that a missing usage block yields zeros."""
+        usage = normalize_usage(None)
+        assert usage["total_tokens"] == 0
+        assert usage["cached_tokens"] == 0
+        assert usage["cost"] == 0.0
+    
+    def test_add_usage(self):
+        """Test summing usage records."""
+        total = add_usage(normalize_usage(OPENROUTER_USAGE, 1.0), normalize_usage(OPENROUTER_USAGE, 2.0))
+        assert total["total_tokens"] == 1000
+        assert total["latency"] == 3.0
+        assert total["calls"] == 2
+        assert total["cached_tokens"] == 120
+
+
+    def test_add_cached_and_billed_usage(self):
+        """Test that a cached call summed with a billed one keeps its tokens out of the billed part."""
+        cached = normalize_usage(OPENROUTER_USAGE, 0.01, billed=False)
+        repair = normalize_usage({"prompt_tokens": 50, "completion_tokens": 10, "cost": 0.0005}, 1.0)
+        total = add_usage(cached, repair)
+        assert total["billed"] is True
+        assert total["total_tokens"] == 560
+        assert billed_usage(total)["total_tokens"] == 60
+        assert billed_usage(total)["cost"] == pytest.approx(0.0005)
+        assert billed_usage(add_usage(total, repair))["total_tokens"] == 120
+        assert billed_usage(cached)["total_tokens"] == 0
+
+
+class TestUsageBudget:
+    """Tests for the hard run budget."""
+    
+    def test_token_budget(self):
+        """Test that the token cap trips once reached."""
+        budget = UsageBudget(max_tokens=900)
+        budget.add(normalize_usage(OPENROUTER_USAGE))
+        budget.check()
+        budget.add(normalize_usage(OPENROUTER_USAGE))
+        with pytest.raises(BudgetExhaustedError):
+            budget.check()
+        assert budget.rejected == 1
+    
+    def test_cost_budget(self):
+        """Test that the dollar cap trips once reached."""
+        budget = UsageBudget(max_cost=0.001)
+        budget.add(normalize_usage(OPENROUTER_USAGE))
+        assert budget.exhausted
+    
+    def test_unlimited_budget(self):
+        """Test that no caps means never exhausted."""
+        budget = UsageBudget()
+        for _ in range(10):
+            budget.add(normalize_usage(OPENROUTER_USAGE))
+        assert not budget.exhausted
+    
+    @pytest.mark.asyncio
+    async def test_client_refuses_requests_after_budget(self):
+        """Test that the client stops sending once the budget is spent."""
+        client = OpenRouterClient("key", budget=UsageBudget(max_tokens=500))
+        response = {"choices": [{"message": {"content": "x"}}], "usage": OPENROUTER_USAGE}
+        with patch.object(client, '_post_chat', AsyncMock(return_value=response)) as post:
+            completion = await client.async_complete("m", [{"role": "user", "content": "a"}])
+            with pytest.raises(BudgetExhaustedError):
+                await client.async_complete("m", [{"role": "user", "content": "b"}])
+        assert post.await_count == 1
+        assert completion.usage == OPENROUTER_USAGE
+
+
+class TestUsageTracker:
+    """Tests for per-group usage roll-ups."""
+    
+    def test_rollup_and_report(self):
+        """Test grouping by model/persona/difficulty and the text report."""
+        tracker = UsageTracker()
+        tracker.record("m1", "naive", "EASY", normalize_usage(OPENROUTER_USAGE, 4.0))
+        tracker.record("m1", "naive", "EASY", normalize_usage(OPENROUTER_USAGE, 4.0))
+        tracker.record("m1", "reasoning", "HARD", normalize_usage(OPENROUTER_USAGE, 2.0))
+        
+        groups = tracker.rollup()
+        assert groups[("m1", "naive", "EASY")]["responses"] == 2
+        assert groups[("m1", "naive", "EASY")]["completion_tokens"] == 800
+        assert groups[("m1", "naive", "EASY")]["tokens_per_second"] == 100.0
+        assert groups[("m1", "naive", "EASY")]["cache_hit_rate"] == 0.6
+        
+        by_persona = tracker.rollup(by=("persona",))
+        assert by_persona[("reasoning",)]["cost"] == pytest.approx(0.002)
+        
+        report = tracker.format_report()
+        assert "TOTAL" in report
+        assert "reasoning" in report
+        assert "cached" in report
+    
+    def test_unbilled_responses_do_not_inflate_cost_or_throughput(self):
+        """Test that cache hits and coalesced duplicates count as responses but not as tokens, cost or latency."""
+        tracker = UsageTracker()
+        tracker.record("m1", "naive", "EASY", normalize_usage(OPENROUTER_USAGE, 4.0))
+        tracker.record("m1", "naive", "EASY", normalize_usage(OPENROUTER_USAGE, 0.01, billed=False))
+        tracker.record("m1", "naive", "EASY", normalize_usage(OPENROUTER_USAGE, 0.01, billed=False))
+        
+        group = tracker.rollup()[("m1", "naive", "EASY")]
+        billed = tracker.rollup(by=())[()]
+        assert group["responses"] == 3
+        assert group["unbilled_responses"] == 2
+        assert group["unbilled_share"] == pytest.approx(2 / 3)
+        assert group["completion_tokens"] == 400
+        assert group["cost"] == pytest.approx(0.002)
+        assert group["cost_per_response"] == pytest.approx(0.002)
+        assert group["tokens_per_second"] == 100.0
+        assert billed["latency"] == 4.0
+        assert "67%" in tracker.format_report()
+    
+    def test_cached_response_with_billed_repair(self):
+        """Test that only the billed repair of a cached response counts toward cost and budget."""
+        usage = add_usage(normalize_usage(OPENROUTER_USAGE, 0.01, billed=False),
+                          normalize_usage({"prompt_tokens": 50, "completion_tokens": 10, "cost": 0.0005}, 1.0))
+        tracker = UsageTracker()
+        tracker.record("m1", "reasoning", "EASY", usage)
+        group = tracker.rollup(by=())[()]
+        assert group["unbilled_responses"] == 0
+        assert group["completion_tokens"] == 10
+        assert group["cost"] == pytest.approx(0.0005)
+        assert group["tokens_per_second"] == 10.0
+        budget = UsageBudget()
+        budget.add(usage)
+        assert budget.tokens == 60
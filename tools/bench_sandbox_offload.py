@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark LLM request throughput while generated code is running.
+
+Starts the local mock server (tools/mock_openrouter.py) and keeps a fixed number of
+chat requests in flight for a few seconds, in three modes: (a) no code running,
+(b) programs executed by calling the sandbox directly from a coroutine, which is how
+generate_response used to run them, and (c) programs executed through SandboxPool.
+Reports requests/sec and p50/p99 latency of the LLM requests in each mode.
+
+Usage:
+    python tools/bench_sandbox_offload.py --duration 5 --concurrency 32 --program-seconds 0.5
+"""
+
+import argparse
+import asyncio
+import itertools
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "generation"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from lm_client import OpenRouterClient
+from mock_openrouter import MockConfig, start_mock_server
+from prompts import SandboxExecutor
+from sandbox_pool import SandboxPool
+
+
+def messages(index: int) -> list:
+    """A distinct prompt per request, so single-flight coalescing does not merge them"""
+    return [{"role": "user", "content": f"Hello {index}"}]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_mode(name: str, client: OpenRouterClient, run_program, duration: float, concurrency: int,
+                   code_workers: int) -> dict:
+    """Keep `concurrency` requests in flight for `duration` seconds while `code_workers` loops run programs"""
+    deadline = time.perf_counter() + duration
+    latencies = []
+    programs = 0
+    request_ids = itertools.count()
+
+    async def request_loop():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await client.async_chat("bench", messages(next(request_ids)))
+            latencies.append(time.perf_counter() - start)
+
+    async def code_loop():
+        nonlocal programs
+        while time.perf_counter() < deadline:
+            await run_program()
+            programs += 1
+
+    start = time.perf_counter()
+    code_tasks = [code_loop() for _ in range(code_workers)] if run_program else []
+    await asyncio.gather(*(request_loop() for _ in range(concurrency)), *code_tasks)
+    elapsed = time.perf_counter() - start
+    return {
+        "mode": name,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "programs": programs
+    }
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark LLM throughput while generated code runs")
+    parser.add_argument("--duration", type=float, default=5.0, help="Seconds per mode (default: 5)")
+    parser.add_argument("--concurrency", type=int, default=32, help="LLM requests in flight (default: 32)")
+    parser.add_argument("--latency", type=float, default=0.02,
+                        help="Simulated server service time in seconds (default: 0.02)")
+    parser.add_argument("--program-seconds", type=float, default=0.5,
+                        help="How long each generated program runs (default: 0.5)")
+    parser.add_argument("--code-workers", type=int, default=4,
+                        help="Responses executing code at the same time (default: 4)")
+    args = parser.parse_args()
+
+    sandbox = SandboxExecutor(time_limit=args.program_seconds + 2)
+    code = f"import time\ntime.sleep({args.program_seconds})\nprint(input())"
+    pool = SandboxPool(args.code_workers)
+
+    async def inline_program():
+        # Old behaviour: the blocking call runs on the event loop thread
+        sandbox.execute_code_multiple_inputs(code, ["1"])
+
+    async def pooled_program():
+        await pool.run(sandbox.execute_code_multiple_inputs, code, ["1"])
+
+    runner, base_url, _ = await start_mock_server(MockConfig(latency_mean=args.latency, reply="ok"))
+    try:
+        client = OpenRouterClient("bench-key", base_url=base_url, max_connections_per_host=args.concurrency)
+        async with client:
+            rows = [
+                await run_mode(name, client, program, args.duration, args.concurrency, args.code_workers)
+                for name, program in (("no code", None), ("inline", inline_program), ("pool", pooled_program))
+            ]
+    finally:
+        pool.close()
+        await runner.cleanup()
+
+    print(f"{'mode':<10} {'req/s':>10} {'p50 (ms)':>10} {'p99 (ms)':>10} {'programs':>9}")
+    for row in rows:
+        print(f"{row['mode']:<10} {row['rps']:>10.1f} {row['p50_ms']:>10.2f} {row['p99_ms']:>10.2f} {row['programs']:>9}")
+    baseline = rows[0]["rps"]
+    print(f"throughput vs no code: inline {rows[1]['rps'] / baseline:.0%}, pool {rows[2]['rps'] / baseline:.0%}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Offline load test for the generation pipeline.
+
+Starts tools/mock_openrouter.py in-process (or targets --base-url), runs
+ReasoningTraceGenerator's staged pipeline over synthetic problems for both personas,
+and reports end-to-end throughput, LLM latency, client-side retry/concurrency
+statistics and the per-stage pipeline report.
+
+Usage:
+    python tools/load_test.py --problems 200 --latency lognormal --latency-mean 0.5 \
+        --tokens-per-second 200 --rate-429 0.05 --stream
+"""
+
+import argparse
+import asyncio
+import logging
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "generation"))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from data_structures import Problem
+from get_reasoning_traces import ReasoningTraceGenerator, summarize_stream_metrics
+from mock_openrouter import add_config_arguments, config_from_args, start_mock_server
+
+
+def synthetic_problems(count: int) -> list:
+    """Small sum-of-integers problems so the naive persona's code runs in the sandbox"""
+    problems = []
+    for i in range(count):
+        inputs = [f"{i} {j}" for j in range(1, 4)]
+        problems.append(Problem(
+            id=str(i + 1),
+            name=f"Synthetic {i + 1}",
+            statement=f"Problem {i + 1}: read integers from standard input and print their sum.",
+            sample_inputs=inputs,
+            sample_outputs=[str(i + j) for j in range(1, 4)],
+            difficulty="EASY",
+            solutions=[]
+        ))
+    return problems
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def run_load_test(args) -> dict:
+    runner = mock = None
+    base_url = args.base_url
+    if base_url is None:
+        runner, base_url, mock = await start_mock_server(config_from_args(args))
+
+    output_file = args.output or str(Path(tempfile.mkdtemp()) / "load_test_responses.jsonl")
+    generator = ReasoningTraceGenerator(
+        "load-test-key",
+        model=args.model,
+        output_file=output_file,
+        requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute,
+        max_concurrent=args.max_concurrent,
+        use_cache=False,
+        base_url=base_url,
+        hedge=args.hedge
+    )
+    generator.stream = args.stream
+    generator.early_stop = args.early_stop
+    generator.cascade_models = args.cascade or []
+
+    generator.resume = False
+
+    problems = synthetic_problems(args.problems)
+    jobs = generator.create_jobs(problems)
+    start = time.perf_counter()
+    try:
+        # The same staged pipeline, buffered writer and work ledger as a real run
+        generator.open_ledger()
+        async with generator.client:
+            results = await generator._process_jobs(jobs)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+    elapsed = time.perf_counter() - start
+    latencies = [result['usage'].get('latency', 0.0) for result in results]
+
+    completed = len(results)
+    report = {
+        'responses': len(jobs),
+        'completed': completed,
+        'failed': len(jobs) - completed,
+        'elapsed': elapsed,
+        'responses_per_second': completed / elapsed if elapsed else 0.0,
+        'p50_latency': percentile(latencies, 50),
+        'p99_latency': percentile(latencies, 99),
+        'retries': generator.client.retry_stats,
+        'concurrency': generator.client.concurrency_limiter,
+        'hedging': generator.client.hedge_stats if args.hedge else None,
+        'early_stop': generator.early_stop_stats if args.early_stop else None,
+        'repairs': generator.repair_stats,
+        'cascade': generator.cascade_stats if args.cascade else None,
+        'streaming': summarize_stream_metrics(generator.stream_metrics) if generator.stream_metrics else None,
+        'pipeline': generator.pipeline.format_report(),
+        'server': mock.stats() if mock else None,
+        'output_file': output_file
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline load test against a mock OpenRouter server')
+    parser.add_argument('--problems', type=int, default=100, help='Number of synthetic problems (default: 100)')
+    parser.add_argument('--model', default='mock/model', help='Model name sent to the server')
+    parser.add_argument('--base-url', default=None, help='Use an already running server instead of the in-process mock')
+    parser.add_argument('--output', default=None, help='Where to write responses (default: temp file)')
+    parser.add_argument('--max-concurrent', type=int, default=64, help='Adaptive concurrency ceiling (default: 64)')
+    parser.add_argument('--requests-per-minute', type=float, default=None)
+    parser.add_argument('--tokens-per-minute', type=float, default=None)
+    parser.add_argument('--stream', action='store_true', help='Use streaming completions')
+    parser.add_argument('--hedge', action='store_true', help='Hedge requests slower than the observed p95 latency')
+    parser.add_argument('--cascade', nargs='+', default=None, metavar='MODEL',
+                        help='Models to try in order (pair with --malformed-models to make the cheap ones fail)')
+    parser.add_argument('--early-stop', action='store_true', help='Stop generation once the answer is complete')
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    report = asyncio.run(run_load_test(args))
+
+    print(f"Responses:   {report['completed']}/{report['responses']} completed ({report['failed']} failed)")
+    print(f"Wall time:   {report['elapsed']:.2f}s")
+    print(f"Throughput:  {report['responses_per_second']:.2f} responses/s "
+          f"({report['responses_per_second'] * 3600:.0f}/hour)")
+    print(f"LLM latency: p50={report['p50_latency']:.3f}s p99={report['p99_latency']:.3f}s (per response)")
+    print(f"Retries:     {report['retries']}")
+    print(f"Concurrency: {report['concurrency']}")
+    if report['hedging']:
+        print(f"Hedging:     {report['hedging']}")
+    if report['early_stop']:
+        print(f"Early stop:  {report['early_stop']}")
+    print(f"Repairs:     {report['repairs']}")
+    if report['cascade']:
+        print(f"Cascade:     {report['cascade']}")
+    if report['streaming']:
+        print(f"Streaming:   {report['streaming']}")
+    if report['server']:
+        print(f"Server:      {report['server']}")
+    print(f"Pipeline stages:\n{report['pipeline']}")
+    print(f"Output:      {report['output_file']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+Merge the output segments of a sharded generation run into one JSONL file.
+
+Each `--shard i/N` run writes `<output>.shard-i-of-N.jsonl`. This reads all N segments,
+drops duplicate responses, orders the records by problem id and persona and writes
+`<output>` atomically; convert it for the web app with generation/convert_to_json.py.
+
+Usage:
+    python tools/merge_shards.py data/responses_taco.jsonl --shards 4
+    python tools/merge_shards.py data/merged.jsonl --segments a.jsonl b.jsonl
+"""
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "generation"))
+
+from sharding import merge_segments, shard_output_file
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge sharded generation output into one JSONL file")
+    parser.add_argument("output", help="Merged JSONL file; also names the segments with --shards")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--shards", type=int, help="Number of shards N the run was split into")
+    source.add_argument("--segments", nargs="+", help="Segment files to merge, in order")
+    parser.add_argument("--allow-missing", action="store_true",
+                        help="Merge the segments that exist instead of failing when a shard has not written one")
+    args = parser.parse_args()
+
+    segments = args.segments or [shard_output_file(args.output, index, args.shards) for index in range(args.shards)]
+    missing = [segment for segment in segments if not os.path.exists(segment)]
+    if missing:
+        print(f"Missing segments: {', '.join(missing)}")
+        if not args.allow_missing:
+            sys.exit(1)
+        segments = [segment for segment in segments if segment not in missing]
+
+    stats = merge_segments(segments, args.output)
+    print(f"Merged {stats['read']} responses from {stats['segments']} segments into {args.output}: "
+          f"{stats['written']} written, {stats['duplicates']} duplicates dropped, {stats['unreadable']} unreadable lines")
+
+
+if __name__ == "__main__":
+    main()
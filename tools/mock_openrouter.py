@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Local OpenRouter-compatible mock server for offline load testing.
+
+Serves POST /chat/completions (JSON and SSE streaming) and the OpenAI-style /files and
+/batches endpoints, with configurable latency distributions, token throughput, 429/5xx
+injection and canned or templated replies:
+prompts from the naive coder persona get a ```python fence, prompts from the reasoner
+persona get reasoning text followed by a ```json outputs block with one output per
+"Input N:" line (or just the JSON object when a json_schema response_format is sent).
+Like real models, both keep talking after the answer; `stop` sequences cut the reply,
+and replies longer than `max_tokens` are cut off with finish_reason "length".
+A fraction of replies can leave out the answer block (--rate-malformed); follow-ups
+asking for "only" the answer are answered with just the block. Prompt caching is
+simulated for content parts marked with cache_control: a prefix up to such a breakpoint
+that was sent before is reported as prompt_tokens_details.cached_tokens.
+
+Usage:
+    python tools/mock_openrouter.py --port 8089 --latency lognormal --latency-mean 1.0 \
+        --tokens-per-second 150 --rate-429 0.05 --rate-5xx 0.02
+    export OPENROUTER_BASE_URL=http://127.0.0.1:8089
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from aiohttp import web
+
+NAIVE_REPLY = """The simplest approach is to read the input and print the answer directly.
+
+```python
+import sys
+data = sys.stdin.read().split()
+print(sum(int(x) for x in data if x.lstrip('-').isdigit()))
+```
+
+This reads every integer from standard input and prints their sum. It runs in linear
+time in the size of the input, which is more than fast enough for these constraints."""
+
+REASONING_TEMPLATE = """Let me work through each input step by step.
+
+{steps}
+
+```json
+{outputs}
+```
+
+Each output above is the sum of the integers on the corresponding input line."""
+
+
+@dataclass
+class MockConfig:
+    """Behaviour of the mock server"""
+    latency: str = "constant"  # constant | uniform | lognormal: delay before the first token
+    latency_mean: float = 0.05  # seconds
+    latency_sigma: float = 0.5  # spread for uniform (+/- fraction) and lognormal (sigma)
+    tokens_per_second: float = 0.0  # completion throughput; 0 sends the whole reply at once
+    rate_429: float = 0.0  # probability of answering 429 with Retry-After
+    rate_5xx: float = 0.0  # probability of answering 500/502/503
+    retry_after: float = 1.0  # Retry-After seconds sent with 429s
+    rate_malformed: float = 0.0  # probability a templated reply leaves out its answer block
+    malformed_models: Tuple[str, ...] = ()  # models whose replies always leave it out (e.g. to exercise a cascade)
+    reply: Optional[str] = None  # fixed reply; None uses persona templates
+    seed: Optional[int] = None
+
+
+def count_tokens(text: str) -> int:
+    """Same rough 4-characters-per-token rule the client uses for estimates"""
+    return max(1, len(text) // 4)
+
+
+def message_text(message: dict) -> str:
+    """Text of a message whose content is a string or a list of content parts"""
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return str(content)
+
+
+def cache_prefix(messages: list) -> Optional[str]:
+    """Prompt text up to the last content part marked with cache_control, if any"""
+    text = ""
+    prefix = None
+    for message in messages:
+        content = message.get("content", "")
+        if not isinstance(content, list):
+            text += str(content)
+            continue
+        for part in content:
+            if isinstance(part, dict):
+                text += part.get("text", "")
+                if part.get("cache_control"):
+                    prefix = text
+    return prefix
+
+
+_ANSWER_BLOCK = re.compile(r"```(?:python|json)\n.*?```\n*", re.DOTALL)
+
+
+def is_repair_request(messages: list) -> bool:
+    """A follow-up asking for only the answer block of the previous reply"""
+    return len(messages) > 2 and messages[-1].get("role") == "user" and "Reply with only" in message_text(messages[-1])
+
+
+def drop_answer_block(reply: str) -> str:
+    return _ANSWER_BLOCK.sub("", reply)
+
+
+def answer_block(reply: str) -> str:
+    match = _ANSWER_BLOCK.search(reply)
+    return match.group(0).strip() if match else reply
+
+
+def templated_reply(messages: list, structured: bool = False) -> str:
+    """Reply in the format the persona prompt asks for (structured: the reasoner schema's JSON object)"""
+    # Earlier assistant turns are not part of the prompt (their "Input N:" lines would count as inputs)
+    prompt = "\n".join(message_text(m) for m in messages if m.get("role") != "assistant")
+    inputs = re.findall(r"^Input \d+: (.*)$", prompt, re.MULTILINE)
+    if "reasons through test case inputs" not in prompt:
+        return NAIVE_REPLY
+    outputs = []
+    steps = []
+    for i, inp in enumerate(inputs):
+        numbers = [int(x) for x in re.findall(r"-?\d+", inp)]
+        outputs.append(str(sum(numbers)))
+        steps.append(f"Input {i + 1}: the values sum to {outputs[-1]}.")
+    if structured:
+        return json.dumps({"reasoning": "\n".join(steps), "outputs": outputs})
+    return REASONING_TEMPLATE.format(
+        steps="\n".join(steps) or "No additional inputs.",
+        outputs=json.dumps({"outputs": outputs}, indent=2)
+    )
+
+
+def apply_stop_sequences(reply: str, stop) -> str:
+    """Cut the reply before the earliest stop sequence, which (as with real providers) is not included"""
+    if not stop:
+        return reply
+    positions = [reply.find(s) for s in ([stop] if isinstance(stop, str) else stop)]
+    positions = [p for p in positions if p != -1]
+    return reply[:min(positions)] if positions else reply
+
+
+class MockOpenRouter:
+    """Request handler plus counters for a running mock server"""
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.random = random.Random(config.seed)
+        self.requests = 0
+        self.injected_429 = 0
+        self.injected_5xx = 0
+        self.malformed = 0
+        self.batched_requests = 0
+        self.cached_tokens = 0
+        self.cached_prefixes = set()
+        self.files = {}
+        self.batches = {}
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def sample_latency(self) -> float:
+        config = self.config
+        if config.latency == "uniform":
+            spread = config.latency_mean * config.latency_sigma
+            return max(0.0, self.random.uniform(config.latency_mean - spread, config.latency_mean + spread))
+        if config.latency == "lognormal":
+            # Parameterized so the distribution's median is latency_mean
+            return self.random.lognormvariate(0, config.latency_sigma) * config.latency_mean
+        return config.latency_mean
+
+    async def handle_chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            roll = self.random.random()
+            if roll < self.config.rate_429:
+                self.injected_429 += 1
+                return web.json_response(
+                    {"error": {"code": 429, "message": "Rate limit exceeded (mock)"}},
+                    status=429, headers={"Retry-After": str(self.config.retry_after)}
+                )
+            if roll < self.config.rate_429 + self.config.rate_5xx:
+                self.injected_5xx += 1
+                status = self.random.choice([500, 502, 503])
+                return web.json_response({"error": {"code": status, "message": "Upstream error (mock)"}}, status=status)
+
+            await asyncio.sleep(self.sample_latency())
+            reply, finish_reason = self.reply_for(body)
+            usage = self.usage(body, reply)
+            if body.get("stream"):
+                return await self.stream_reply(request, body, reply, usage, finish_reason)
+            if self.config.tokens_per_second > 0:
+                await asyncio.sleep(usage["completion_tokens"] / self.config.tokens_per_second)
+            return web.json_response(self.completion(body, reply, finish_reason, usage))
+        finally:
+            self.in_flight -= 1
+
+    def reply_for(self, body: dict) -> tuple:
+        """(reply text, finish_reason) for a chat completion request body"""
+        structured = (body.get("response_format") or {}).get("type") == "json_schema"
+        messages = body.get("messages", [])
+        if self.config.reply is not None:
+            reply = self.config.reply
+        elif is_repair_request(messages):
+            reply = answer_block(templated_reply(messages))
+        else:
+            reply = templated_reply(messages, structured)
+            if body.get("model") in self.config.malformed_models or (
+                    self.config.rate_malformed and self.random.random() < self.config.rate_malformed):
+                self.malformed += 1
+                reply = drop_answer_block(reply)
+        reply = apply_stop_sequences(reply, body.get("stop"))
+        if body.get("max_tokens") and count_tokens(reply) > body["max_tokens"]:
+            return reply[:body["max_tokens"] * 4], "length"
+        return reply, "stop"
+
+    def completion(self, body: dict, reply: str, finish_reason: str, usage: dict) -> dict:
+        return {
+            "id": f"mock-{self.requests}",
+            "model": body.get("model"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": finish_reason}],
+            "usage": usage
+        }
+
+    async def handle_upload(self, request: web.Request) -> web.Response:
+        """POST /files (multipart, purpose=batch)"""
+        form = await request.post()
+        upload = form["file"]
+        file_id = f"file-{len(self.files) + 1}"
+        self.files[file_id] = upload.file.read().decode("utf-8")
+        return web.json_response({"id": file_id, "object": "file", "purpose": form.get("purpose")})
+
+    async def handle_file_content(self, request: web.Request) -> web.Response:
+        content = self.files.get(request.match_info["file_id"])
+        if content is None:
+            return web.json_response({"error": {"code": 404, "message": "No such file"}}, status=404)
+        return web.Response(text=content)
+
+    async def handle_create_batch(self, request: web.Request) -> web.Response:
+        """POST /batches: answers every line of the input file in the background"""
+        body = await request.json()
+        batch_id = f"batch-{len(self.batches) + 1}"
+        self.batches[batch_id] = {"id": batch_id, "object": "batch", "status": "in_progress",
+                                  "input_file_id": body["input_file_id"], "output_file_id": None}
+        asyncio.ensure_future(self.run_batch(batch_id))
+        return web.json_response(self.batches[batch_id])
+
+    async def run_batch(self, batch_id: str):
+        batch = self.batches[batch_id]
+        await asyncio.sleep(self.sample_latency())
+        lines = []
+        for line in self.files[batch["input_file_id"]].splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            self.requests += 1
+            self.batched_requests += 1
+            reply, finish_reason = self.reply_for(request["body"])
+            completion = self.completion(request["body"], reply, finish_reason, self.usage(request["body"], reply))
+            lines.append(json.dumps({"id": f"batch_req_{self.requests}", "custom_id": request["custom_id"],
+                                     "response": {"status_code": 200, "body": completion}, "error": None}))
+        output_id = f"file-{len(self.files) + 1}"
+        self.files[output_id] = "\n".join(lines) + "\n"
+        batch.update(status="completed", output_file_id=output_id)
+
+    async def handle_get_batch(self, request: web.Request) -> web.Response:
+        batch = self.batches.get(request.match_info["batch_id"])
+        if batch is None:
+            return web.json_response({"error": {"code": 404, "message": "No such batch"}}, status=404)
+        return web.json_response(batch)
+
+    def usage(self, body: dict, reply: str) -> dict:
+        messages = body.get("messages", [])
+        prompt_tokens = sum(count_tokens(message_text(m)) for m in messages)
+        completion_tokens = count_tokens(reply)
+        prefix = cache_prefix(messages)
+        cached_tokens = 0
+        if prefix is not None:
+            if prefix in self.cached_prefixes:
+                cached_tokens = min(prompt_tokens, count_tokens(prefix))
+                self.cached_tokens += cached_tokens
+            self.cached_prefixes.add(prefix)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens
+        }
+
+    async def stream_reply(self, request: web.Request, body: dict, reply: str, usage: dict,
+                           finish_reason: str = "stop") -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await response.write(b": OPENROUTER PROCESSING\n\n")
+        # Send ~4-character tokens, batching whatever is due every 20ms to pace at tokens_per_second
+        pieces = [reply[i:i + 4] for i in range(0, len(reply), 4)]
+        start = time.monotonic()
+        sent = 0
+        while sent < len(pieces):
+            if self.config.tokens_per_second > 0:
+                due = min(len(pieces), max(sent + 1, int((time.monotonic() - start) * self.config.tokens_per_second)))
+            else:
+                due = len(pieces)
+            chunk = {"choices": [{"index": 0, "delta": {"content": "".join(pieces[sent:due])}, "finish_reason": None}]}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            sent = due
+            if sent < len(pieces):
+                await asyncio.sleep(0.02)
+        final = {"choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}], "usage": usage}
+        await response.write(f"data: {json.dumps(final)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'injected_429': self.injected_429,
+            'injected_5xx': self.injected_5xx,
+            'malformed': self.malformed,
+            'batched_requests': self.batched_requests,
+            'cached_tokens': self.cached_tokens,
+            'peak_in_flight': self.peak_in_flight
+        }
+
+
+def create_app(mock: MockOpenRouter) -> web.Application:
+    app = web.Application()
+    app.router.add_post("/chat/completions", mock.handle_chat)
+    app.router.add_post("/api/v1/chat/completions", mock.handle_chat)
+    # OpenAI-style batch API
+    app.router.add_post("/files", mock.handle_upload)
+    app.router.add_get("/files/{file_id}/content", mock.handle_file_content)
+    app.router.add_post("/batches", mock.handle_create_batch)
+    app.router.add_get("/batches/{batch_id}", mock.handle_get_batch)
+    return app
+
+
+async def start_mock_server(config: MockConfig, host: str = "127.0.0.1", port: int = 0):
+    """Start the mock in the current event loop; returns (runner, base_url, mock)"""
+    mock = MockOpenRouter(config)
+    # Like a real provider, abandon a request when the client hangs up
+    runner = web.AppRunner(create_app(mock), handler_cancellation=True)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://{host}:{port}", mock
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    """Mock behaviour flags, shared with the load-test driver"""
+    parser.add_argument('--latency', choices=['constant', 'uniform', 'lognormal'], default='constant',
+                        help='Distribution of the delay before the first token (default: constant)')
+    parser.add_argument('--latency-mean', type=float, default=0.05,
+                        help='Mean (median for lognormal) delay in seconds (default: 0.05)')
+    parser.add_argument('--latency-sigma', type=float, default=0.5,
+                        help='Spread of the delay distribution (default: 0.5)')
+    parser.add_argument('--tokens-per-second', type=float, default=0.0,
+                        help='Completion throughput per request, 0 for instant (default: 0)')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--rate-5xx', type=float, default=0.0, help='Fraction of requests answered with 5xx')
+    parser.add_argument('--rate-malformed', type=float, default=0.0,
+                        help='Fraction of replies that leave out their code / outputs block')
+    parser.add_argument('--malformed-models', nargs='+', default=(),
+                        help='Models whose replies always leave out their code / outputs block')
+    parser.add_argument('--retry-after', type=float, default=1.0, help='Retry-After seconds sent with 429s')
+    parser.add_argument('--reply', type=str, default=None, help='Fixed reply instead of persona templates')
+    parser.add_argument('--seed', type=int, default=None, help='Random seed for reproducible runs')
+
+
+def config_from_args(args) -> MockConfig:
+    return MockConfig(
+        latency=args.latency,
+        latency_mean=args.latency_mean,
+        latency_sigma=args.latency_sigma,
+        tokens_per_second=args.tokens_per_second,
+        rate_429=args.rate_429,
+        rate_5xx=args.rate_5xx,
+        retry_after=args.retry_after,
+        rate_malformed=args.rate_malformed,
+        malformed_models=tuple(args.malformed_models),
+        reply=args.reply,
+        seed=args.seed
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local OpenRouter-compatible mock server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    print(f"Mock OpenRouter listening on http://{args.host}:{args.port}")
+    web.run_app(create_app(MockOpenRouter(config_from_args(args))), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()